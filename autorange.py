@@ -0,0 +1,136 @@
+'''
+Gate time control for the reciprocal counter
+
+The gate state machine reloads its gate length from the OSR at the start of
+every measurement, so a new length can be pushed into its TX FIFO and pulled
+into the OSR between measurements without stopping the counter.
+
+Below PERIOD_MODE_BELOW_HZ, GateControl can also hand over to a
+period.PeriodCounter on the same input, and back again above
+PERIOD_MODE_ABOVE_HZ.
+'''
+from reciprocal_counter import load_gate, stop_sm, restart_sm
+from constants import PIO_FREQ, \
+  AUTO_RANGE_DIGITS, AUTO_RANGE_MIN_GATE_MS, AUTO_RANGE_MAX_GATE_MS, \
+  PERIOD_MODE_BELOW_HZ, PERIOD_MODE_ABOVE_HZ
+
+def count_digits(n):
+  '''Number of decimal digits in a non-negative integer (1 for 0)'''
+  digits = 1
+  while n >= 10:
+    n //= 10
+    digits += 1
+  return digits
+
+class GateControl():
+  '''
+  Owns the gate SM's gate length, optionally auto-ranging it from each reading.
+  Given the clock and pulse SMs as `counters`, can also park and resume the counter,
+  and given a PeriodCounter as `period`, switch to and from period mode by frequency.
+  `wide` must match the gate SM's program (see reciprocal_counter.init_sm).
+  `handler` is the gate SM's IRQ handler, for burst.BurstCapture to detach and restore.
+  '''
+  def __init__(self, sm_gate, cycles, auto=False, digits=AUTO_RANGE_DIGITS,
+               min_gate_ms=AUTO_RANGE_MIN_GATE_MS, max_gate_ms=AUTO_RANGE_MAX_GATE_MS,
+               freq=PIO_FREQ, counters=None, period=None,
+               period_below_hz=PERIOD_MODE_BELOW_HZ, period_above_hz=PERIOD_MODE_ABOVE_HZ,
+               wide=False, handler=None):
+    self.sm = sm_gate
+    self.wide = wide
+    self.handler = handler
+    self.counters = counters
+    self.period = period
+    self.period_mode = False
+    self.period_below = 10 * period_below_hz  # decihertz
+    self.period_above = 10 * period_above_hz
+    self.cycles = cycles
+    self.auto = auto
+    self.digits = digits
+    self.freq = freq
+    self.min_cycles = freq * min_gate_ms // 1000
+    self.max_cycles = freq * max_gate_ms // 1000
+    self.changes = 0
+
+  @property
+  def gate_ms(self):
+    return 1000 * self.cycles // self.freq
+
+  def set_cycles(self, cycles):
+    '''Load a new gate length, taking effect from the next measurement'''
+    if cycles == self.cycles:
+      return
+    load_gate(self.sm, cycles, self.wide)
+    self.cycles = cycles
+    self.changes += 1
+
+  def cycles_for(self, decihertz):
+    '''
+    Shortest gate that resolves the reading to the target number of digits.
+
+    Reciprocal counting syncs the gate to input edges, so resolution is set by
+    the clock count alone, which only counts every other PIO cycle: a gate of
+    2 * 10**n cycles resolves 1 part in 10**n. There's no point resolving
+    more digits than the display shows (one decimal place under 10 kHz,
+    whole Hz above, 6 significant figures in scientific notation from 100 MHz).
+    '''
+    if decihertz >= 1_000_000_000:
+      shown = 6
+    elif decihertz >= 100_000:
+      shown = count_digits(decihertz // 10)
+    else:
+      shown = count_digits(decihertz)
+    cycles = 2 * 10 ** min(self.digits, shown)
+    return max(self.min_cycles, min(cycles, self.max_cycles))
+
+  def park(self):
+    '''Stop all the counter state machines'''
+    stop_sm(self.sm, *self.counters)
+    if self.period is not None:
+      self.period.stop()
+
+  def resume(self):
+    '''Restart parked state machines in the current mode, with the current gate length'''
+    if self.period_mode:
+      self.period.start()
+    else:
+      restart_sm(self.sm, *self.counters, self.cycles, self.wide)
+
+  def set_period_mode(self, period_mode):
+    if period_mode == self.period_mode:
+      return
+    self.park()
+    self.period_mode = period_mode
+    self.resume()
+    self.changes += 1
+
+  def update(self, decihertz):
+    '''
+    Switch between gated and period mode, with hysteresis, and pick the next
+    gate length when auto-ranging, from the latest reading
+    '''
+    if self.period is not None:
+      if self.period_mode:
+        if decihertz > self.period_above:
+          self.set_period_mode(False)
+        return
+      if decihertz < self.period_below:
+        self.set_period_mode(True)
+        return
+    if self.auto:
+      self.set_cycles(self.cycles_for(decihertz))
+
+def test_cycles_for():
+  gate = GateControl(None, 0, digits=8, min_gate_ms=0, max_gate_ms=10_000, freq=125_000_000)
+  # 9999.9 Hz shows 5 digits, 10 kHz and 1 MHz only whole Hz, 5 and 7 digits
+  assert gate.cycles_for(99_999) == 2 * 10 ** 5
+  assert gate.cycles_for(100_000) == 2 * 10 ** 5
+  assert gate.cycles_for(10_000_000) == 2 * 10 ** 7
+  # and 100 MHz shows 6 figures
+  assert gate.cycles_for(1_000_000_000) == 2 * 10 ** 6
+  # by default, 10 kHz needs no more than the shortest gate, 1 MHz 160 ms
+  gate = GateControl(None, 0, freq=125_000_000)
+  assert gate.cycles_for(100_000) == gate.min_cycles == 1_250_000
+  assert gate.cycles_for(10_000_000) == 20_000_000
+
+if __name__ == '__main__':
+  test_cycles_for()
@@ -0,0 +1,272 @@
+'''
+Benchmarks of the measurement to display pipeline
+
+Times the frequency calculation and formatting in util.py and the rendering
+and refresh in display.py, against a transport that records the SPI traffic
+instead of driving pins, so it runs the same on CPython and the MicroPython
+Unix port:
+
+    python benchmark.py
+    micropython benchmark.py
+    python benchmark.py --save  # keep these results as the baseline
+    python benchmark.py --tolerance=0.4  # on a busy machine
+
+Reports operations per second, heap bytes allocated per operation and SPI
+bytes sent per operation, and exits with status 1 if anything regressed
+against the baseline in BASELINE for the platform it runs on, e.g.
+'micropython-rp2-32bit' for the board: allocations or SPI bytes grew at all,
+or ops/sec fell by more than TOLERANCE. Allocations are only counted on
+MicroPython, whose heap is the one that matters (CPython frees the
+temporaries at once). Throughput depends on the machine, so each baseline
+records where it was captured; --save one on the machine you compare on.
+'''
+import gc
+import json
+import os
+import sys
+import time
+
+from display import Display
+from util import calculate_frequency, calculate_decihertz, calculate_decihertz_and_display, format_frequency, \
+  encode_decihertz, test_frequencies, test_raw_data
+
+BASELINE = 'benchmark_baseline.json'
+TOLERANCE = 0.25  # fraction of the baseline ops/sec that may be lost to noise
+RUN_US = 50_000  # time each run of a benchmark for at least this long
+RUNS = 10  # and keep the fastest, the one least disturbed by everything else running
+BATCH = 50  # operations between clock reads
+COUNT_OPS = 2 * len(test_frequencies)  # operations counted for allocations and SPI bytes
+
+try:
+  ticks_us, ticks_diff = time.ticks_us, time.ticks_diff
+except AttributeError:
+  def ticks_us():
+    return time.perf_counter_ns() // 1000
+
+  def ticks_diff(a, b):
+    return a - b
+
+class RecordingTransport():
+  '''Display transport that counts what would have gone over the bus'''
+  def __init__(self):
+    self.spi = self
+    self.bytes = 0
+    self.transactions = 0
+
+  def write(self, buf):
+    self.bytes += len(buf)
+    self.transactions += 1
+
+  async def awrite(self, buf):
+    self.write(buf)
+
+texts = [format_frequency(f) for f in test_frequencies]
+
+# Each benchmark sets up with a fresh Display and returns op(i), which does the
+# i'th of a repeating sequence of operations; consecutive ones differ.
+def bench_calculate_frequency(disp):
+  def op(i):
+    clock, pulse = test_raw_data[i % len(test_raw_data)]
+    calculate_frequency(clock, pulse)
+  return op
+
+def bench_calculate_decihertz(disp):
+  def op(i):
+    clock, pulse = test_raw_data[i % len(test_raw_data)]
+    calculate_decihertz(clock, pulse)
+  return op
+
+def bench_calculate_decihertz_and_display(disp):
+  '''Both values a reading needs in the default 'raw' DISPLAY_MODE'''
+  def op(i):
+    clock, pulse = test_raw_data[i % len(test_raw_data)]
+    calculate_decihertz_and_display(clock, pulse)
+  return op
+
+def bench_format_frequency(disp):
+  def op(i):
+    format_frequency(test_frequencies[i % len(test_frequencies)])
+  return op
+
+def bench_encode_decihertz(disp):
+  decihertz = [int(f * 10 + 0.5) for f in test_frequencies]
+  buf = bytearray(8)
+
+  def op(i):
+    encode_decihertz(decihertz[i % len(decihertz)], buf)
+  return op
+
+def bench_symbolize(disp):
+  def op(i):
+    for _ in disp.symbolize(texts[i % len(texts)]):
+      pass
+  return op
+
+def bench_merge_dots(disp):
+  symbols = [[next(disp.symbolize(char)) for char in text] for text in texts]
+
+  def op(i):
+    for _ in disp.merge_dots(symbols[i % len(symbols)]):
+      pass
+  return op
+
+def bench_render(disp):
+  symbols = [list(disp.symbolize(text)) for text in texts]
+
+  def op(i):
+    disp.render(symbols[i % len(symbols)])
+  return op
+
+def bench_display(disp):
+  '''A full display() refresh from a string, as for idle and messages'''
+  def op(i):
+    disp.display(texts[i % len(texts)])
+  return op
+
+def bench_display_code_b(disp):
+  '''Encode and refresh, as output.LocalOutput does for each reading on the output core'''
+  decihertz = [int(f * 10 + 0.5) for f in test_frequencies]
+  buf = bytearray(8)
+
+  def op(i):
+    disp.display_code_b(encode_decihertz(decihertz[i % len(decihertz)], buf))
+  return op
+
+BENCHMARKS = (
+  ('calculate_frequency', bench_calculate_frequency),
+  ('calculate_decihertz', bench_calculate_decihertz),
+  ('calculate_decihertz_and_display', bench_calculate_decihertz_and_display),
+  ('format_frequency', bench_format_frequency),
+  ('encode_decihertz', bench_encode_decihertz),
+  ('symbolize', bench_symbolize),
+  ('merge_dots', bench_merge_dots),
+  ('render', bench_render),
+  ('display', bench_display),
+  ('display_code_b', bench_display_code_b),
+)
+
+def measure(setup):
+  '''
+  A benchmark's op, and its result: heap bytes per op (None off MicroPython)
+  and SPI bytes per op, with ops/sec left for timed() to fill in
+  '''
+  transport = RecordingTransport()
+  op = setup(Display(0, 0, 0, transport=transport))
+  # start each count from the same state: the op before the first
+  op(-1)
+  sent = transport.bytes
+  alloc = None
+  if hasattr(gc, 'mem_alloc'):
+    gc.collect()
+    gc.disable()
+    try:
+      before = gc.mem_alloc()
+      for i in range(COUNT_OPS):
+        op(i)
+      alloc = round((gc.mem_alloc() - before) / COUNT_OPS, 1)
+    finally:
+      gc.enable()
+  else:
+    for i in range(COUNT_OPS):
+      op(i)
+  spi_bytes = round((transport.bytes - sent) / COUNT_OPS, 2)
+  return op, {'ops_per_s': 0, 'alloc_bytes': alloc, 'spi_bytes': spi_bytes}
+
+def timed(op):
+  '''ops/sec of one run'''
+  gc.collect()
+  ops = 0
+  start = ticks_us()
+  while True:
+    for i in range(ops, ops + BATCH):
+      op(i)
+    ops += BATCH
+    elapsed = ticks_diff(ticks_us(), start)
+    if elapsed >= RUN_US:
+      return ops * 1_000_000 // elapsed
+
+def platform():
+  '''Baseline key: heap use depends on the implementation and its word size, speed on the port'''
+  return f"{sys.implementation.name}-{sys.platform}-{64 if sys.maxsize > 1 << 32 else 32}bit"
+
+def provenance():
+  '''Where a baseline is being captured, saved along with it'''
+  version = '.'.join(str(n) for n in sys.implementation.version[:3])
+  source = {'implementation': f"{sys.implementation.name} {version}", 'platform': sys.platform}
+  try:
+    source['machine'] = os.uname().machine
+  except AttributeError:
+    pass
+  year, month, day = time.localtime()[:3]
+  source['date'] = f"{year:04}-{month:02}-{day:02}"
+  return source
+
+def regressions(results, baseline, tolerance=TOLERANCE):
+  '''(name, what, baseline, now) for every result worse than the baseline'''
+  found = []
+  for name, result in results.items():
+    base = baseline.get(name)
+    if base is None:
+      continue
+    if base.get('ops_per_s') and result['ops_per_s'] < base['ops_per_s'] * (1 - tolerance):
+      found.append((name, 'ops/s', base['ops_per_s'], result['ops_per_s']))
+    for key in ('alloc_bytes', 'spi_bytes'):
+      if result[key] is not None and base.get(key) is not None and result[key] > base[key]:
+        found.append((name, key, base[key], result[key]))
+  return found
+
+def load_baselines(path=BASELINE):
+  try:
+    with open(path) as f:
+      return json.load(f)
+  except OSError:
+    return {}
+
+def main(argv):
+  key = platform()
+  baselines = load_baselines()
+  baseline = baselines.get(key)
+  if baseline is not None:
+    source = baseline['source']
+    print(f"Baseline {key}: " + ', '.join(str(value) for value in source.values()))
+    baseline = baseline['results']
+  results = {}
+  ops = []
+  for name, setup in BENCHMARKS:
+    op, results[name] = measure(setup)
+    ops.append((op, results[name]))
+  # each benchmark's runs are spread over the whole suite, so one busy spell can't slow them all
+  for _ in range(RUNS):
+    for op, result in ops:
+      result['ops_per_s'] = max(result['ops_per_s'], timed(op))
+  print(f"{'benchmark':<32}{'ops/s':>12}{'vs base':>9}{'alloc B/op':>12}{'SPI B/op':>10}")
+  for name, _ in BENCHMARKS:
+    result = results[name]
+    alloc = '-' if result['alloc_bytes'] is None else f"{result['alloc_bytes']:.1f}"
+    base = None if baseline is None else baseline.get(name)
+    ratio = '-' if not (base and base['ops_per_s']) else f"{result['ops_per_s'] / base['ops_per_s']:.2f}x"
+    print(f"{name:<32}{result['ops_per_s']:>12.0f}{ratio:>9}{alloc:>12}{result['spi_bytes']:>10.1f}")
+
+  if '--save' in argv:
+    baselines[key] = {'source': provenance(), 'results': results}
+    with open(BASELINE, 'w') as f:
+      json.dump(baselines, f)
+      f.write('\n')
+    print(f"Saved the {key} baseline to {BASELINE}")
+    return 0
+  if baseline is None:
+    print(f"No {key} baseline in {BASELINE}, run with --save to keep one")
+    return 0
+  tolerance = TOLERANCE
+  for arg in argv:
+    if arg.startswith('--tolerance='):
+      tolerance = float(arg.split('=', 1)[1])
+  found = regressions(results, baseline, tolerance)
+  for name, what, before, now in found:
+    print(f"REGRESSION {name} {what}: {before:.1f} -> {now:.1f}")
+  if not found:
+    print(f"No regressions against the {key} baseline")
+  return 1 if found else 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
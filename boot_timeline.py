@@ -0,0 +1,30 @@
+'''
+Boot timeline: time from power-up to the first reading
+
+mark() notes time.ticks_ms(), which the rp2 port counts from power-up, at
+each boot milestone, and done() closes the timeline at the first reading,
+printing it if asked to. Later calls cost a single test. Only imports time,
+so main.py can mark before anything else is imported.
+'''
+import time
+
+_marks = []
+
+def mark(name):
+  if _marks is not None:
+    _marks.append((name, time.ticks_ms()))
+
+def done(name, report=True):
+  '''Mark the last milestone, and print the timeline the first time'''
+  global _marks
+  if _marks is None:
+    return
+  mark(name)
+  if report:
+    print("Boot timeline (ms since power-up):")
+    last = None
+    for name, ms in _marks:
+      delta = '' if last is None else f" (+{time.ticks_diff(ms, last)})"
+      print(f"  {ms:6d}  {name}{delta}")
+      last = ms
+  _marks = None
@@ -0,0 +1,129 @@
+'''
+DMA burst capture of short-gate measurements, for frequency-vs-time transients
+
+Normally each measurement is read out of the clock and pulse state machines'
+FIFOs by the counter IRQ handler, so the measurement rate is bounded by
+MicroPython's IRQ latency. A burst instead detaches the handler and has two
+DMA channels drain the FIFOs straight into preallocated arrays, paced by the
+FIFOs' data requests, while the counter runs back to back with a short gate.
+The gate waits for its irq 0 to be acknowledged after every measurement, so
+for the burst the block's fourth state machine runs burst_ack in place of
+period mode's program to do that. The counter programs are unchanged.
+
+Once the burst is in, convert_burst turns the whole batch into counts and
+start times in one viper pass, with no Python call per measurement. Each
+gate opens on the first input edge after the previous one closed, so the
+measurements are contiguous but for one input period each.
+'''
+import asyncio
+import micropython
+import rp2
+from rp2 import asm_pio
+import sys
+import time
+import uarray as array
+
+from constants import PIO_FREQ, BURST_GATE_US, BURST_TIMEOUT_MS
+from reciprocal_counter import restart_sm, period, init_period_sm
+
+PIO_BASES = (0x50200000, 0x50300000)
+PIO_RXF0 = 0x20  # RX FIFO of state machine 0, then 1-3 every 4 bytes
+DREQ_PIO_RX0 = (4, 12)  # data request of state machine 0's RX FIFO, per PIO block
+DMA_SIZE_WORD = 2
+BURST_POLL_MS = 5
+
+@asm_pio()
+def burst_ack():
+  '''
+  Acknowledges the gate SM's irq 0 in place of the counter IRQ handler, so the
+  gate runs back to back. One instruction, to fit in place of period().
+  '''
+  wait(1, irq, 0)  # waiting on the flag also clears it
+
+@micropython.viper
+def convert_burst(clock, pulse, start, n: int, prescale: int):
+  # In place, raw clock and pulse counts to counts (as util.convert_*), times
+  # `prescale` for pulses, and each measurement's start in clock cycles from
+  # the first into `start`. Machine word arithmetic: gates under 2**31 cycles.
+  c = ptr32(clock)
+  p = ptr32(pulse)
+  t = ptr32(start)
+  zero = uint(0)
+  now = zero
+  for i in range(n):
+    clocks = uint(zero - uint(c[i]))  # MAX_COUNT - raw + 1
+    clocks += clocks
+    pulses = uint(zero - uint(p[i]) - uint(1))  # MAX_COUNT - raw
+    c[i] = clocks
+    p[i] = pulses * uint(prescale)
+    t[i] = now
+    # the next gate opens on the input edge after this one closes
+    now += clocks + uint(int(clocks) // int(pulses))  # viper only divides signed ints
+
+class BurstCapture():
+  '''
+  Captures bursts of up to `size` measurements from the counter driven by the
+  GateControl `gate` on PIO block `pio` and `input_pin`, scaling pulses by `prescale`.
+  Not for wide counters: the arrays hold 32 bit counts.
+  '''
+  def __init__(self, gate, size, input_pin, pio=0, prescale=1):
+    assert not gate.wide
+    self.gate = gate
+    self.size = size
+    self.input_pin = input_pin
+    self.pio = pio
+    self.prescale = prescale
+    self.clock = array.array("I", [0] * size)
+    self.pulse = array.array("I", [0] * size)
+    self.start = array.array("I", [0] * size)
+    self.count = 0  # measurements in the last burst
+    base = PIO_BASES[pio] + PIO_RXF0
+    dreq = DREQ_PIO_RX0[pio]
+    # clock_count is state machine 1 of the block, pulse_count 2
+    self._channels = []
+    for sm_index, buf in ((1, self.clock), (2, self.pulse)):
+      dma = rp2.DMA()
+      ctrl = dma.pack_ctrl(size=DMA_SIZE_WORD, inc_read=False, inc_write=True, treq_sel=dreq + sm_index)
+      self._channels.append((dma, base + 4 * sm_index, buf, ctrl))
+
+  async def capture(self, gate_us=BURST_GATE_US, count=None, timeout_ms=BURST_TIMEOUT_MS):
+    '''
+    Capture `count` (default `size`) measurements with a `gate_us` gate, then
+    resume normal counting. Returns the number captured, fewer on timeout.
+    '''
+    count = self.size if count is None else min(count, self.size)
+    gate = self.gate
+    gate.park()
+    gate.sm.irq(None)
+    # swap period mode's program for the acknowledger: PIO memory only fits one
+    pio = rp2.PIO(self.pio)
+    pio.remove_program(period)
+    ack = rp2.StateMachine(4 * self.pio + 3, burst_ack, freq=PIO_FREQ)
+    for dma, fifo, buf, ctrl in self._channels:
+      dma.config(read=fifo, write=buf, count=count, ctrl=ctrl, trigger=True)
+    ack.active(1)
+    restart_sm(gate.sm, *gate.counters, PIO_FREQ * gate_us // 1_000_000)
+    started = time.ticks_ms()
+    while any(dma.active() for dma, _, _, _ in self._channels):
+      if time.ticks_diff(time.ticks_ms(), started) >= timeout_ms:
+        break
+      await asyncio.sleep_ms(BURST_POLL_MS)
+    gate.park()
+    ack.active(0)
+    pio.remove_program(burst_ack)
+    if gate.period is not None:
+      gate.period.sm = init_period_sm(PIO_FREQ, self.input_pin, self.pio)
+    # measurements both channels finished moving
+    self.count = count - max(dma.count for dma, _, _, _ in self._channels)
+    for dma, _, _, _ in self._channels:
+      dma.active(0)
+    convert_burst(self.clock, self.pulse, self.start, self.count, self.prescale)
+    gate.sm.irq(gate.handler)
+    gate.resume()
+    return self.count
+
+  def dump(self, stream=sys.stdout):
+    '''Write the last burst as CSV'''
+    stream.write("i,start_cycles,clock_count,pulse_count\n")
+    for i in range(self.count):
+      stream.write(f"{i},{self.start[i]},{self.clock[i]},{self.pulse[i]}\n")
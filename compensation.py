@@ -0,0 +1,160 @@
+'''
+Temperature compensation of the crystal timebase
+
+The crystal's frequency drifts by several ppm across the enclosure's
+temperature range. A Compensator reads the RP2040's internal temperature
+sensor every COMPENSATION_INTERVAL_MS, interpolates the calibration table
+captured for this board and publishes the matching correction through
+util.set_correction. Measurements only ever read the cached correction, so
+compensation costs them nothing beyond the multiply CORRECTION already took.
+
+The table is a JSON list of [centidegrees C, correction in ppb] points in
+COMPENSATION_TABLE on flash, captured by capture_calibration against a known
+reference frequency while the board is swept through its temperature range.
+'''
+import asyncio
+import json
+import machine
+import time
+
+import util
+from constants import PIO_FREQ, COMPENSATION_TABLE, COMPENSATION_INTERVAL_MS, COMPENSATION_SAMPLES, \
+  CALIBRATION_STEP_C
+from util import convert_clock_count, convert_pulse_count
+
+PPB = 1_000_000_000
+ADC_CORE_TEMP = 4  # ADC input wired to the internal temperature sensor
+CALIBRATION_SAVE_MS = 60_000
+
+def read_temperature(adc, samples=COMPENSATION_SAMPLES):
+  '''Die temperature in hundredths of a degree C, averaged over `samples` ADC reads'''
+  total = 0
+  for _ in range(samples):
+    total += adc.read_u16()
+  microvolts = total * 3_300_000 // (samples * 65535)
+  # 0.706 V at 27 C, falling 1.721 mV per degree (RP2040 datasheet 4.9.5)
+  return 2700 - (microvolts - 706_000) * 100 // 1721
+
+def interpolate(points, temperature):
+  '''Correction in ppb at `temperature`, linear between sorted points, held beyond the ends'''
+  if temperature <= points[0][0]:
+    return points[0][1]
+  for (t0, ppb0), (t1, ppb1) in zip(points, points[1:]):
+    if temperature <= t1:
+      return ppb0 + (ppb1 - ppb0) * (temperature - t0) // (t1 - t0)
+  return points[-1][1]
+
+def load_table(path=COMPENSATION_TABLE):
+  '''The captured table's sorted points, or None if there isn't one'''
+  try:
+    with open(path) as f:
+      points = json.load(f)
+  except OSError:
+    return None
+  return sorted(tuple(point) for point in points) or None
+
+def save_table(points, path=COMPENSATION_TABLE):
+  with open(path, 'w') as f:
+    json.dump([list(point) for point in points], f)
+
+class Compensator():
+  '''Keeps util's timebase correction matched to the temperature, per a captured table'''
+  def __init__(self, points, adc=None, samples=COMPENSATION_SAMPLES):
+    self.points = points
+    self.adc = machine.ADC(ADC_CORE_TEMP) if adc is None else adc
+    self.samples = samples
+    self.temperature = None  # centidegrees C
+    self.ppb = None
+
+  def update(self):
+    '''Read the temperature and publish the correction for it'''
+    self.temperature = read_temperature(self.adc, self.samples)
+    self.ppb = interpolate(self.points, self.temperature)
+    util.set_correction(PPB + self.ppb, PPB)
+
+  async def run(self, interval_ms=COMPENSATION_INTERVAL_MS):
+    while True:
+      self.update()
+      await asyncio.sleep_ms(interval_ms)
+
+def measurement_ppb(clock_raw, pulse_raw, reference_hz, freq=PIO_FREQ):
+  '''Correction in ppb that makes a measurement of a `reference_hz` input read exactly that'''
+  denominator = freq * convert_pulse_count(pulse_raw)
+  numerator = PPB * reference_hz * convert_clock_count(clock_raw)
+  return (2 * numerator + denominator) // (2 * denominator) - PPB
+
+class Calibration():
+  '''Accumulates measurements of a reference into mean corrections per temperature step'''
+  def __init__(self, reference_hz, step_c=CALIBRATION_STEP_C, points=None):
+    self.reference_hz = reference_hz
+    self.step = 100 * step_c  # centidegrees
+    # step index: [sum of ppb, measurements], seeded from an earlier capture
+    self.bins = {t // self.step: [ppb, 1] for t, ppb in points or ()}
+
+  def add(self, clock_raw, pulse_raw, temperature):
+    '''Add one measurement taken at `temperature` (centidegrees); returns its ppb'''
+    ppb = measurement_ppb(clock_raw, pulse_raw, self.reference_hz)
+    # round to the nearest step
+    i = (temperature + self.step // 2) // self.step
+    acc = self.bins.get(i)
+    if acc is None:
+      self.bins[i] = [ppb, 1]
+    else:
+      acc[0] += ppb
+      acc[1] += 1
+    return ppb
+
+  def points(self):
+    return [(i * self.step, total // n) for i, (total, n) in sorted(self.bins.items())]
+
+async def capture_calibration(queue, reference_hz, path=COMPENSATION_TABLE, adc=None,
+                              save_ms=CALIBRATION_SAVE_MS):
+  '''
+  Build the compensation table from measurements of a known `reference_hz` on
+  the input, adding to any table already at `path`. Runs until reset, saving
+  the table every `save_ms`: sweep the board's temperature meanwhile.
+  '''
+  adc = machine.ADC(ADC_CORE_TEMP) if adc is None else adc
+  calibration = Calibration(reference_hz, points=load_table(path))
+  saved = time.ticks_ms()
+  print(f"Capturing temperature compensation against {reference_hz} Hz into {path}...")
+  while True:
+    await queue.flag.wait()
+    temperature = read_temperature(adc)
+    while not queue.empty():
+      clock_raw, pulse_raw, _ = queue.get()
+      ppb = calibration.add(clock_raw, pulse_raw, temperature)
+      print(f"{temperature / 100:.2f} C: {ppb} ppb")
+    if time.ticks_diff(time.ticks_ms(), saved) >= save_ms:
+      save_table(calibration.points(), path)
+      saved = time.ticks_ms()
+      print(f"Saved {len(calibration.bins)} table entries")
+
+def test_interpolate():
+  points = [(-1000, 4000), (2500, 0), (6000, -3000)]
+  assert interpolate(points, -2000) == 4000
+  assert interpolate(points, 2500) == 0
+  assert interpolate(points, 750) == 2000
+  assert interpolate(points, 4250) == -1500
+  assert interpolate(points, 9000) == -3000
+  assert interpolate([(2500, 7)], 0) == 7
+
+def test_calibration():
+  from util import unconvert_clock_count, unconvert_pulse_count, calculate_decihertz
+  saved = util.correction
+  # a crystal running 5 ppm slow: a 10 MHz reference reads 50 Hz high
+  clock, pulse = unconvert_clock_count(PIO_FREQ), unconvert_pulse_count(10_000_050)
+  calibration = Calibration(10_000_000)
+  assert calibration.add(clock, pulse, 2480) == -5000
+  calibration.add(clock, pulse, 2560)
+  calibration.add(clock, pulse, 3030)
+  assert calibration.points() == [(2400, -5000), (2600, -5000), (3000, -5000)]
+  try:
+    util.set_correction(PPB + interpolate(calibration.points(), 2700), PPB)
+    assert calculate_decihertz(clock, pulse) == 100_000_000
+  finally:
+    util.set_correction(*saved)
+
+if __name__ == '__main__':
+  test_interpolate()
+  test_calibration()
@@ -10,15 +10,55 @@ CS = 12
 CK = 13
 
 DISPLAY_INTENSITY = 50  # %
+DISPLAY_SPI_BAUDRATE = 10_000_000  # hardware SPI, if MOSI and CK are a TX and SCK pin, e.g. CK = 10
+DISPLAY_SOFT_SPI_BAUDRATE = 1_000_000  # otherwise
+# SoftSPI insists on a MISO though the display is TX-only; a pin nothing else uses
+DISPLAY_MISO = 22
+DISPLAY_CHAIN = 1  # MAX7219s daisy-chained on the display bus; with more, each channel gets one
+BOOT_DISPLAY_TEST_MS = 500  # all segments lit at boot; hold BOOTSEL then to run the display test
 
 # Frequency counter config
-PIO_FREQ = 125_000_000
-# TODO: Add temperature compensation per RP2040 internal temp sensor
+# The timebase: every clock rate and gate length derives from SYS_FREQ, set at boot by
+# timebase.py. Overclocking scales the resolution of a gate of a given length with it.
+SYS_FREQ = 125_000_000  # e.g. 200_000_000 or 250_000_000; must be reachable by the PLL
+OVERCLOCK_VREG_ABOVE_HZ = 200_000_000  # raise the core voltage to 1.15 V above this
+PIO_FREQ = SYS_FREQ  # the counter state machines run undivided, at the highest rate
+GATE_MS = 100
+# crystal correction at room temperature, used until a compensation table is captured
 # read 9998082 @ correction == 1, oscope reads 9.9985 MHz
 # (9998082./9998500)**-1 = 1.000041808018778
-CORRECTION = 1.00004
-GATE_CYCLES = int(PIO_FREQ // 10)  # i.e. 100 ms gate time
+# kept as an exact ratio so frequencies can be computed in integer arithmetic
+# n.b. a crystal error, so it holds at any SYS_FREQ the PLL multiplies the crystal up to
+CORRECTION_NUM = 100_004
+CORRECTION_DEN = 100_000
+CORRECTION = CORRECTION_NUM / CORRECTION_DEN
+GATE_CYCLES = PIO_FREQ * GATE_MS // 1000
 MAX_COUNT = const((1 << 32) - 1)  # i.e. 0xffff ffff
+# Wide counting carries counts into a high word, for gates over 2**32 cycles (34 s at
+# 125 MHz, 17 s at 250 MHz) or over 2**32 input pulses; uses all of PIO memory, so no period mode
+WIDE_COUNT = False
+MAX_WIDE_COUNT = (1 << 64) - 1
+
+# Temperature compensation of the crystal from the RP2040's internal sensor, see compensation.py
+COMPENSATION = True  # apply COMPENSATION_TABLE instead of CORRECTION, if it has been captured
+COMPENSATION_TABLE = 'compensation.json'  # on the board's flash filesystem
+COMPENSATION_INTERVAL_MS = 10_000  # how often to re-read the temperature
+COMPENSATION_SAMPLES = 64  # ADC reads averaged per temperature reading
+# to capture a table, feed the input a reference frequency, set this to it, and sweep temperature
+CALIBRATION_REFERENCE_HZ = 0
+CALIBRATION_STEP_C = 2  # temperature spacing of captured table entries
+
+# Auto-ranging picks each gate time from the previous reading instead of GATE_CYCLES
+AUTO_RANGE = False
+AUTO_RANGE_DIGITS = 7  # target resolution, significant digits
+AUTO_RANGE_MIN_GATE_MS = 10
+AUTO_RANGE_MAX_GATE_MS = 1000  # i.e. max update latency
+
+# Period mode times every input period instead of gating, for low frequencies, see period.py
+PERIOD_MODE = True  # switch automatically by the measured frequency
+PERIOD_MODE_BELOW_HZ = 10  # switch to period mode below this
+PERIOD_MODE_ABOVE_HZ = 20  # and back to gated counting above this
+PERIOD_POLL_MS = 20  # how often to collect edge timestamps
 
 COUNTER_INPUT_PIN = 10
 # Counter input pin must be the next pin after the gate pin,
@@ -26,7 +66,48 @@ COUNTER_INPUT_PIN = 10
 COUNTER_GATE_PIN = COUNTER_INPUT_PIN - 1
 COUNTER_PULSE_FIN_PIN = 8
 
+# Optional second, independent counter channel (B) on PIO1, with its own pins
+COUNTER_CHANNELS = 1  # 2 to also measure on COUNTER_B_INPUT_PIN
+COUNTER_B_INPUT_PIN = 16
+COUNTER_B_GATE_PIN = COUNTER_B_INPUT_PIN - 1
+COUNTER_B_PULSE_FIN_PIN = 14
+DISPLAY_CHANNEL = 0  # channel shown on the LED display, all channels are printed
+
+# High frequency input, divided down by a PWM slice before counting, see prescaler.py
+HF_INPUT = False  # measure on HF_INPUT_PIN instead of COUNTER_INPUT_PIN
+HF_INPUT_PIN = 21  # must be odd, a PWM slice's B pin
+HF_PRESCALE = 8  # even, up to 65536
+# the counter then measures the prescaled signal on HF_INPUT_PIN - 1
+HF_GATE_PIN = HF_INPUT_PIN - 2
+HF_PULSE_FIN_PIN = 18
+
 # Program behavior
 IDLE_THRESHOLD_MS = 3000  # stop displaying last freq after delay w/no detected freq
 INIT_IDLE_THRESHOLD_MS = 1000  # shorter idle time when booting up
-IDLE_SLEEP_MS = 100  # time to sleep between loops when no freq detected
+# Power saving once idle, delays from going idle (0 disables), see power.py
+IDLE_DIM_MS = 10_000
+IDLE_DIM_INTENSITY = 5  # %
+IDLE_SHUTDOWN_MS = 60_000  # display off
+IDLE_LIGHTSLEEP_MS = 0  # MCU asleep until an input edge; drops USB serial, for battery units
+MEASUREMENT_RING_SIZE = 32  # raw measurements buffered between counter IRQ and display loop
+DUAL_CORE = False  # run display and serial output on core 1, measurement on core 0
+READING_RING_SIZE = 16  # readings buffered between the two cores
+SERIAL_OUTPUT = 'text'  # 'text', or 'binary' telemetry records (see telemetry.py)
+TEXT_SUMMARY_MS = 0  # print at most one reading per interval, 0 to print every reading
+LATENCY_PROFILE = False  # time each stage from counter IRQ to display, see latency.py
+BOOT_TIMELINE = True  # print the time from power-up to each boot milestone, see boot_timeline.py
+# Burst capture of back to back short-gate measurements by DMA, see burst.py
+BURST_SIZE = 0  # measurements per burst, 0 to disable; enables the 'burst' serial command
+BURST_GATE_US = 100
+BURST_TIMEOUT_MS = 5000
+# Record raw readings to a ring file on flash for replay on the host, see recorder.py
+RECORDER = False
+RECORDER_FILE = 'recording.bin'
+RECORDER_BLOCK_SIZE = 4096  # bytes per flash write, one LittleFS block
+RECORDER_BLOCKS = 16  # ring file size in blocks, i.e. 64 KB, about 2900 readings
+RECORDER_WRITE_SIZE = 256  # bytes per write() between yields to the display loop, one flash page
+
+# Statistics and display mode
+DISPLAY_MODE = 'raw'  # 'raw' reading, 'average' (moving average) or 'mean' (since last reset)
+MOVING_AVERAGE_WINDOW = 10  # readings
+ALLAN_TAUS = (1, 2, 4, 8, 16)  # Allan deviation taus, multiples of the gate time
@@ -1,92 +1,246 @@
 import asyncio
 from machine import Pin, reset
 from rp2 import bootsel_button
-from threadsafe import ThreadSafeQueue
+import micropython
+import sys
 import time
-import uarray as array
 
 from constants import \
-  PIO_FREQ, GATE_CYCLES, \
+  PIO_FREQ, GATE_CYCLES, AUTO_RANGE, \
   COUNTER_INPUT_PIN, COUNTER_GATE_PIN, COUNTER_PULSE_FIN_PIN, \
-  MOSI, CS, CK, DISPLAY_INTENSITY, \
-  IDLE_THRESHOLD_MS, INIT_IDLE_THRESHOLD_MS, IDLE_SLEEP_MS
-from display import Display
-from reciprocal_counter import init_sm
-from util import format_frequency, convert_clock_count, convert_pulse_count, calculate_frequency
+  COUNTER_CHANNELS, COUNTER_B_INPUT_PIN, COUNTER_B_GATE_PIN, COUNTER_B_PULSE_FIN_PIN, \
+  DISPLAY_CHANNEL, PERIOD_MODE, PERIOD_POLL_MS, WIDE_COUNT, \
+  COMPENSATION, CALIBRATION_REFERENCE_HZ, \
+  HF_INPUT, HF_INPUT_PIN, HF_GATE_PIN, HF_PULSE_FIN_PIN, \
+  MOSI, CS, CK, DISPLAY_MISO, DISPLAY_INTENSITY, DISPLAY_CHAIN, \
+  IDLE_THRESHOLD_MS, INIT_IDLE_THRESHOLD_MS, IDLE_DIM_MS, IDLE_SHUTDOWN_MS, IDLE_LIGHTSLEEP_MS, \
+  MEASUREMENT_RING_SIZE, RECORDER, BURST_SIZE, \
+  DISPLAY_MODE, DUAL_CORE, SERIAL_OUTPUT, LATENCY_PROFILE, BOOT_DISPLAY_TEST_MS, BOOT_TIMELINE
+import boot_timeline
+from autorange import GateControl
+from display import Display, ChainedDisplay
+from latency import QUEUE, CALCULATE
+from measurement_ring import MeasurementRing
+from output import LocalOutput, start_output_core
+from reciprocal_counter import init_sm, init_period_sm
+from stats import StreamStats
+from timebase import init_timebase
+from util import calculate_decihertz, calculate_decihertz_and_display, convert_clock_count
+
+# stage latency histograms when LATENCY_PROFILE is enabled, for inspection from the REPL
+latency = None
 
 # sanity check idle delay times
-assert IDLE_SLEEP_MS < IDLE_THRESHOLD_MS
-assert IDLE_SLEEP_MS < INIT_IDLE_THRESHOLD_MS
+assert INIT_IDLE_THRESHOLD_MS <= IDLE_THRESHOLD_MS
+# and that the display's SoftSPI MISO doesn't reconfigure a counter or prescaler pin
+assert DISPLAY_MISO not in (MOSI, CS, CK,
+                            COUNTER_INPUT_PIN, COUNTER_GATE_PIN, COUNTER_PULSE_FIN_PIN,
+                            COUNTER_B_INPUT_PIN, COUNTER_B_GATE_PIN, COUNTER_B_PULSE_FIN_PIN,
+                            HF_INPUT_PIN, HF_INPUT_PIN - 1, HF_GATE_PIN, HF_PULSE_FIN_PIN)
+
+def idle_threshold(gate_cycles):
+  '''Time (ms) without readings before the input counts as idle, for the given gate length'''
+  gate_ms = 1000 * gate_cycles // PIO_FREQ
+  # never declare idle while a long gate could still be running
+  return max(IDLE_THRESHOLD_MS, 2 * gate_ms)
 
-async def display_loop(disp, queue):
+async def display_loop(disp, queue, gate=None, stats=None, mode=DISPLAY_MODE, output=None,
+                       latency=None, power=None):
+  '''
+  Consume measurements from the queue and display them, tagged with the queue's channel.
+  `mode` picks what is displayed: the 'raw' reading, or the moving 'average' or 'mean' of `stats`.
+  `output` defaults to displaying and printing inline, see output.start_output_core.
+  `latency` is an optional LatencyProfile to record the queue and calculate stages into.
+  `power` is an optional IdlePolicy to dim, shut down and sleep while idle.
+  '''
   i = 0
+  channel = queue.channel
+  if stats is None:
+    stats = StreamStats()
+  if output is None:
+    output = LocalOutput(disp)
 
-  # if gate time is < configured idle sleep time, use half the gate time so we
-  # can keep up with counter output as it's produced
-  idle_sleep_ms = min(IDLE_SLEEP_MS, int(1000 * GATE_CYCLES / PIO_FREQ // 2))
+  gate_cycles = GATE_CYCLES if gate is None else gate.cycles
+  idle_threshold_ms = idle_threshold(gate_cycles)
+  period_mode = False
 
-  # preload the idle counter so we display idle faster when starting up
-  idle_count = int((IDLE_THRESHOLD_MS - INIT_IDLE_THRESHOLD_MS) // idle_sleep_ms)
-  idle_threshold = int(IDLE_THRESHOLD_MS // idle_sleep_ms)
+  # backdate the last reading so we display idle faster when starting up
+  last_reading_ms = time.ticks_add(time.ticks_ms(), INIT_IDLE_THRESHOLD_MS - IDLE_THRESHOLD_MS)
+  idle = False
 
-  print(f"""Starting display loop...
-  idle_sleep_ms = {idle_sleep_ms}
-  idle_threshold = {idle_threshold}
-  init idle_count = {idle_count}""")
+  print(f"""Starting display loop for channel {channel}...
+  idle_threshold_ms = {idle_threshold_ms}
+  init idle_threshold_ms = {INIT_IDLE_THRESHOLD_MS}""")
   while True:
-    # polling queue rather than using `async for ...` so we can change behavior after timeout
     if queue.empty():
-      # if we've been idle for 30 sleep cycles i.e. 3 seconds, revert display to '-'
-      if idle_count > idle_threshold:
-        disp.display('-')
-      # TODO: put display and microcontroller to sleep after enough idle cycles
-      await asyncio.sleep_ms(idle_sleep_ms)
-      idle_count += 1
+      # sleep until the counter IRQ flags a new measurement, or until it's time to go idle
+      if idle:
+        timeout_ms = None if power is None else power.timeout_ms()
+        if timeout_ms is None:
+          await queue.flag.wait()
+        elif timeout_ms == 0:
+          power.advance()
+        else:
+          try:
+            await asyncio.wait_for_ms(queue.flag.wait(), timeout_ms)
+          except asyncio.TimeoutError:
+            pass
+        continue
+      remaining_ms = idle_threshold_ms - time.ticks_diff(time.ticks_ms(), last_reading_ms)
+      if remaining_ms > 0:
+        try:
+          await asyncio.wait_for_ms(queue.flag.wait(), remaining_ms)
+        except asyncio.TimeoutError:
+          pass
+        continue
+      # no readings for e.g. 3 seconds, revert display to '-'
+      idle = True
+      output.idle(channel)
+      if stats.count:
+        print(f"Idle, channel {channel} stats: {stats.summary()}")
+        stats.reset()
+      if power is not None:
+        power.start()
       continue
-    idle_count = 0
-    clock_raw, pulse_raw = queue.get_sync(block=False)
-    freq = calculate_frequency(clock_raw, pulse_raw)
-
-    print(f"Measurement {i}")
-    print(f"  Raw data:    (clock {clock_raw}, pulse {pulse_raw})")
-    print(f"  Clock count: {convert_clock_count(clock_raw)}")
-    print(f"  Input count: {convert_pulse_count(pulse_raw)}")
-    print(f"  Frequency:   {freq} Hz")
+    if idle and power is not None:
+      power.wake()
+    idle = False
+    last_reading_ms = time.ticks_ms()
+    if latency is not None:
+      latency.queue_depth(queue.qsize(), queue.dropped)
+    clock_raw, pulse_raw, ticks_us = queue.get()
+    if latency is not None:
+      t_dequeue = time.ticks_us()
+    if mode == 'average' or mode == 'mean':
+      decihertz = calculate_decihertz(clock_raw, pulse_raw)
+      stats.add(decihertz)
+      shown = stats.moving_average() if mode == 'average' else stats.mean_decihertz()
+    else:
+      # one exact ratio, rounded once to the displayed digits, not again from decihertz
+      decihertz, shown = calculate_decihertz_and_display(clock_raw, pulse_raw)
+      stats.add(decihertz)
+    if latency is not None:
+      latency.record(QUEUE, time.ticks_diff(t_dequeue, ticks_us))
+      latency.record(CALCULATE, time.ticks_diff(time.ticks_us(), t_dequeue))
+    output.reading(i, clock_raw, pulse_raw, ticks_us, decihertz, shown, queue.dropped, queue.overflows,
+                   channel)
+    if not i:
+      boot_timeline.done('first reading', BOOT_TIMELINE)
     i += 1
-    disp.display(format_frequency(freq))
 
-def init_counter(queue):
+    if gate is not None:
+      gate.update(decihertz)
+      if gate.period_mode != period_mode:
+        period_mode = gate.period_mode
+        print(f"  Mode:        {'period' if period_mode else 'gated'}")
+        stats.reset()
+        gate_cycles = None  # recompute the idle threshold when back to gating
+      if period_mode:
+        # a reading per input period, and up to two periods for the first after switching
+        idle_threshold_ms = idle_threshold(2 * convert_clock_count(clock_raw))
+      elif gate.cycles != gate_cycles:
+        gate_cycles = gate.cycles
+        idle_threshold_ms = idle_threshold(gate_cycles)
+        print(f"  Gate:        {gate.gate_ms} ms")
+        # Allan deviation assumes a constant tau0
+        stats.reset()
+
+def init_counter(queue, pio=0, input_pin=COUNTER_INPUT_PIN, gate_pin=COUNTER_GATE_PIN,
+                 pulse_fin_pin=COUNTER_PULSE_FIN_PIN, prescaler=None):
   '''
-  Configure and start the counter PIO state machines
-  Measurement data will be pushed onto the provided queue by the counter IRQ handler.
+  Configure and start the counter PIO state machines on PIO block `pio`
+  Measurement data will be written into the provided MeasurementRing by the counter IRQ handler.
+  With a prescaler.Prescaler, input_pin must be its output pin.
+  Returns the GateControl for the running gate state machine.
   '''
-  data = array.array("I", [0, 0])
+  micropython.alloc_emergency_exception_buf(100)
 
   def counter_handler(sm):
     '''
     IRQ handler
     Pulls data from the clock and counter PIO state machines when the gate SM signals a
-    measurement is complete. Sends data into queue for consumption by display loop.
+    measurement is complete, straight into the ring for consumption by display loop.
+    n.b. must not allocate or print
     '''
-    print("IRQ")
-    data[0] = sm_clock.get() # clock count
-    data[1] = sm_count.get() # pulse count
-    print(data)
-    queue.put_sync(data)
+    queue.fill(sm_clock, sm_count)
 
   # ensure input and gate pins are correctly configured as adjacent with the gate first
   # before attempting to run state machines
-  assert COUNTER_INPUT_PIN == COUNTER_GATE_PIN + 1
+  assert input_pin == gate_pin + 1
 
-  print("Starting counter...")
+  print(f"Starting counter on PIO{pio}...")
+  input_pin = Pin(input_pin, Pin.IN, Pin.PULL_UP)
   sm_gate, sm_clock, sm_count = init_sm(
     PIO_FREQ,
-    input_pin=Pin(COUNTER_INPUT_PIN, Pin.IN, Pin.PULL_UP),
-    gate_pin=Pin(COUNTER_GATE_PIN, Pin.OUT),
-    pulse_fin_pin=Pin(COUNTER_PULSE_FIN_PIN, Pin.OUT),
+    input_pin=input_pin,
+    gate_pin=Pin(gate_pin, Pin.OUT),
+    pulse_fin_pin=Pin(pulse_fin_pin, Pin.OUT),
     gate_cycles=GATE_CYCLES,
+    pio=pio,
+    wide=WIDE_COUNT,
   )
   sm_gate.irq(counter_handler)
+  if prescaler is not None:
+    # takes over the pins from the counter's Pin setup
+    prescaler.start()
+    queue.prescale = prescaler.divisor
+  # period mode timestamps edges on the same input with the block's spare state machine,
+  # which the wide counter programs leave no instruction memory for
+  period = None
+  if PERIOD_MODE and not WIDE_COUNT:
+    from period import PeriodCounter
+    period = PeriodCounter(init_period_sm(PIO_FREQ, input_pin, pio), queue)
+  return GateControl(sm_gate, GATE_CYCLES, auto=AUTO_RANGE, counters=(sm_clock, sm_count),
+                     period=period, wide=WIDE_COUNT, handler=counter_handler)
+
+async def poll_period(period, poll_ms=PERIOD_POLL_MS):
+  '''Collect period mode measurements into the period counter's queue, while it runs'''
+  while True:
+    period.poll()
+    await asyncio.sleep_ms(poll_ms)
+
+async def serial_commands(latency, burst=None):
+  '''Answer simple commands typed on the serial console while the counter runs'''
+  reader = asyncio.StreamReader(sys.stdin)
+  while True:
+    command = (await reader.readline()).strip()
+    if latency is not None and command in (b'latency', b'l'):
+      latency.report()
+    elif latency is not None and command == b'reset':
+      latency.reset()
+      print("latency reset")
+    elif burst is not None and command in (b'burst', b'b'):
+      count = await burst.capture()
+      print(f"burst of {count} measurements")
+      burst.dump()
+
+async def run_counter(disp, queues, gates, output, latency, power, compensator=None, recorder=None,
+                      burst=None, local=None):
+  '''
+  Run one display loop per counter channel; `power` follows the displayed channel.
+  `local` is the output.LocalOutput at the end of `output`, to run its display refresh task.
+  `compensator` is an optional compensation.Compensator to keep the timebase corrected.
+  `recorder` is an optional recorder.Recorder to write to flash in the background.
+  `burst` is an optional burst.BurstCapture to run from the serial console.
+  '''
+  if local is not None and not local.inline:
+    asyncio.create_task(local.refresh())
+  if recorder is not None and not recorder.inline:
+    asyncio.create_task(recorder.run())
+  if compensator is not None:
+    compensator.update()
+    asyncio.create_task(compensator.run())
+  if latency is not None or burst is not None:
+    asyncio.create_task(serial_commands(latency, burst))
+  for gate in gates:
+    if gate.period is not None:
+      asyncio.create_task(poll_period(gate.period))
+  for queue, gate in zip(queues[1:], gates[1:]):
+    asyncio.create_task(display_loop(disp, queue, gate, output=output, latency=latency,
+                                     power=power if queue.channel == DISPLAY_CHANNEL else None))
+  queue, gate = queues[0], gates[0]
+  await display_loop(disp, queue, gate, output=output, latency=latency,
+                     power=power if queue.channel == DISPLAY_CHANNEL else None)
 
 async def run_display_test(disp, queue):
   '''Excercise the display code by running a mock data producer'''
@@ -101,17 +255,23 @@ def main():
   '''Main entry point and controller'''
   print("Hello.")
 
+  # set the system clock before anything derives a divider from it
+  init_timebase()
+  boot_timeline.mark('timebase')
+
   # configure the 7-segment LED display
-  d = Display(MOSI, CS, CK)
+  d = Display(MOSI, CS, CK) if DISPLAY_CHAIN == 1 else ChainedDisplay(MOSI, CS, CK, DISPLAY_CHAIN)
 
   d.intensity(DISPLAY_INTENSITY)
-  d.display_test(0.5)
+  if BOOT_DISPLAY_TEST_MS:
+    d.display_test(BOOT_DISPLAY_TEST_MS / 1000)
 
   d.clear()
   d.enable()
+  boot_timeline.mark('display')
 
-  # create queue for passing data from counter state machine IRQ handler to display loop
-  queue = ThreadSafeQueue(10)
+  # create ring for passing data from counter state machine IRQ handler to display loop
+  queue = MeasurementRing(MEASUREMENT_RING_SIZE, wide=WIDE_COUNT)
 
   # read the BOOTSEL button (1 == LOW/pressed) once after the display self-test completes
   # n.b. this read momentarily disables interrupts
@@ -128,7 +288,71 @@ def main():
     reset()
 
   # configure and start counter state machines
-  init_counter(queue)
+  if HF_INPUT:
+    from prescaler import Prescaler
+    gate = init_counter(queue, input_pin=HF_INPUT_PIN - 1, gate_pin=HF_GATE_PIN,
+                        pulse_fin_pin=HF_PULSE_FIN_PIN, prescaler=Prescaler(HF_INPUT_PIN))
+  else:
+    gate = init_counter(queue)
+  queues, gates = [queue], [gate]
+  if COUNTER_CHANNELS > 1:
+    # second, independent channel on PIO1, with its own ring
+    queue_b = MeasurementRing(MEASUREMENT_RING_SIZE, channel=1, wide=WIDE_COUNT)
+    gates.append(init_counter(queue_b, pio=1, input_pin=COUNTER_B_INPUT_PIN,
+                              gate_pin=COUNTER_B_GATE_PIN, pulse_fin_pin=COUNTER_B_PULSE_FIN_PIN))
+    queues.append(queue_b)
+  boot_timeline.mark('counter started')
+
+  if CALIBRATION_REFERENCE_HZ:
+    # capture a temperature compensation table from a reference on the input, until reset
+    from compensation import capture_calibration
+    asyncio.run(capture_calibration(queue, CALIBRATION_REFERENCE_HZ))
+
+  burst = None
+  if BURST_SIZE:
+    # of channel A
+    from burst import BurstCapture
+    burst = BurstCapture(gate, BURST_SIZE, HF_INPUT_PIN - 1 if HF_INPUT else COUNTER_INPUT_PIN,
+                         prescale=queue.prescale)
+
+  compensator = None
+  if COMPENSATION:
+    from compensation import Compensator, load_table
+    points = load_table()
+    if points is not None:
+      compensator = Compensator(points)
+    else:
+      print("No temperature compensation table, using CORRECTION")
+
+  global latency
+  if LATENCY_PROFILE:
+    from latency import LatencyProfile
+    latency = LatencyProfile()
+
+  # on the output core, the display is refreshed there; otherwise by a task between readings
+  if SERIAL_OUTPUT == 'binary':
+    from telemetry import TelemetryOutput
+    output = TelemetryOutput(d, latency=latency, inline=DUAL_CORE)
+  else:
+    output = LocalOutput(d, latency=latency, inline=DUAL_CORE)
+  local = output
+
+  recorder = None
+  if RECORDER:
+    from recorder import Recorder, RecordingOutput
+    # on the output core, blocks are written there; otherwise by a task between readings
+    recorder = Recorder(inline=DUAL_CORE)
+    output = RecordingOutput(output, recorder)
+
+  # optionally move display and serial output to core 1, leaving core 0 to measure
+  # n.b. the idle power policy drives the display directly, so only use it single core
+  power = None
+  if DUAL_CORE:
+    output = start_output_core(output)
+  elif IDLE_DIM_MS or IDLE_SHUTDOWN_MS or IDLE_LIGHTSLEEP_MS:
+    # n.b. sleeping would stop every channel, so only allow it with a single channel
+    from power import IdlePolicy
+    power = IdlePolicy(d, gate if len(gates) == 1 else None)
 
-  # start display loop
-  asyncio.run(display_loop(d, queue))
+  # start display loops
+  asyncio.run(run_counter(d, queues, gates, output, latency, power, compensator, recorder, burst, local))
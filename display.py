@@ -1,12 +1,12 @@
 
-from machine import Pin, SoftSPI
+try:
+  from collections import OrderedDict
+except ImportError:
+  from ucollections import OrderedDict
 import time
 
-# SoftSPI forces us to set a MISO even though we are TX-only
-# Pick an unused pin.
-MISO = 20
-
 DEFAULT_INTENSITY = 50  # %
+RENDER_CACHE_SIZE = 16  # rendered strings kept by Display.display()
 
 # MAX7219 register addresses
 NOOP = 0x0
@@ -37,26 +37,70 @@ symbols = code_b
 MISSING_SYMBOL_REPLACEMENT = ' '
 BLANK_SYMBOL = symbols.get(' ')
 
+DIGIT_ADDRS = (8, 7, 6, 5, 4, 3, 2, 1)
+
+
+class RenderCache():
+  '''Bounded LRU map of display strings to rendered digit register tuples'''
+  def __init__(self, size=RENDER_CACHE_SIZE):
+    self.size = size
+    self._entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key):
+    entries = self._entries
+    if key not in entries:
+      self.misses += 1
+      return None
+    self.hits += 1
+    # re-insert to mark as most recently used
+    value = entries.pop(key)
+    entries[key] = value
+    return value
+
+  def put(self, key, value):
+    entries = self._entries
+    if key in entries:
+      entries.pop(key)
+    elif len(entries) >= self.size:
+      # evict least recently used
+      entries.pop(next(iter(entries)))
+    entries[key] = value
+
+  def __len__(self):
+    return len(self._entries)
+
 
 class Display():
   '''Control a MAX7812 7-segment display'''
   dot_symbol = CODE_B_DP
-
-  # n.b. miso is an unused pin, but SoftSPI forces us to set it
-  def __init__(self, mosi, cs, ck, miso=MISO):
-    self.cs = Pin(cs, Pin.OUT)
-    self.spi = SoftSPI(
-      baudrate=1000000,
-      polarity=1,
-      phase=0,
-      sck=Pin(ck),
-      mosi=Pin(mosi),
-      miso=Pin(miso),
-    )
+  devices = 1  # MAX7219s on the bus, see ChainedDisplay
+
+  # n.b. miso is only used by the SoftSPI fallback, pick an unused pin
+  def __init__(self, mosi, cs, ck, miso=None, cache_size=RENDER_CACHE_SIZE, transport=None):
+    '''`transport` defaults to hardware SPI if the pins allow it, see transport.py'''
+    if transport is None:
+      # only imported here, so rendering works without the machine module, e.g. in benchmarks
+      from transport import open_transport
+      transport = open_transport(mosi, cs, ck, miso)
+    self.transport = transport
+    self.spi = self.transport.spi
+    self._frame = bytearray(2)  # reused for every register write
+
+    # shadow copy of the MAX7219's registers, indexed by address, so that
+    # unchanged registers aren't re-sent over the (slow, blocking) SPI bus
+    self._shadow = bytearray(16)
+    self._known = 0  # bitmask of shadow registers known to match the device
+    self._last_text = None
+    self.bytes_sent = 0
+    self.bytes_skipped = 0
+    self.cache = RenderCache(cache_size)
 
     self._init_display()
 
   def _init_display(self):
+    self.invalidate()
     self.shutdown()
 
     self._stop_display_test()
@@ -74,23 +118,24 @@ class Display():
     '''
     intensity = max(0, min(percent, 100)) * 0xf // 100
     # print(f"{percent} % = intensity {intensity}")
-    self.spi_command(INTENSITY, intensity)  # 0x0-0xf
+    self.update(INTENSITY, intensity)  # 0x0-0xf
 
   def shutdown(self):
     '''Set display to low power/no digits displayed. Data will be retained'''
-    self.spi_command(SHUTDOWN, 0x0)
+    self.update(SHUTDOWN, 0x0)
 
   def enable(self):
     '''Turn on display. Display will show existing stored data.'''
-    self.spi_command(SHUTDOWN, 0x1)
+    self.update(SHUTDOWN, 0x1)
 
   def clear(self):
     '''Clear the display'''
     # assume code-b mode
     # clear all digit data, Code B
 
+    self._last_text = None
     for digit, symbol in self.render(''):
-      self.spi_command(digit, symbol)
+      self.update(digit, symbol)
 
   def display_test(self, seconds=1):
     '''Trigger MAX7218's internal all-segments display test for duration'''
@@ -163,13 +208,35 @@ class Display():
     return list(zip(digit_addrs, helper()))
 
   def display(self, string):
-    '''Display a message'''
-    symbols = self.symbolize(string)
-
-    rendered = self.render(symbols)
-    for addr, symbol in rendered:
-      # print(f"{addr}, {symbol}")
-      self.spi_command(addr, symbol)
+    '''Display a message, sending only the digits that changed'''
+    if string == self._last_text:
+      self.bytes_skipped += 16
+      return
+    digits = self.cache.get(string)
+    if digits is None:
+      digits = tuple(symbol for _, symbol in self.render(self.symbolize(string)))
+      self.cache.put(string, digits)
+    self.display_code_b(digits)
+    self._last_text = string
+
+  def display_code_b(self, digits):
+    '''
+    Display 8 Code B register values, leftmost digit first, e.g. as produced
+    by util.encode_frequency. Sends only the digits that changed.
+    '''
+    self._last_text = None
+    for i in range(8):
+      self.update(8 - i, digits[i])
+
+  async def adisplay_code_b(self, digits):
+    '''As display_code_b, yielding to other tasks after each digit sent'''
+    self._last_text = None
+    for i in range(8):
+      data = digits[i]
+      if not (self._known & (1 << (8 - i)) and self._shadow[8 - i] == data):
+        await self.transport.awrite(self._pack(8 - i, data))
+      else:
+        self.bytes_skipped += 2
 
   def display8(self, string):
     '''Display a message (max 8 chars)'''
@@ -178,15 +245,186 @@ class Display():
     for digit, char in enumerate(reversed(message)):
       encoded = code_b[char]
 
-      self.spi_command(digit + 1, encoded)
+      self.update(digit + 1, encoded)
+    self._last_text = None
+
+  def invalidate(self):
+    '''Forget the shadow registers so the next update of each one is sent'''
+    self._known = 0
+    self._last_text = None
+
+  def update(self, command, data):
+    '''Send command to MAX7812 unless the register already holds this value'''
+    data &= 0xff
+    if self._known & (1 << command) and self._shadow[command] == data:
+      self.bytes_skipped += 2
+      return
+    self.spi_command(command, data)
 
   def spi_command(self, command, data):
     '''Send command to MAX7812'''
-    try:
-      self.cs.off()
-      self.spi.write(bytearray([command & 0xff, data & 0xff]))
-    finally:
-      self.cs.on()
+    self.transport.write(self._pack(command, data))
+
+  def _pack(self, command, data):
+    '''Fill the reused frame, counting it as sent to the shadow registers'''
+    frame = self._frame
+    frame[0] = command & 0xff
+    frame[1] = data & 0xff
+    command &= 0xf
+    self._shadow[command] = data & 0xff
+    self._known |= 1 << command
+    self.bytes_sent += 2
+    return frame
+
+
+class ChainedDisplay(Display):
+  '''
+  Control `devices` MAX7219s daisy-chained on one bus, device 0 nearest the MOSI pin
+
+  Each register write is a single CS-low transaction shifting one frame through
+  the whole chain, with NOOP frames for the devices whose register already holds
+  its value, so a refresh costs one transaction per changed digit position
+  however many devices there are. Control commands (intensity, shutdown, ...)
+  go to every device.
+  '''
+  def __init__(self, mosi, cs, ck, devices, miso=None, cache_size=RENDER_CACHE_SIZE, transport=None):
+    self.devices = devices
+    self._chain_frame = bytearray(2 * devices)  # reused for every transaction
+    # per device shadow registers, at 16 * device + address, as Display._shadow
+    self._shadows = bytearray(16 * devices)
+    self._pending = bytearray(16 * devices)  # staged register values
+    self._staged = 0  # bitmask of addresses with a value staged for some device
+    self._staged_devices = [0] * devices  # per device bitmask of staged addresses
+    self.transactions = 0
+    super().__init__(mosi, cs, ck, miso, cache_size, transport)
+
+  def invalidate(self):
+    '''Forget the shadow registers of every device so the next update of each one is sent'''
+    self._known = [0] * self.devices
+    self._last_text = [None] * self.devices
+
+  def clear(self):
+    '''Clear every device'''
+    for device in range(self.devices):
+      self._last_text[device] = None
+      for digit, symbol in self.render(''):
+        self._stage(device, digit, symbol)
+    self.flush()
+
+  def stage(self, string, device=0):
+    '''Render a message for `device`, to be sent by the next flush()'''
+    if string == self._last_text[device]:
+      self.bytes_skipped += 16
+      return
+    digits = self.cache.get(string)
+    if digits is None:
+      digits = tuple(symbol for _, symbol in self.render(self.symbolize(string)))
+      self.cache.put(string, digits)
+    self.stage_code_b(digits, device)
+    self._last_text[device] = string
+
+  def stage_code_b(self, digits, device=0):
+    '''Stage 8 Code B register values for `device`, leftmost digit first'''
+    self._last_text[device] = None
+    for i in range(8):
+      self._stage(device, 8 - i, digits[i])
+
+  def display(self, string, device=0):
+    '''Display a message on `device`, sending only the digits that changed'''
+    self.stage(string, device)
+    self.flush()
+
+  def display_code_b(self, digits, device=0):
+    '''Display 8 Code B register values on `device`, sending only the digits that changed'''
+    self.stage_code_b(digits, device)
+    self.flush()
+
+  def display_all(self, strings):
+    '''Display one message per device, None leaving a device as it is'''
+    for device, string in enumerate(strings):
+      if string is not None:
+        self.stage(string, device)
+    self.flush()
+
+  def _stage(self, device, command, data):
+    data &= 0xff
+    command &= 0xf
+    offset = 16 * device + command
+    if self._known[device] & (1 << command) and self._shadows[offset] == data:
+      # already showing, unless an earlier staged value replaced it
+      self._staged_devices[device] &= ~(1 << command)
+      return
+    self._pending[offset] = data
+    self._staged_devices[device] |= 1 << command
+    self._staged |= 1 << command
+
+  def flush(self):
+    '''Send each staged register address to the whole chain in one transaction'''
+    staged = self._staged
+    self._staged = 0
+    # highest address first, i.e. control registers, then digits left to right
+    for command in range(15, 0, -1):
+      if staged & (1 << command):
+        self._send(command)
+
+  async def adisplay_code_b(self, digits, device=0):
+    '''As display_code_b, yielding to other tasks after each transaction'''
+    self.stage_code_b(digits, device)
+    staged = self._staged
+    for command in range(15, 0, -1):
+      if staged & (1 << command):
+        frame = self._pack_chain(command)
+        if frame is not None:
+          await self.transport.awrite(frame)
+
+  def _send(self, command):
+    frame = self._pack_chain(command)
+    if frame is not None:
+      self.transport.write(frame)
+
+  def _pack_chain(self, command):
+    '''Fill the reused frame with `command`'s staged values, or None if no device needs one'''
+    frame = self._chain_frame
+    bit = 1 << command
+    self._staged &= ~bit
+    last = 2 * (self.devices - 1)
+    sent = False
+    for device in range(self.devices):
+      # the last frame shifted in ends up in the first device
+      offset = last - 2 * device
+      if self._staged_devices[device] & bit:
+        self._staged_devices[device] &= ~bit
+        data = self._pending[16 * device + command]
+        frame[offset] = command
+        frame[offset + 1] = data
+        self._shadows[16 * device + command] = data
+        self._known[device] |= bit
+        sent = True
+      else:
+        frame[offset] = NOOP
+        frame[offset + 1] = 0
+    if not sent:
+      self.bytes_skipped += len(frame)
+      return None
+    self.transactions += 1
+    self.bytes_sent += len(frame)
+    return frame
+
+  def update(self, command, data):
+    '''Set a register on every device, sending only to devices where it differs'''
+    for device in range(self.devices):
+      self._stage(device, command, data)
+    self._send(command & 0xf)
+
+  def spi_command(self, command, data):
+    '''Set a register on every device'''
+    command &= 0xf
+    for device in range(self.devices):
+      self._known[device] &= ~(1 << command)
+    self.update(command, data)
+
+  def display8(self, string):
+    self.display(f"{string[:8]:>8}")
 
 
 def display_test():
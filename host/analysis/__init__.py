@@ -0,0 +1,23 @@
+'''
+Host analysis of raw counts captured from the counter, with NumPy
+
+Loads telemetry captures and flash recordings a chunk at a time into
+arrays (records), converts the raw counts to frequencies with the firmware's
+own arithmetic, bit for bit (counts), and accumulates statistics, drift and
+Allan deviations over the series (series). From the command line:
+
+    python host/analysis capture.bin --taus 1,2,4,8,16,32 --histogram 0.1
+'''
+import os
+import sys
+
+HOST_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (os.path.dirname(HOST_DIR), HOST_DIR):
+  if path not in sys.path:
+    sys.path.insert(0, path)
+
+import micropython  # noqa: E402,F401
+from .counts import convert_clock_count, convert_pulse_count, calculate_frequency, \
+  calculate_scaled_frequency, calculate_decihertz  # noqa: E402,F401
+from .records import Chunk, Reader, load  # noqa: E402,F401
+from .series import SeriesStats  # noqa: E402,F401
@@ -0,0 +1,107 @@
+'''
+Analyze a telemetry capture or flash recording of raw counts
+
+    python host/analysis capture.bin
+    python host/analysis recording.bin --channel 1 --taus 1,2,4,8,16,32,64 --csv series.csv
+    python host/analysis --test
+'''
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from analysis import Reader, SeriesStats, calculate_decihertz, convert_clock_count  # noqa: E402
+from constants import PIO_FREQ, ALLAN_TAUS  # noqa: E402
+from telemetry import FLAG_IDLE  # noqa: E402
+
+def analyze(path, channel=0, taus=ALLAN_TAUS, csv=None, chunk_size=None):
+  '''Stream a file through SeriesStats. Returns (stats, reader, missing readings, median gate s)'''
+  reader = Reader(path) if chunk_size is None else Reader(path, chunk_size)
+  stats = SeriesStats(taus)
+  missing = 0
+  last_seq = None
+  gates = []
+  for chunk in reader:
+    chunk = chunk.select((chunk.channel == channel) & (chunk.flags & FLAG_IDLE == 0))
+    if not len(chunk):
+      continue
+    seq = chunk.seq.astype(np.int64)
+    steps = np.diff(seq, prepend=seq[0] if last_seq is None else last_seq)
+    missing += int(np.clip(steps - 1, 0, None).sum())
+    last_seq = int(seq[-1])
+    decihertz = calculate_decihertz(chunk.clock_raw, chunk.pulse_raw)
+    stats.add(decihertz, chunk.ticks_us)
+    gates.append(np.median(convert_clock_count(chunk.clock_raw)))
+    if csv is not None:
+      for row in zip(chunk.seq.tolist(), chunk.ticks_us.tolist(), (decihertz / 10).tolist()):
+        csv.write("%d,%d,%.1f\n" % row)
+  gate_s = float(np.median(gates)) / PIO_FREQ if gates else None
+  return stats, reader, missing, gate_s
+
+def report(stats, reader, missing, gate_s, histogram_hz=None, out=sys.stdout):
+  print(f"{reader.records} records, {missing} missing, {reader.bad_records} bad, "
+        f"{reader.skipped_bytes} bytes skipped", file=out)
+  if not stats.count:
+    print("No readings", file=out)
+    return
+  print(f"n={stats.count} mean={stats.mean / 10:.3f} Hz sd={stats.stddev / 10:.3g} Hz "
+        f"min={stats.min / 10} max={stats.max / 10} Hz", file=out)
+  drift = stats.drift()
+  if drift is not None:
+    slope, intercept = drift
+    print(f"drift {slope / 10:+.4g} Hz/s ({slope / stats.ref * 3.6e12:+.4g} ppb/hour) "
+          f"from {intercept / 10:.3f} Hz", file=out)
+  print(f"{'tau_s':>10} {'m':>6} {'adev':>10} {'mdev':>10}", file=out)
+  for i, m in enumerate(stats.taus):
+    adev, mdev = stats.allan_deviation(i), stats.modified_allan_deviation(i)
+    if adev is None:
+      continue
+    tau = f"{m * gate_s:.4g}" if gate_s else '?'
+    print(f"{tau:>10} {m:>6} {adev:>10.3e} {mdev if mdev is not None else float('nan'):>10.3e}", file=out)
+  if histogram_hz:
+    starts, counts = stats.histogram(max(1, round(histogram_hz * 10)))
+    scale = 50 / counts.max()
+    for start, count in zip(starts.tolist(), counts.tolist()):
+      print(f"{start / 10:>14.1f} {count:>8} {'#' * max(1, round(count * scale))}", file=out)
+
+def test():
+  from analysis import counts, series
+  for module in (counts, series):
+    for name in sorted(dir(module)):
+      if name.startswith('test_'):
+        getattr(module, name)()
+        print(f"{module.__name__}.{name} ok")
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument('path', nargs='?', help='telemetry capture or flash recording')
+  parser.add_argument('--channel', type=int, default=0)
+  parser.add_argument('--taus', default=','.join(map(str, ALLAN_TAUS)),
+                      help='Allan deviation taus, comma separated multiples of the gate time')
+  parser.add_argument('--histogram', type=float, metavar='HZ', help='print a histogram with HZ wide bins')
+  parser.add_argument('--csv', metavar='PATH', help='write seq,ticks_us,frequency_hz of each reading')
+  parser.add_argument('--test', action='store_true', help='run the self tests')
+  args = parser.parse_args(argv)
+  if args.test:
+    test()
+    return 0
+  if args.path is None:
+    parser.error('a capture or recording is required')
+  taus = [int(tau) for tau in args.taus.split(',')]
+  csv = None
+  if args.csv:
+    csv = open(args.csv, 'w')
+    csv.write("seq,ticks_us,frequency_hz\n")
+  try:
+    results = analyze(args.path, args.channel, taus, csv)
+  finally:
+    if csv is not None:
+      csv.close()
+  report(*results, histogram_hz=args.histogram)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
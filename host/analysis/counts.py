@@ -0,0 +1,216 @@
+'''
+Vectorized raw count conversion and frequency calculation
+
+The same formulas as util.convert_clock_count, convert_pulse_count,
+calculate_frequency and calculate_decihertz, over uint64 arrays, with the
+same results bit for bit. util divides Python ints, so calculate_frequency
+is the correctly rounded quotient and calculate_decihertz the exactly
+rounded one; here the products are carried to 128 bits in 32 bit limbs and
+divided exactly, and only rows whose quotient couldn't fit (gates of
+centuries) go through util one at a time.
+'''
+from math import gcd
+
+import numpy as np
+
+import util
+from constants import MAX_COUNT, MAX_WIDE_COUNT, PIO_FREQ
+
+U64 = np.uint64
+MASK32 = U64(0xffffffff)
+MAX_DIVISOR = (1 << 63) - 1  # so a remainder can be doubled without overflow
+MANTISSA_BITS = 53
+
+def convert_pulse_count(pulse_raw):
+  '''util.convert_pulse_count of each raw count'''
+  raw = np.asarray(pulse_raw, dtype=U64)
+  with np.errstate(over='ignore'):
+    return np.where(raw > MAX_COUNT, U64(MAX_WIDE_COUNT) - raw, U64(MAX_COUNT) - raw)
+
+def convert_clock_count(clock_raw):
+  '''util.convert_clock_count of each raw count, for gates under 2**63 cycles'''
+  raw = np.asarray(clock_raw, dtype=U64)
+  with np.errstate(over='ignore'):
+    wide = U64(2) * (U64(MAX_WIDE_COUNT) - raw + U64(1)) + (U64(MAX_COUNT) - (raw >> U64(32)))
+    narrow = U64(2) * (U64(MAX_COUNT) - raw + U64(1))
+  return np.where(raw > MAX_COUNT, wide, narrow)
+
+def _ratio(scale, correction, freq):
+  '''scale * freq * num / den in lowest terms, as calculate_* multiply the counts by'''
+  num, den = util.correction if correction is None else correction
+  numerator = scale * freq * num
+  divisor = gcd(numerator, den)
+  return numerator // divisor, den // divisor
+
+def _multiply(a, b):
+  '''Full 128 bit products of uint64 arrays, as (high, low) words'''
+  a_lo, a_hi = a & MASK32, a >> U64(32)
+  b_lo, b_hi = b & MASK32, b >> U64(32)
+  ll, lh, hl, hh = a_lo * b_lo, a_lo * b_hi, a_hi * b_lo, a_hi * b_hi
+  middle = (ll >> U64(32)) + (lh & MASK32) + (hl & MASK32)
+  low = (ll & MASK32) | (middle << U64(32))
+  high = hh + (lh >> U64(32)) + (hl >> U64(32)) + (middle >> U64(32))
+  return high, low
+
+def _divide(high, low, divisor):
+  '''
+  Quotient and remainder of the 128 bit (high, low) by divisor < 2**63, for
+  high < divisor, so the quotient fits 64 bits
+  '''
+  quotient = np.zeros_like(low)
+  remainder = high.copy()
+  short = high == 0
+  if short.any():
+    quotient[short] = low[short] // divisor[short]
+    remainder[short] = low[short] % divisor[short]
+  long = ~short
+  if long.any():
+    r, lo, d = remainder[long], low[long], divisor[long]
+    q = np.zeros_like(lo)
+    for bit in range(63, -1, -1):
+      r = (r << U64(1)) | ((lo >> U64(bit)) & U64(1))
+      carry = r >= d
+      r = np.where(carry, r - d, r)
+      q |= carry.astype(U64) << U64(bit)
+    quotient[long], remainder[long] = q, r
+  return quotient, remainder
+
+def _round_float(quotient, remainder, divisor):
+  '''quotient + remainder / divisor correctly rounded (half to even) to float64, for quotient < 2**53'''
+  result = np.empty(len(quotient))
+  mantissa = quotient.copy()
+  exponent = np.zeros(len(quotient), dtype=np.int64)
+  # long division, a bit at a time, to one bit past the 53 of a double's mantissa
+  active = np.flatnonzero((mantissa >> U64(MANTISSA_BITS)) == 0)
+  while len(active):
+    m, r, d = mantissa[active], remainder[active], divisor[active]
+    carry = r >= d - r
+    r = np.where(carry, r - (d - r), r + r)
+    m = (m << U64(1)) | carry.astype(U64)
+    mantissa[active], remainder[active] = m, r
+    exponent[active] += 1
+    # done once there's a rounding bit, or nothing left to divide
+    more = ((m >> U64(MANTISSA_BITS)) == 0) & (r != 0)
+    active = active[more]
+  rounding = (mantissa >> U64(MANTISSA_BITS)) != 0
+  # exact: mantissa fits as it is
+  exact = ~rounding
+  result[exact] = np.ldexp(mantissa[exact].astype(np.float64), -exponent[exact])
+  # drop the rounding bit, rounding up past half, or at half to even
+  m = mantissa[rounding]
+  half = (m & U64(1)) != 0
+  m >>= U64(1)
+  up = half & ((remainder[rounding] != 0) | ((m & U64(1)) != 0))
+  m += up.astype(U64)
+  result[rounding] = np.ldexp(m.astype(np.float64), -(exponent[rounding] - 1))
+  return result
+
+def _quotients(clock_raw, pulse_raw, scale, correction, freq):
+  '''
+  Exact (quotient, remainder, divisor) of scale * freq * correction * pulses / clocks,
+  and a mask of the rows that overflowed and need util
+  '''
+  multiplier, denominator = _ratio(scale, correction, freq)
+  clocks = convert_clock_count(clock_raw)
+  pulses = convert_pulse_count(pulse_raw)
+  if multiplier > MAX_COUNT << 32 | MAX_COUNT:
+    overflow = np.ones(len(clocks), dtype=bool)
+    return None, None, None, overflow
+  overflow = clocks > MAX_DIVISOR // denominator
+  divisor = np.where(overflow, U64(1), clocks * U64(denominator))
+  high, low = _multiply(pulses, np.full(len(pulses), multiplier, dtype=U64))
+  overflow |= high >= divisor
+  high = np.where(overflow, U64(0), high)
+  quotient, remainder = _divide(high, low, divisor)
+  return quotient, remainder, divisor, overflow
+
+def _fallback(result, overflow, clock_raw, pulse_raw, function, correction, freq):
+  '''Fill in the overflowed rows of `result` with util's `function`'''
+  rows = np.flatnonzero(overflow)
+  if not len(rows):
+    return result
+  saved = util.correction
+  try:
+    if correction is not None:
+      util.set_correction(*correction)
+    assert freq == PIO_FREQ, "util only calculates at PIO_FREQ"
+    for i in rows:
+      result[i] = function(int(clock_raw[i]), int(pulse_raw[i]))
+  finally:
+    util.set_correction(*saved)
+  return result
+
+def calculate_frequency(clock_raw, pulse_raw, correction=None, freq=PIO_FREQ):
+  '''util.calculate_frequency of each measurement, float64 Hz'''
+  clock_raw = np.asarray(clock_raw, dtype=U64)
+  pulse_raw = np.asarray(pulse_raw, dtype=U64)
+  quotient, remainder, divisor, overflow = _quotients(clock_raw, pulse_raw, 1, correction, freq)
+  result = np.zeros(len(clock_raw))
+  if quotient is not None:
+    overflow |= (quotient >> U64(MANTISSA_BITS)) != 0
+    rows = ~overflow
+    result[rows] = _round_float(quotient[rows], remainder[rows], divisor[rows])
+  return _fallback(result, overflow, clock_raw, pulse_raw, util.calculate_frequency, correction, freq)
+
+def calculate_scaled_frequency(clock_raw, pulse_raw, scale, correction=None, freq=PIO_FREQ):
+  '''util.calculate_scaled_frequency of each measurement, int64 units of 1/scale Hz'''
+  clock_raw = np.asarray(clock_raw, dtype=U64)
+  pulse_raw = np.asarray(pulse_raw, dtype=U64)
+  quotient, remainder, divisor, overflow = _quotients(clock_raw, pulse_raw, scale, correction, freq)
+  result = np.zeros(len(clock_raw), dtype=np.int64)
+  if quotient is not None:
+    # round half up: the quotient of (2 n + d) // (2 d)
+    rounded = quotient + (remainder >= divisor - remainder).astype(U64)
+    overflow |= rounded >> U64(63) != 0
+    result[~overflow] = rounded[~overflow].astype(np.int64)
+
+  def scaled(clock, pulse):
+    return util.calculate_scaled_frequency(clock, pulse, scale)
+  return _fallback(result, overflow, clock_raw, pulse_raw, scaled, correction, freq)
+
+def calculate_decihertz(clock_raw, pulse_raw, correction=None, freq=PIO_FREQ):
+  '''util.calculate_decihertz of each measurement, int64 tenths of Hz'''
+  return calculate_scaled_frequency(clock_raw, pulse_raw, 10, correction, freq)
+
+def _test_counts(rng, n):
+  '''Random raw counts, 32 bit and wide, around realistic gates and inputs'''
+  gates = rng.integers(1_000, 1 << 36, n)
+  pulses = rng.integers(0, 1 << 34, n) * rng.random(n) ** 4
+  pulses = np.minimum(pulses.astype(np.int64), gates)
+  clock = [util.unconvert_clock_count(int(g) & ~1 or 2) for g in gates]
+  pulse = [util.unconvert_pulse_count(int(p)) for p in pulses]
+  return clock, pulse
+
+def test_bit_exact():
+  rng = np.random.default_rng(1)
+  clock, pulse = _test_counts(rng, 5000)
+  clock += [raw for raw, _ in util.test_raw_data]
+  pulse += [raw for _, raw in util.test_raw_data]
+  for correction in (None, (100_004, 100_000), (1_000_000_000 - 4_321, 1_000_000_000), (7, 3)):
+    saved = util.correction
+    try:
+      if correction is not None:
+        util.set_correction(*correction)
+      expected_hz = [util.calculate_frequency(c, p) for c, p in zip(clock, pulse)]
+      expected_dhz = [util.calculate_decihertz(c, p) for c, p in zip(clock, pulse)]
+    finally:
+      util.set_correction(*saved)
+    hz = calculate_frequency(clock, pulse, correction)
+    dhz = calculate_decihertz(clock, pulse, correction)
+    for i, (want, got) in enumerate(zip(expected_hz, hz)):
+      assert want == got, (correction, clock[i], pulse[i], want.hex(), float(got).hex())
+    assert dhz.tolist() == expected_dhz, correction
+  assert convert_clock_count(clock).tolist() == [util.convert_clock_count(c) for c in clock]
+  assert convert_pulse_count(pulse).tolist() == [util.convert_pulse_count(p) for p in pulse]
+
+def test_fallback():
+  # a correction too fine to multiply in 64 bits goes through util
+  correction = (10 ** 18 + 1, 10 ** 18)
+  clock, pulse = util.test_raw_data[-1]
+  saved = util.correction
+  try:
+    util.set_correction(*correction)
+    expected = util.calculate_decihertz(clock, pulse)
+  finally:
+    util.set_correction(*saved)
+  assert calculate_decihertz([clock], [pulse], correction).tolist() == [expected]
@@ -0,0 +1,152 @@
+'''
+Chunked loading of telemetry captures and flash recordings into arrays
+
+A telemetry capture (host/telemetry_decode.py's input) is a byte stream of
+records, interleaved with console text; a recording (recorder.py) is a ring
+of blocks of records. Both are decoded a chunk at a time, with every sync
+word in the chunk checked at once, and taken in order the way
+telemetry_decode.Decoder resynchronizes. So a chunk of a million records
+never becomes a million tuples.
+'''
+import numpy as np
+
+from recorder import BLOCK_MAGIC
+from replay import read_blocks
+from telemetry import RECORD_SIZE, WIDE_RECORD_SIZE, FLAGS_OFFSET, FLAG_WIDE, CHANNEL_SHIFT
+
+CHUNK_SIZE = 1 << 24  # bytes read at a time, some 750,000 records
+SYNC = (0xa5, 0x5a)
+FIELDS = ('seq', 'ticks_us', 'clock_raw', 'pulse_raw', 'flags')
+
+class Chunk():
+  '''Decoded records as parallel arrays, named as unpack_record's fields'''
+  def __init__(self, seq, ticks_us, clock_raw, pulse_raw, flags):
+    self.seq = seq
+    self.ticks_us = ticks_us
+    self.clock_raw = clock_raw
+    self.pulse_raw = pulse_raw
+    self.flags = flags
+
+  def __len__(self):
+    return len(self.seq)
+
+  @property
+  def channel(self):
+    return self.flags >> CHANNEL_SHIFT
+
+  def select(self, rows):
+    return Chunk(*(getattr(self, name)[rows] for name in FIELDS))
+
+  @classmethod
+  def concatenate(cls, chunks):
+    chunks = list(chunks)
+    if not chunks:
+      dtypes = (np.uint32, np.uint32, np.uint64, np.uint64, np.uint16)
+      return cls(*(np.zeros(0, dtype=dtype) for dtype in dtypes))
+    return cls(*(np.concatenate([getattr(chunk, name) for chunk in chunks]) for name in FIELDS))
+
+def _fletcher16(buf, starts, length):
+  '''telemetry.fletcher16 of `length` bytes at each start'''
+  # the running sums reduce mod 255 at the end just the same
+  data = buf[starts[:, None] + np.arange(length)].astype(np.int64)
+  weights = np.arange(length, 0, -1)
+  return ((data @ weights) % 255) << 8 | data.sum(axis=1) % 255
+
+def _field(buf, starts, offset, dtype):
+  size = np.dtype(dtype).itemsize
+  rows = buf[starts[:, None] + offset + np.arange(size)]
+  return np.ascontiguousarray(rows).view('<' + np.dtype(dtype).str[1:]).ravel()
+
+def decode(buf, final=True):
+  '''
+  Decode the records in `buf` (a uint8 array). Returns (Chunk, bytes consumed,
+  bytes skipped, bad records); without `final`, stops before a record that
+  might continue in the next buffer.
+  '''
+  end = len(buf)
+  candidates = np.flatnonzero((buf[:-1] == SYNC[0]) & (buf[1:] == SYNC[1]))
+  # a record's size is only known from its flags
+  candidates = candidates[candidates + RECORD_SIZE <= end]
+  flags = _field(buf, candidates, FLAGS_OFFSET, np.uint16)
+  sizes = np.where(flags & FLAG_WIDE, WIDE_RECORD_SIZE, RECORD_SIZE)
+  complete = candidates + sizes <= end
+  valid = np.zeros(len(candidates), dtype=bool)
+  for size in (RECORD_SIZE, WIDE_RECORD_SIZE):
+    rows = np.flatnonzero((sizes == size) & complete)
+    starts = candidates[rows]
+    checksum = _field(buf, starts, size - 2, np.uint16)
+    valid[rows] = checksum == _fletcher16(buf, starts + 2, size - 4)
+  # take them in order, skipping any that start inside the previous one, up to
+  # one that's cut off by the end of the buffer
+  taken = []
+  bad = 0
+  pos = 0
+  consumed = None
+  for i, (start, size, whole, ok) in enumerate(zip(candidates.tolist(), sizes.tolist(),
+                                                   complete.tolist(), valid.tolist())):
+    if start < pos:
+      continue
+    if not whole:
+      consumed = start
+      break
+    if ok:
+      taken.append(i)
+      pos = start + size
+    else:
+      bad += 1
+  if final:
+    consumed = end
+  elif consumed is None:
+    # keep the bytes a record too short to check yet could start in
+    consumed = max(pos, end - RECORD_SIZE + 1)
+  taken = np.array(taken, dtype=np.int64)
+  skipped = consumed - int(sizes[taken].sum())
+  starts = candidates[taken]
+  flags = flags[taken]
+  clock = _field(buf, starts, 10, np.uint32).astype(np.uint64)
+  pulse = _field(buf, starts, 14, np.uint32).astype(np.uint64)
+  wide = np.flatnonzero(flags & FLAG_WIDE)
+  if len(wide):
+    clock[wide] |= _field(buf, starts[wide], RECORD_SIZE - 2, np.uint32).astype(np.uint64) << np.uint64(32)
+    pulse[wide] |= _field(buf, starts[wide], RECORD_SIZE + 2, np.uint32).astype(np.uint64) << np.uint64(32)
+  chunk = Chunk(_field(buf, starts, 2, np.uint32), _field(buf, starts, 6, np.uint32), clock, pulse, flags)
+  return chunk, consumed, skipped, bad
+
+class Reader():
+  '''Iterate over a capture or recording a Chunk at a time, tallying what was skipped'''
+  def __init__(self, path, chunk_size=CHUNK_SIZE):
+    self.path = path
+    self.chunk_size = chunk_size
+    self.records = 0
+    self.skipped_bytes = 0
+    self.bad_records = 0
+
+  def _count(self, chunk, skipped, bad):
+    self.records += len(chunk)
+    self.skipped_bytes += skipped
+    self.bad_records += bad
+    return chunk
+
+  def __iter__(self):
+    with open(self.path, 'rb') as f:
+      recording = f.read(len(BLOCK_MAGIC)) == BLOCK_MAGIC
+      f.seek(0)
+      if recording:
+        # records never span blocks
+        for _, data in read_blocks(f):
+          chunk, _, skipped, bad = decode(np.frombuffer(data, dtype=np.uint8))
+          yield self._count(chunk, skipped, bad)
+        return
+      tail = np.zeros(0, dtype=np.uint8)
+      while True:
+        data = f.read(self.chunk_size)
+        buf = np.concatenate([tail, np.frombuffer(data, dtype=np.uint8)])
+        chunk, consumed, skipped, bad = decode(buf, final=not data)
+        tail = buf[consumed:]
+        yield self._count(chunk, skipped, bad)
+        if not data:
+          return
+
+def load(path, chunk_size=CHUNK_SIZE):
+  '''Every record in a capture or recording, as one Chunk'''
+  return Chunk.concatenate(Reader(path, chunk_size))
@@ -0,0 +1,192 @@
+'''
+Statistics of a frequency series, accumulated a chunk at a time
+
+SeriesStats takes readings in tenths of Hz (as calculate_decihertz) and
+their ticks_us timestamps chunk by chunk, and keeps only running sums and
+the tail of the phase needed to continue the Allan deviations. Like the
+firmware's stats.StreamStats, readings are taken relative to the first one
+and the phase is their running sum, kept exact in int64, and taus are in
+multiples of the gate time, tau0.
+'''
+import math
+
+import numpy as np
+
+from constants import ALLAN_TAUS
+
+TICKS_PERIOD = 1 << 30  # time.ticks_us() wraps here on the rp2 port
+
+class SeriesStats():
+  '''
+  Count, mean, standard deviation, min/max, histogram, linear drift fit, and
+  overlapping Allan and modified Allan deviation at each of `taus`
+  '''
+  def __init__(self, taus=ALLAN_TAUS):
+    self.taus = tuple(taus)
+    self.count = 0
+    self.ref = None  # first reading, tenths of Hz
+    self.min = None
+    self.max = None
+    self._sum = 0  # of readings relative to ref, exact
+    self._sum2 = 0
+    self._values = {}  # histogram, reading: count
+    # drift fit sums, of seconds since the first reading and readings relative to ref
+    self._ticks = None  # last timestamp, to unwrap the next
+    self._seconds = 0.0  # at the last timestamp
+    self._fit = np.zeros(4)  # sum of t, t * t, y, t * y
+    # phase is the running sum of readings relative to ref; phase[0] is zero
+    self._phase_tail = np.zeros(1, dtype=np.int64)
+    self._tail_length = 3 * max(self.taus)
+    self._adev = [[0.0, 0] for _ in self.taus]  # sum of squares, terms
+    self._mdev = [[0.0, 0] for _ in self.taus]
+
+  def add(self, decihertz, ticks_us=None):
+    '''Add a chunk of consecutive readings (int64 tenths of Hz), and optionally their ticks_us'''
+    decihertz = np.asarray(decihertz, dtype=np.int64)
+    if not len(decihertz):
+      return
+    if self.ref is None:
+      self.ref = int(decihertz[0])
+      self.min = self.max = self.ref
+    self.min = min(self.min, int(decihertz.min()))
+    self.max = max(self.max, int(decihertz.max()))
+    x = decihertz - self.ref
+    self.count += len(x)
+    self._sum += int(x.sum())
+    if int(np.abs(x).max()) ** 2 * len(x) < 1 << 63:
+      self._sum2 += int((x * x).sum())
+    else:
+      # readings far enough from ref, e.g. glitches, would overflow int64
+      self._sum2 += sum(v * v for v in x.tolist())
+    values, counts = np.unique(decihertz, return_counts=True)
+    for value, count in zip(values.tolist(), counts.tolist()):
+      self._values[value] = self._values.get(value, 0) + count
+    if ticks_us is not None:
+      self._add_times(np.asarray(ticks_us, dtype=np.int64), x)
+    self._add_phase(x)
+
+  def _add_times(self, ticks_us, x):
+    previous = ticks_us[0] if self._ticks is None else self._ticks
+    steps = np.diff(ticks_us, prepend=previous) % TICKS_PERIOD
+    t = self._seconds + np.cumsum(steps) / 1e6
+    self._ticks = int(ticks_us[-1])
+    self._seconds = float(t[-1])
+    self._fit += (t.sum(), (t * t).sum(), x.sum(), (t * x).sum())
+
+  def _add_phase(self, x):
+    tail = self._phase_tail
+    phase = np.concatenate([tail, tail[-1] + np.cumsum(x)])
+    # phase points before this chunk's, at the start of `phase`
+    old = len(tail)
+    for i, m in enumerate(self.taus):
+      if len(phase) <= 2 * m:
+        continue
+      d = phase[2 * m:] - 2 * phase[m:-m] + phase[:-2 * m]  # d[j] ends at phase[j + 2 m]
+      new = d[max(0, old - 2 * m):].astype(np.float64)
+      self._adev[i][0] += float((new * new).sum())
+      self._adev[i][1] += len(new)
+      if len(d) < m:
+        continue
+      # modified: sums of m consecutive second differences
+      sums = np.cumsum(np.concatenate([[0], d]))
+      s = (sums[m:] - sums[:-m])[max(0, old - 3 * m + 1):].astype(np.float64)  # s[j] ends at d[j + m - 1]
+      self._mdev[i][0] += float((s * s).sum())
+      self._mdev[i][1] += len(s)
+    self._phase_tail = phase[-self._tail_length:]
+
+  @property
+  def mean(self):
+    '''Mean reading, tenths of Hz'''
+    return None if self.ref is None else self.ref + self._sum / self.count
+
+  @property
+  def stddev(self):
+    '''Sample standard deviation, tenths of Hz'''
+    if self.count < 2:
+      return 0.0
+    # exact in ints, since the float difference can cancel to below zero
+    n = self.count
+    return math.sqrt((n * self._sum2 - self._sum * self._sum) / (n * (n - 1)))
+
+  def histogram(self, width=1):
+    '''(bin starts, counts) of the readings in bins of `width` tenths of Hz'''
+    values = np.array(sorted(self._values), dtype=np.int64)
+    counts = np.array([self._values[value] for value in values.tolist()], dtype=np.int64)
+    bins = values // width * width
+    starts, index = np.unique(bins, return_inverse=True)
+    return starts, np.bincount(index, weights=counts).astype(np.int64)
+
+  def drift(self):
+    '''Least squares (slope in tenths of Hz per second, intercept in tenths of Hz at the first reading)'''
+    n = self.count
+    st, stt, sy, sty = self._fit
+    det = n * stt - st * st
+    if self._ticks is None or n < 2 or not det:
+      return None
+    slope = (n * sty - st * sy) / det
+    return slope, self.ref + (sy - slope * st) / n
+
+  def allan_deviation(self, i):
+    '''Overlapping Allan deviation (fractional) at tau = taus[i] * tau0, None until enough data'''
+    total, terms = self._adev[i]
+    if not terms or not self.ref:
+      return None
+    m = self.taus[i]
+    return math.sqrt(total / (2 * m * m * terms)) / self.ref
+
+  def modified_allan_deviation(self, i):
+    '''Modified Allan deviation (fractional) at tau = taus[i] * tau0, None until enough data'''
+    total, terms = self._mdev[i]
+    if not terms or not self.ref:
+      return None
+    m = self.taus[i]
+    return math.sqrt(total / (2 * m ** 4 * terms)) / self.ref
+
+def test_matches_stream_stats():
+  from stats import StreamStats
+  rng = np.random.default_rng(2)
+  readings = 100_000_000 + np.cumsum(rng.integers(-3, 4, 1000))
+  device = StreamStats(taus=ALLAN_TAUS)
+  for reading in readings.tolist():
+    device.add(reading)
+  host = SeriesStats()
+  for chunk in np.array_split(readings, 7):
+    host.add(chunk)
+  assert host.count == device.count and (host.min, host.max) == (device.min, device.max)
+  assert abs(host.mean - device.mean) < 1e-6
+  assert abs(host.stddev - device.stddev) < 1e-9 * device.stddev
+  for i in range(len(ALLAN_TAUS)):
+    assert abs(host.allan_deviation(i) - device.allan_deviation(i)) < 1e-9 * device.allan_deviation(i)
+
+def test_modified_allan_deviation():
+  rng = np.random.default_rng(3)
+  readings = 10_000_000 + rng.integers(-50, 51, 2000)
+  taus = (1, 2, 3, 8)
+  whole = SeriesStats(taus)
+  whole.add(readings)
+  chunked = SeriesStats(taus)
+  for chunk in np.array_split(readings, 13):
+    chunked.add(chunk)
+  # from the definition, over the phase x (in readings relative to the first)
+  x = np.concatenate([[0], np.cumsum(readings - readings[0])]).astype(np.float64)
+  n = len(x)
+  for i, m in enumerate(taus):
+    terms = [sum(x[k + 2 * m] - 2 * x[k + m] + x[k] for k in range(j, j + m)) for j in range(n - 3 * m + 1)]
+    expected = math.sqrt(sum(t * t for t in terms) / (2 * m ** 4 * len(terms))) / readings[0]
+    for stats in (whole, chunked):
+      assert abs(stats.modified_allan_deviation(i) - expected) < 1e-9 * expected, (m, expected)
+  # modified and plain Allan deviation coincide at tau0
+  assert whole.modified_allan_deviation(0) == whole.allan_deviation(0)
+
+def test_drift_and_histogram():
+  # 10 ppb/s drift on 10 MHz, a reading every 100 ms, across a ticks_us wrap
+  t = np.arange(5000) * 0.1
+  readings = np.round(100_000_000 + 1.0 * t).astype(np.int64)
+  ticks = (TICKS_PERIOD - 200_000 + np.arange(5000) * 100_000) % TICKS_PERIOD
+  stats = SeriesStats()
+  for chunk, chunk_ticks in zip(np.array_split(readings, 3), np.array_split(ticks, 3)):
+    stats.add(chunk, chunk_ticks)
+  slope, intercept = stats.drift()
+  assert abs(slope - 1.0) < 1e-3 and abs(intercept - 100_000_000) < 1, (slope, intercept)
+  starts, counts = stats.histogram(width=100)
+  assert counts.sum() == 5000 and starts[0] == 100_000_000 and len(starts) == 6
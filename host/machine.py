@@ -0,0 +1,217 @@
+'''
+Host stand-in for the `machine` module
+
+`Pin` levels live in the PIO emulator's GPIO bank, so pins driven by software
+are visible to emulated state machines and vice versa. `SoftSPI` records every
+write and decodes it as MAX7219 register frames.
+'''
+import micropython  # noqa: F401 installs time/asyncio extensions
+from pio_emulator import emulator
+
+
+class Pin():
+  IN = 0
+  OUT = 1
+  OPEN_DRAIN = 2
+  ALT = 3
+  PULL_UP = 1
+  PULL_DOWN = 2
+  IRQ_FALLING = 4
+  IRQ_RISING = 8
+
+  def __init__(self, id, mode=None, pull=None, value=None):
+    self.id = id
+    self.mode = mode
+    self.pull = pull
+    if pull == Pin.PULL_UP and id not in emulator.drivers:
+      emulator.gpio[id] = 1
+    if value is not None:
+      self.value(value)
+
+  def init(self, mode=None, pull=None, value=None):
+    self.__init__(self.id, mode, pull, value)
+
+  def value(self, v=None):
+    if v is None:
+      return emulator.gpio[self.id]
+    emulator.gpio[self.id] = 1 if v else 0
+
+  def __call__(self, v=None):
+    return self.value(v)
+
+  def on(self):
+    self.value(1)
+
+  def off(self):
+    self.value(0)
+
+  def low(self):
+    self.value(0)
+
+  def high(self):
+    self.value(1)
+
+  def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+    '''Edge interrupts are only delivered by lightsleep() on the host'''
+    if handler is None:
+      emulator.pin_irqs.pop(self.id, None)
+    else:
+      emulator.pin_irqs[self.id] = (self, handler, trigger)
+
+  def __repr__(self):
+    return f"Pin({self.id})"
+
+
+CODE_B_FONT = '0123456789-EHLP '
+SPI_DEVICES = 1  # MAX7219 models chained on each SoftSPI, e.g. for a display.ChainedDisplay
+
+class Max7219():
+  '''Register-level model of a MAX7219 fed with 16-bit frames'''
+  def __init__(self):
+    self.registers = bytearray(16)
+    self.writes = 0
+
+  def latch(self, address, data):
+    address &= 0xf
+    self.writes += 1
+    if address:  # NOOP frames don't touch any register
+      self.registers[address] = data
+
+  def digits(self):
+    '''Digit register values, leftmost (digit 8) first'''
+    return bytes(self.registers[addr] for addr in range(8, 0, -1))
+
+  def text(self):
+    '''Decode the digit registers as Code B into a display string'''
+    out = []
+    for value in self.digits():
+      out.append(CODE_B_FONT[value & 0xf])
+      if value & 0x80:
+        out.append('.')
+    return ''.join(out)
+
+
+class SoftSPI():
+  '''Recording bit-banged SPI stand-in, wired to a chain of MAX7219 models'''
+  MSB = 0
+  LSB = 1
+
+  def __init__(self, baudrate=500000, polarity=0, phase=0, bits=8, firstbit=MSB,
+               sck=None, mosi=None, miso=None, devices=None):
+    self.baudrate = baudrate
+    self.devices = [Max7219() for _ in range(SPI_DEVICES if devices is None else devices)]
+    self.transactions = 0
+    self.bytes_written = 0
+    self.log = None  # set to a list to keep a copy of every write
+
+  def init(self, baudrate=None, **kwargs):
+    if baudrate is not None:
+      self.baudrate = baudrate
+
+  def deinit(self):
+    pass
+
+  def write(self, buf):
+    '''
+    Record one transaction. Frames are shifted through the chain, so the
+    last frame written lands in the first device.
+    '''
+    buf = bytes(buf)
+    self.transactions += 1
+    self.bytes_written += len(buf)
+    if self.log is not None:
+      self.log.append(buf)
+    frames = len(buf) // 2
+    for i, device in enumerate(self.devices[:frames]):
+      offset = 2 * (frames - 1 - i)
+      device.latch(buf[offset], buf[offset + 1])
+
+  @property
+  def registers(self):
+    return self.devices[0].registers
+
+  def text(self, device=0):
+    return self.devices[device].text()
+
+  def bus_time_us(self):
+    '''Time the recorded traffic would have spent on the wire at `baudrate`'''
+    return self.bytes_written * 8 * 1_000_000 / self.baudrate
+
+
+class SPI(SoftSPI):
+  '''Hardware SPI block stand-in, recording like SoftSPI'''
+  def __init__(self, id, baudrate=1_000_000, **kwargs):
+    super().__init__(baudrate, **kwargs)
+    self.id = id
+
+
+class ADC():
+  '''Reads a fixed level; the core temperature sensor input reads 27 C unless `value` is changed'''
+  value = 14_021  # 0.706 V
+
+  def __init__(self, channel):
+    self.channel = channel
+
+  def read_u16(self):
+    return self.value
+
+
+class _Mem32():
+  '''
+  Peripheral register stand-in: remembers what was written where. Nothing
+  behind the registers is emulated; e.g. simulate.py drives a prescaled
+  input directly instead of modelling a PWM slice.
+  '''
+  def __init__(self):
+    self.registers = {}
+
+  def __getitem__(self, address):
+    return self.registers.get(address, 0)
+
+  def __setitem__(self, address, value):
+    self.registers[address] = value & 0xffffffff
+
+mem32 = _Mem32()
+
+
+def freq(hz=None):
+  if hz is None:
+    return emulator.sys_freq
+  emulator.sys_freq = hz
+
+def lightsleep(ms=None):
+  '''
+  Advance the emulator with the CPU asleep until an edge on a pin with an irq
+  handler (or `ms` of emulated time). Returns at once if nothing could wake it.
+  '''
+  irqs = emulator.pin_irqs
+  cycles = (1 << 62) if ms is None else ms * emulator.sys_freq // 1000
+  if ms is None and not any(pin in emulator.drivers for pin in irqs):
+    return
+  levels = {pin: emulator.gpio[pin] for pin in irqs}
+  woken = []
+
+  def edge():
+    for pin, (obj, handler, trigger) in irqs.items():
+      level = emulator.gpio[pin]
+      if level != levels[pin]:
+        levels[pin] = level
+        if trigger & (Pin.IRQ_RISING if level else Pin.IRQ_FALLING):
+          woken.append((obj, handler))
+    return bool(woken)
+
+  emulator.run(cycles, until=edge)
+  for obj, handler in woken:
+    handler(obj)
+
+def reset():
+  raise SystemExit("machine.reset()")
+
+def disable_irq():
+  return 0
+
+def enable_irq(state=0):
+  pass
+
+def unique_id():
+  return b'host'
@@ -0,0 +1,160 @@
+'''
+Host stand-in for the `micropython` module
+
+Importing this module (directly, or via the `machine`/`rp2` stand-ins) also
+installs the MicroPython-only extensions to `time` and `asyncio` used by the
+firmware (`time.ticks_us`, `asyncio.sleep_ms`, ...) and viper's `ptr32` and
+`uint` casts, so the unmodified sources run under CPython. `@native` and
+`@viper` functions run as plain Python.
+
+Ticks count wall clock time unless set_clock() gives another source, e.g.
+the PIO emulator's time, which runs far slower than the device would; async
+sleep_ms and wait_for_ms then wait on that clock too.
+'''
+import asyncio
+import time
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+_TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+def const(n):
+  return n
+
+def alloc_emergency_exception_buf(size):
+  pass
+
+def schedule(func, arg):
+  func(arg)
+
+def native(func):
+  return func
+
+viper = native
+
+class _Ptr32():
+  '''Viper ptr32: 32 bit word access to a buffer, wrapping stored values like machine words'''
+  def __init__(self, buf):
+    self.buf = buf if getattr(buf, 'itemsize', 0) == 4 else memoryview(buf).cast('I')
+
+  def __getitem__(self, i):
+    return self.buf[i]
+
+  def __setitem__(self, i, value):
+    self.buf[i] = value & 0xffffffff
+
+def _uint(n):
+  return n & 0xffffffff
+
+_clock_ns = time.perf_counter_ns  # what ticks count, see set_clock
+
+def set_clock(clock_ns=None):
+  '''Count ticks in `clock_ns()` nanoseconds, e.g. emulated time, or the wall clock with None'''
+  global _clock_ns
+  _clock_ns = time.perf_counter_ns if clock_ns is None else clock_ns
+
+def _ticks_ms():
+  return (_clock_ns() // 1_000_000) & TICKS_MAX
+
+def _ticks_us():
+  return (_clock_ns() // 1_000) & TICKS_MAX
+
+def _ticks_cpu():
+  return _clock_ns() & TICKS_MAX
+
+def _ticks_add(ticks, delta):
+  return (ticks + delta) & TICKS_MAX
+
+def _ticks_diff(ticks1, ticks2):
+  '''Signed difference of two ticks values, per MicroPython's modular semantics'''
+  return ((ticks1 - ticks2 + _TICKS_HALFPERIOD) & TICKS_MAX) - _TICKS_HALFPERIOD
+
+def _sleep_ms(ms):
+  time.sleep(ms / 1000)
+
+def _sleep_us(us):
+  time.sleep(us / 1_000_000)
+
+async def _async_sleep_ms(ms):
+  if _clock_ns is time.perf_counter_ns:
+    await asyncio.sleep(ms / 1000)
+    return
+  # yield until the other clock gets there, e.g. while other tasks run the emulator
+  deadline = _clock_ns() + ms * 1_000_000
+  while _clock_ns() < deadline:
+    await asyncio.sleep(0)
+
+async def _wait_for_ms(aw, timeout):
+  if _clock_ns is time.perf_counter_ns:
+    return await asyncio.wait_for(aw, timeout / 1000)
+  task = asyncio.ensure_future(aw)
+  deadline = _clock_ns() + timeout * 1_000_000
+  try:
+    while not task.done():
+      if _clock_ns() >= deadline:
+        raise asyncio.TimeoutError
+      await asyncio.sleep(0)
+    return task.result()
+  finally:
+    task.cancel()
+
+class _ThreadSafeFlag():
+  '''asyncio.ThreadSafeFlag: set() from IRQs or other threads, wait() from one task'''
+  def __init__(self):
+    self._flag = False
+    self._event = None
+    self._loop = None
+
+  def set(self):
+    self._flag = True
+    if self._event is None:
+      return
+    try:
+      running = asyncio.get_running_loop()
+    except RuntimeError:
+      running = None
+    if running is self._loop:
+      self._event.set()
+    else:
+      self._loop.call_soon_threadsafe(self._event.set)
+
+  def clear(self):
+    self._flag = False
+
+  async def wait(self):
+    while not self._flag:
+      self._loop = asyncio.get_running_loop()
+      self._event = asyncio.Event()
+      try:
+        await self._event.wait()
+      finally:
+        self._event = None
+    self._flag = False
+
+def install():
+  '''
+  Add MicroPython's extensions to CPython's `time` and `asyncio` modules,
+  and the viper code emitter's casts as builtins
+  '''
+  import builtins
+  for name, func in (('ptr32', _Ptr32), ('uint', _uint)):
+    if not hasattr(builtins, name):
+      setattr(builtins, name, func)
+  for name, func in (
+      ('ticks_ms', _ticks_ms),
+      ('ticks_us', _ticks_us),
+      ('ticks_cpu', _ticks_cpu),
+      ('ticks_add', _ticks_add),
+      ('ticks_diff', _ticks_diff),
+      ('sleep_ms', _sleep_ms),
+      ('sleep_us', _sleep_us)):
+    if not hasattr(time, name):
+      setattr(time, name, func)
+  for name, func in (
+      ('sleep_ms', _async_sleep_ms),
+      ('wait_for_ms', _wait_for_ms),
+      ('ThreadSafeFlag', _ThreadSafeFlag)):
+    if not hasattr(asyncio, name):
+      setattr(asyncio, name, func)
+
+install()
@@ -0,0 +1,588 @@
+'''
+Cycle-counting emulator for RP2040 PIO programs
+
+Assembles `@asm_pio` programs on the host (see the `rp2` stand-in) and runs
+them one system clock cycle at a time against synthetic input waveforms,
+firing `StateMachine.irq` handlers the way the rp2 port does. Good for about a
+million emulated cycles per second under CPython, so shorten the gate time
+(or the PIO clock) when simulating many measurements.
+'''
+from collections import deque
+
+NUM_GPIO = 30
+FIFO_DEPTH = 4
+INSTRUCTION_MEMORY = 32  # per PIO block, shared by its state machines' programs
+MASK = 0xffffffff
+
+SHIFT_LEFT = 0
+SHIFT_RIGHT = 1
+JOIN_NONE = 0
+JOIN_TX = 1
+JOIN_RX = 2
+
+
+class Instr():
+  '''One assembled PIO instruction, with optional `.side()` and `[delay]`'''
+  __slots__ = ('op', 'args', 'sideset', 'delay')
+
+  def __init__(self, op, args):
+    self.op = op
+    self.args = args
+    self.sideset = None
+    self.delay = 0
+
+  def side(self, value):
+    self.sideset = value
+    return self
+
+  def __getitem__(self, delay):
+    self.delay = delay
+    return self
+
+  def __repr__(self):
+    return f"{self.op}{self.args}"
+
+
+def _invert(value):
+  return ('invert', value)
+
+def _reverse(value):
+  return ('reverse', value)
+
+def _rel(index):
+  return ('rel', index)
+
+OPERANDS = {
+  'x': 'x', 'y': 'y', 'osr': 'osr', 'isr': 'isr', 'null': 'null',
+  'pins': 'pins', 'pindirs': 'pindirs', 'pin': 'pin', 'gpio': 'gpio',
+  'pc': 'pc', 'exec': 'exec', 'status': 'status',
+  'block': 'block', 'noblock': 'noblock', 'clear': 'clear', 'nowait': 'nowait',
+  'iffull': 'iffull', 'ifempty': 'ifempty',
+  'x_dec': 'x_dec', 'y_dec': 'y_dec', 'not_x': 'not_x', 'not_y': 'not_y',
+  'x_not_y': 'x_not_y', 'not_osre': 'not_osre',
+  'invert': _invert, 'reverse': _reverse, 'rel': _rel,
+}
+
+
+class Program():
+  '''Instructions, labels and config collected from an `@asm_pio` function'''
+  def __init__(self, name, config=None):
+    self.name = name
+    self.config = config or {}
+    self.instrs = []
+    self.labels = {}
+    self.wrap_target = 0
+    self.wrap = None
+    sideset_init = self.config.get('sideset_init')
+    if sideset_init is None:
+      self.sideset_count = 0
+    elif isinstance(sideset_init, (tuple, list)):
+      self.sideset_count = len(sideset_init)
+    else:
+      self.sideset_count = 1
+
+  def _emit(self, op, *args):
+    instr = Instr(op, args)
+    self.instrs.append(instr)
+    return instr
+
+  def emitters(self):
+    '''Names injected into the program function's globals while assembling'''
+    names = dict(OPERANDS)
+
+    def label(name):
+      self.labels[name] = len(self.instrs)
+
+    def wrap_target():
+      self.wrap_target = len(self.instrs)
+
+    def wrap():
+      self.wrap = len(self.instrs) - 1
+
+    def irq(*args):
+      return self._emit('irq', *args)
+
+    for op in ('jmp', 'wait', 'in_', 'out', 'push', 'pull', 'mov', 'set', 'nop'):
+      names[op] = (lambda op: lambda *args: self._emit(op, *args))(op)
+    names['irq'] = irq
+    names['label'] = label
+    names['wrap_target'] = wrap_target
+    names['wrap'] = wrap
+    return names
+
+  def finish(self):
+    if self.wrap is None:
+      self.wrap = len(self.instrs) - 1
+    return self
+
+
+def assemble(func, config=None):
+  '''Run an `@asm_pio` style function body, collecting its instructions'''
+  program = Program(func.__name__, config)
+  names = program.emitters()
+  scope = func.__globals__
+  saved = {name: scope[name] for name in names if name in scope}
+  scope.update(names)
+  try:
+    func()
+  finally:
+    for name in names:
+      if name in saved:
+        scope[name] = saved[name]
+      else:
+        del scope[name]
+  return program.finish()
+
+def assemble_one(source):
+  '''Assemble a single instruction from source text, as used by `StateMachine.exec`'''
+  program = Program('exec')
+  eval(source, program.emitters())
+  return program.instrs[-1]
+
+
+class SquareWave():
+  '''
+  Synthetic input signal. `freq` may be changed while the emulator runs, and
+  takes effect from the next half period.
+  '''
+  def __init__(self, freq, duty=0.5, phase=0.0):
+    self.freq = freq
+    self.duty = duty
+    self.phase = phase
+
+  def edges(self, sys_freq, start_cycle):
+    '''Generator of (cycle, level) transitions'''
+    t = start_cycle + self.phase * sys_freq / self.freq
+    while True:
+      period = sys_freq / self.freq
+      yield t, 1
+      t += period * self.duty
+      yield t, 0
+      t += period * (1 - self.duty)
+
+
+class StateMachineCore():
+  '''Registers, FIFOs and execution of one PIO state machine'''
+  def __init__(self, block, index):
+    self.block = block
+    self.emulator = block.emulator
+    self.index = index
+    self.id = 4 * block.index + index
+    self.program = None
+    self.running = False
+    self.handler = None
+    self.owner = None
+    self.reset()
+
+  def reset(self):
+    self.x = self.y = self.osr = self.isr = 0
+    self.isr_count = 0
+    self.osr_count = 32
+    self.rx = deque()
+    self.tx = deque()
+    self.pc = 0
+    self.delay_count = 0
+    self.irq_waiting = False
+    self.div = 1.0
+    self.acc = 0.0
+    self.rx_high_water = 0
+    self.rx_depth = FIFO_DEPTH
+
+  def init(self, program, freq=None, in_base=None, out_base=None, set_base=None,
+           jmp_pin=None, sideset_base=None, **kwargs):
+    self.reset()
+    self.program = program
+    self.in_base = _pin_id(in_base, 0)
+    self.out_base = _pin_id(out_base, 0)
+    self.set_base = _pin_id(set_base, 0)
+    self.jmp_pin = _pin_id(jmp_pin, 0)
+    self.sideset_base = _pin_id(sideset_base, 0)
+    if freq:
+      self.div = max(1.0, self.emulator.sys_freq / freq)
+    config = dict(program.config)
+    config.update(kwargs)
+    self.in_shiftdir = config.get('in_shiftdir', SHIFT_LEFT)
+    self.autopush = config.get('autopush', False)
+    self.push_thresh = config.get('push_thresh', 32) or 32
+    self.out_shiftdir = config.get('out_shiftdir', SHIFT_LEFT)
+    # joining gives the RX FIFO the TX FIFO's storage (a TX join isn't modelled)
+    self.rx_depth = 2 * FIFO_DEPTH if config.get('fifo_join') == JOIN_RX else FIFO_DEPTH
+    self.block.load(program)
+    self.code = []
+    for pc, instr in enumerate(program.instrs):
+      nxt = program.wrap_target if pc == program.wrap else pc + 1
+      self.code.append((self._op(instr), instr, nxt))
+
+  def _op(self, instr):
+    return getattr(self, '_' + instr.op.rstrip('_'))
+
+  def activate(self, value):
+    self.running = bool(value)
+    self.emulator._schedule(self)
+
+  # --- execution ---
+
+  def step(self):
+    if self.delay_count:
+      self.delay_count -= 1
+      return
+    fn, instr, nxt = self.code[self.pc]
+    if instr.sideset is not None:
+      self._sideset(instr.sideset)
+    target = fn(instr, nxt)
+    if target is not None:
+      self.pc = target
+      self.delay_count = instr.delay
+
+  def execute(self, instr):
+    '''Run a one-off instruction, as `StateMachine.exec` does'''
+    if instr.sideset is not None:
+      self._sideset(instr.sideset)
+    target = self._op(instr)(instr, self.pc)
+    if target is not None:
+      self.pc = target
+
+  def _sideset(self, value):
+    gpio = self.emulator.gpio
+    for bit in range(self.program.sideset_count):
+      gpio[self.sideset_base + bit] = (value >> bit) & 1
+
+  def _read_pins(self, base):
+    gpio = self.emulator.gpio
+    value = 0
+    for bit in range(NUM_GPIO - base):
+      value |= gpio[base + bit] << bit
+    return value
+
+  def _source(self, src):
+    if isinstance(src, tuple):
+      modifier, inner = src
+      value = self._source(inner)
+      if modifier == 'invert':
+        return ~value & MASK
+      return int(f"{value:032b}"[::-1], 2)
+    if src == 'x':
+      return self.x
+    if src == 'y':
+      return self.y
+    if src == 'osr':
+      return self.osr
+    if src == 'isr':
+      return self.isr
+    if src == 'pins':
+      return self._read_pins(self.in_base)
+    if src == 'status':
+      return MASK if len(self.tx) < FIFO_DEPTH else 0
+    if isinstance(src, int):
+      return src & MASK
+    return 0  # null
+
+  def _dest(self, dst, value):
+    value &= MASK
+    if dst == 'x':
+      self.x = value
+    elif dst == 'y':
+      self.y = value
+    elif dst == 'isr':
+      self.isr = value
+      self.isr_count = 0
+    elif dst == 'osr':
+      self.osr = value
+      self.osr_count = 0
+    elif dst == 'pins':
+      gpio = self.emulator.gpio
+      for bit in range(NUM_GPIO - self.out_base):
+        gpio[self.out_base + bit] = (value >> bit) & 1
+
+  def _irq_index(self, index):
+    if isinstance(index, tuple):  # rel()
+      index = index[1]
+      return (index & 4) | ((index + self.index) & 3)
+    return index
+
+  def _mov(self, instr, nxt):
+    dst, src = instr.args
+    value = self._source(src)
+    if dst == 'pc':
+      return value
+    if dst == 'exec':
+      raise NotImplementedError("mov(exec, ...) is not emulated")
+    self._dest(dst, value)
+    return nxt
+
+  def _set(self, instr, nxt):
+    dst, value = instr.args
+    if dst == 'pins':
+      gpio = self.emulator.gpio
+      for bit in range(5):
+        if self.set_base + bit < NUM_GPIO:
+          gpio[self.set_base + bit] = (value >> bit) & 1
+    elif dst != 'pindirs':
+      self._dest(dst, value)
+    return nxt
+
+  def _nop(self, instr, nxt):
+    return nxt
+
+  def _jmp(self, instr, nxt):
+    if len(instr.args) == 1:
+      cond, target = None, instr.args[0]
+    else:
+      cond, target = instr.args
+    target = self.program.labels[target] if isinstance(target, str) else target
+    if cond is None:
+      taken = True
+    elif cond == 'x_dec':
+      taken = self.x != 0
+      self.x = (self.x - 1) & MASK
+    elif cond == 'y_dec':
+      taken = self.y != 0
+      self.y = (self.y - 1) & MASK
+    elif cond == 'not_x':
+      taken = self.x == 0
+    elif cond == 'not_y':
+      taken = self.y == 0
+    elif cond == 'x_not_y':
+      taken = self.x != self.y
+    elif cond == 'pin':
+      taken = self.emulator.gpio[self.jmp_pin] == 1
+    elif cond == 'not_osre':
+      taken = self.osr_count < 32
+    else:
+      raise ValueError(f"unknown jmp condition {cond!r}")
+    return target if taken else nxt
+
+  def _wait(self, instr, nxt):
+    polarity, src, index = instr.args[:3]
+    if src == 'gpio':
+      level = self.emulator.gpio[index]
+    elif src == 'pin':
+      level = self.emulator.gpio[self.in_base + index]
+    else:  # irq
+      flags = self.block.irq_flags
+      index = self._irq_index(index)
+      level = flags[index]
+      if level and polarity:
+        flags[index] = 0
+        return nxt
+    return nxt if level == polarity else None
+
+  def _irq(self, instr, nxt):
+    args = instr.args
+    mode, index = (args[0], args[1]) if len(args) > 1 else ('nowait', args[0])
+    index = self._irq_index(index)
+    flags = self.block.irq_flags
+    if mode == 'clear':
+      flags[index] = 0
+      return nxt
+    if not self.irq_waiting:
+      flags[index] = 1
+      self.block.raised(index)
+      if mode != 'block':
+        return nxt
+      self.irq_waiting = True
+    if flags[index]:
+      return None
+    self.irq_waiting = False
+    return nxt
+
+  def _push(self, instr, nxt):
+    args = instr.args
+    if 'iffull' in args and self.isr_count < 32:
+      return nxt
+    if len(self.rx) >= self.rx_depth:
+      return nxt if 'noblock' in args else None
+    self.rx.append(self.isr)
+    self.rx_high_water = max(self.rx_high_water, len(self.rx))
+    self.isr = 0
+    self.isr_count = 0
+    return nxt
+
+  def _pull(self, instr, nxt):
+    args = instr.args
+    if 'ifempty' in args and self.osr_count < 32:
+      return nxt
+    if not self.tx:
+      if 'noblock' in args:
+        self.osr = self.x
+        self.osr_count = 0
+        return nxt
+      return None
+    self.osr = self.tx.popleft()
+    self.osr_count = 0
+    return nxt
+
+  def _in(self, instr, nxt):
+    src, bits = instr.args
+    bits = bits or 32
+    autopush = self.autopush and self.isr_count + bits >= self.push_thresh
+    if autopush and len(self.rx) >= self.rx_depth:
+      return None  # stalls until the push can go ahead
+    value = self._source(src) & ((1 << bits) - 1)
+    if self.in_shiftdir == SHIFT_LEFT:
+      self.isr = ((self.isr << bits) | value) & MASK
+    else:
+      self.isr = (self.isr >> bits) | (value << (32 - bits)) & MASK
+    self.isr_count = min(32, self.isr_count + bits)
+    if autopush:
+      self.rx.append(self.isr)
+      self.rx_high_water = max(self.rx_high_water, len(self.rx))
+      self.isr = 0
+      self.isr_count = 0
+    return nxt
+
+  def _out(self, instr, nxt):
+    dst, bits = instr.args
+    bits = bits or 32
+    if self.out_shiftdir == SHIFT_LEFT:
+      value = self.osr >> (32 - bits)
+      self.osr = (self.osr << bits) & MASK
+    else:
+      value = self.osr & ((1 << bits) - 1)
+      self.osr >>= bits
+    self.osr_count = min(32, self.osr_count + bits)
+    if dst == 'pc':
+      return value
+    self._dest(dst, value)
+    return nxt
+
+
+def _pin_id(pin, default):
+  if pin is None:
+    return default
+  return pin if isinstance(pin, int) else pin.id
+
+
+class PIOBlock():
+  '''Four state machines sharing eight IRQ flags'''
+  def __init__(self, emulator, index):
+    self.emulator = emulator
+    self.index = index
+    self.irq_flags = bytearray(8)
+    self.sms = [StateMachineCore(self, i) for i in range(4)]
+    self.programs = {}  # loaded program -> length
+
+  def load(self, program):
+    '''Claim instruction memory for a program, as MicroPython does on first use in a block'''
+    if program in self.programs:
+      return
+    used = sum(self.programs.values())
+    if used + len(program.instrs) > INSTRUCTION_MEMORY:
+      raise OSError(12, f"no space in PIO{self.index} for {program.name} "
+                        f"({len(program.instrs)} instructions, {used} of {INSTRUCTION_MEMORY} used)")
+    self.programs[program] = len(program.instrs)
+
+  def remove(self, program=None):
+    if program is None:
+      self.programs.clear()
+    else:
+      self.programs.pop(program, None)
+
+  def raised(self, index):
+    if index < 4 and self.sms[index].handler is not None:
+      self.emulator.pending.append(self.sms[index])
+
+
+class Emulator():
+  '''System clock, GPIO bank and both PIO blocks'''
+  def __init__(self, sys_freq=125_000_000):
+    self.sys_freq = sys_freq
+    self.reset()
+
+  def reset(self):
+    self.cycle = 0
+    self.gpio = bytearray(NUM_GPIO)
+    self.drivers = {}
+    self.pin_irqs = {}  # gpio -> (Pin, handler, trigger), see machine.lightsleep
+    self._next_edge = float('inf')
+    self.blocks = [PIOBlock(self, 0), PIOBlock(self, 1)]
+    self.active = []
+    self.dma = []  # active DMA channels, see rp2.DMA
+    self.pending = deque()
+    self.in_irq = False
+    self.irq_count = 0
+
+  @property
+  def time_s(self):
+    return self.cycle / self.sys_freq
+
+  def time_ns(self):
+    '''Emulated time, e.g. for micropython.set_clock'''
+    return self.cycle * 1_000_000_000 // self.sys_freq
+
+  def state_machine(self, id):
+    return self.blocks[id // 4].sms[id % 4]
+
+  def drive(self, pin, waveform):
+    '''Drive a GPIO from a waveform object providing `edges(sys_freq, start_cycle)`'''
+    pin = _pin_id(pin, 0)
+    edges = waveform.edges(self.sys_freq, self.cycle)
+    self.drivers[pin] = [edges, *next(edges)]
+    self._update_inputs()
+
+  def undrive(self, pin):
+    self.drivers.pop(_pin_id(pin, 0), None)
+    self._update_inputs()
+
+  def _update_inputs(self):
+    nearest = float('inf')
+    for pin, driver in self.drivers.items():
+      edges, at, level = driver
+      while at <= self.cycle:
+        self.gpio[pin] = level
+        at, level = next(edges)
+      driver[1], driver[2] = at, level
+      nearest = min(nearest, at)
+    self._next_edge = nearest
+
+  def _schedule(self, core):
+    if core.running and core not in self.active:
+      self.active.append(core)
+    elif not core.running and core in self.active:
+      self.active.remove(core)
+
+  def _dispatch(self):
+    self.in_irq = True
+    try:
+      while self.pending:
+        core = self.pending.popleft()
+        self.irq_count += 1
+        core.handler(core.owner)
+        # the rp2 port acknowledges the flag once the handler has run
+        core.block.irq_flags[core.index] = 0
+    finally:
+      self.in_irq = False
+
+  def run(self, cycles=1, until=None):
+    '''
+    Advance `cycles` system clock cycles, or stop early once `until()` is true.
+    Returns the number of cycles run.
+    '''
+    start = self.cycle
+    end = start + cycles
+    active = self.active
+    while self.cycle < end:
+      if self.cycle >= self._next_edge:
+        self._update_inputs()
+      for core in active:
+        if core.div == 1:
+          core.step()
+        else:
+          core.acc += 1
+          if core.acc >= core.div:
+            core.acc -= core.div
+            core.step()
+      for channel in self.dma:
+        channel.step()
+      self.cycle += 1
+      if self.pending and not self.in_irq:
+        self._dispatch()
+      if until is not None and until():
+        break
+    return self.cycle - start
+
+  def run_seconds(self, seconds):
+    return self.run(int(seconds * self.sys_freq))
+
+
+emulator = Emulator()
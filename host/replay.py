@@ -0,0 +1,111 @@
+'''
+Replay a flash recording through the firmware's calculation and display code
+
+Reads a ring file written by recorder.py (copy it off the board with e.g.
+`mpremote cp :recording.bin .`), oldest block first, and runs every reading
+through the firmware's integer calculation (calculate_decihertz and
+calculate_display_decihertz, under the correction recorded in its block),
+encode_decihertz and Display.display_code_b as fast as it can, printing what
+the LED display showed in the default 'raw' DISPLAY_MODE:
+
+    python host/replay.py recording.bin > replay.csv
+    python host/replay.py recording.bin --expect replay.csv
+
+With --expect, compares against an earlier replay's output instead, exiting
+with status 1 if any reading now calculates or displays differently.
+'''
+import argparse
+import os
+import sys
+import time
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HOST_DIR, os.path.dirname(HOST_DIR)]
+
+import micropython  # noqa: E402,F401
+from constants import MOSI, CS, CK, RECORDER_BLOCK_SIZE  # noqa: E402
+from display import Display  # noqa: E402
+from recorder import BLOCK_HEADER_SIZE, read_block_header  # noqa: E402
+from telemetry import FLAG_IDLE, FLAG_DROPPED, CHANNEL_SHIFT  # noqa: E402
+from telemetry_decode import Decoder  # noqa: E402
+from transport import SoftSPITransport  # noqa: E402
+import util  # noqa: E402
+from util import calculate_decihertz, calculate_display_decihertz, encode_decihertz, \
+  convert_clock_count, convert_pulse_count  # noqa: E402
+
+HEADER = "seq,channel,ticks_us,clock_count,pulse_count,frequency_hz,display"
+
+def read_blocks(f, block_size=RECORDER_BLOCK_SIZE):
+  '''(correction, record bytes) of each written block, oldest first'''
+  f.seek(0, 2)
+  blocks = []
+  for index in range(f.tell() // block_size):
+    header = read_block_header(f, index, block_size)
+    if header is not None:
+      blocks.append((header[0], index, header[1], header[2]))
+  for _, index, used, correction in sorted(blocks):
+    f.seek(index * block_size + BLOCK_HEADER_SIZE)
+    yield correction, f.read(used)
+
+def replay(records, disp):
+  '''Render each (correction, record) on `disp`, yielding its CSV line'''
+  digits = bytearray(8)
+  saved = util.correction
+  try:
+    for correction, (seq, ticks_us, clock_raw, pulse_raw, flags) in records:
+      channel = flags >> CHANNEL_SHIFT
+      if flags & FLAG_IDLE:
+        disp.display('-')
+        yield f"idle,{channel},,,,,{disp.spi.text()}"
+        continue
+      if correction != util.correction:
+        util.set_correction(*correction)
+      decihertz = calculate_decihertz(clock_raw, pulse_raw)
+      disp.display_code_b(encode_decihertz(calculate_display_decihertz(clock_raw, pulse_raw), digits))
+      note = ' dropped' if flags & FLAG_DROPPED else ''
+      yield (f"{seq},{channel},{ticks_us},{convert_clock_count(clock_raw)},{convert_pulse_count(pulse_raw)},"
+             f"{decihertz // 10}.{decihertz % 10},{disp.spi.text()}{note}")
+  finally:
+    util.set_correction(*saved)
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument('recording', help='ring file copied from the board')
+  parser.add_argument('--block-size', type=int, default=RECORDER_BLOCK_SIZE)
+  parser.add_argument('--expect', metavar='CSV', help='compare with the output of an earlier replay')
+  args = parser.parse_args(argv)
+
+  decoder = Decoder()
+  records = []
+  with open(args.recording, 'rb') as f:
+    for correction, data in read_blocks(f, args.block_size):
+      records += ((correction, record) for record in decoder.feed(data))
+      # records never span blocks
+      decoder.buffer.clear()
+
+  # the device's pins need SoftSPI; opened directly so stdout is only the CSV
+  disp = Display(MOSI, CS, CK, transport=SoftSPITransport(MOSI, CS, CK))
+  start = time.perf_counter()
+  lines = [HEADER] + list(replay(records, disp))
+  elapsed = time.perf_counter() - start
+
+  status = 0
+  if args.expect:
+    with open(args.expect) as f:
+      expected = f.read().splitlines()
+    differences = [(n, want, got) for n, (want, got) in enumerate(zip(expected, lines), 1) if want != got]
+    for n, want, got in differences[:10]:
+      print(f"line {n}: expected {want!r}, got {got!r}", file=sys.stderr)
+    if len(expected) != len(lines):
+      print(f"expected {len(expected)} lines, got {len(lines)}", file=sys.stderr)
+    status = 1 if differences or len(expected) != len(lines) else 0
+  else:
+    for line in lines:
+      print(line)
+
+  print(f"{len(records)} records in {elapsed:.3f} s ({len(records) / max(elapsed, 1e-9):.0f}/s), "
+        f"{decoder.missing} missing, {decoder.bad_records} bad", file=sys.stderr)
+  return status
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,182 @@
+'''
+Host stand-in for the `rp2` module, backed by the PIO emulator
+'''
+import micropython  # noqa: F401 installs time/asyncio extensions
+from pio_emulator import emulator, assemble, assemble_one, SHIFT_LEFT, SHIFT_RIGHT, MASK, \
+  JOIN_NONE, JOIN_TX, JOIN_RX, FIFO_DEPTH
+
+
+def asm_pio(**config):
+  def decorator(func):
+    return assemble(func, config)
+  return decorator
+
+
+class PIO():
+  IN_LOW = 0
+  IN_HIGH = 1
+  OUT_LOW = 2
+  OUT_HIGH = 3
+  SHIFT_LEFT = SHIFT_LEFT
+  SHIFT_RIGHT = SHIFT_RIGHT
+  JOIN_NONE = JOIN_NONE
+  JOIN_TX = JOIN_TX
+  JOIN_RX = JOIN_RX
+  IRQ_SM0 = 0x100
+  IRQ_SM1 = 0x200
+  IRQ_SM2 = 0x400
+  IRQ_SM3 = 0x800
+
+  def __init__(self, id):
+    self.id = id
+    self._block = emulator.blocks[id]
+
+  def state_machine(self, id, program=None, **kwargs):
+    return StateMachine(4 * self.id + id, program, **kwargs)
+
+  def remove_program(self, program=None):
+    self._block.remove(program)
+
+
+class StateMachine():
+  def __init__(self, id, program=None, **kwargs):
+    self.id = id
+    self._core = emulator.state_machine(id)
+    self._core.owner = self
+    if program is not None:
+      self.init(program, **kwargs)
+
+  def init(self, program, freq=-1, **kwargs):
+    self._core.init(program, freq=None if freq < 0 else freq, **kwargs)
+
+  def active(self, value=None):
+    if value is None:
+      return self._core.running
+    self._core.activate(value)
+
+  def restart(self):
+    core = self._core
+    core.pc = 0
+    core.delay_count = 0
+    core.isr = core.isr_count = 0
+    core.irq_waiting = False
+
+  def exec(self, instr):
+    self._core.execute(assemble_one(instr))
+
+  def put(self, value, shift=0):
+    core = self._core
+    values = value if isinstance(value, (list, tuple, bytes, bytearray)) or hasattr(value, 'typecode') else (value,)
+    for v in values:
+      # blocking put: let the state machines run until the TX FIFO has room
+      if len(core.tx) >= 4:
+        emulator.run(1 << 40, until=lambda: len(core.tx) < 4)
+      core.tx.append((v << shift) & MASK)
+
+  def get(self, buf=None, shift=0):
+    core = self._core
+    if buf is not None:
+      for i in range(len(buf)):
+        buf[i] = self.get(shift=shift)
+      return buf
+    if not core.rx:
+      # blocking get: the CPU stalls while the PIO keeps running
+      if not core.running:
+        raise RuntimeError(f"get() on stopped state machine {self.id} would block forever")
+      emulator.run(1 << 40, until=lambda: bool(core.rx))
+    return core.rx.popleft() >> shift
+
+  def rx_fifo(self):
+    return len(self._core.rx)
+
+  def tx_fifo(self):
+    return len(self._core.tx)
+
+  def irq(self, handler=None, trigger=0, hard=False):
+    self._core.handler = handler
+
+
+PIO_BASES = (0x50200000, 0x50300000)
+PIO_TXF0 = 0x10
+PIO_RXF0 = 0x20
+
+
+class DMA():
+  '''
+  DMA channel stand-in: moves words between state machine FIFOs (given by
+  register address) and buffers, one per emulated cycle while paced by the FIFO.
+  '''
+  def __init__(self):
+    self.read = self.write = None
+    self.count = 0
+    self.ctrl = None
+    self._handler = None
+
+  def pack_ctrl(self, default=None, **kwargs):
+    ctrl = dict(default or {})
+    ctrl.update(kwargs)
+    return ctrl
+
+  def config(self, read=None, write=None, count=None, ctrl=None, trigger=False):
+    if read is not None:
+      self.read = read
+    if write is not None:
+      self.write = write
+    if count is not None:
+      self.count = count
+    if ctrl is not None:
+      self.ctrl = ctrl
+    self._src = self._fifo(self.read, PIO_RXF0)
+    self._dst = self._fifo(self.write, PIO_TXF0)
+    self._ri = self._wi = 0
+    if trigger:
+      self.active(1)
+
+  @staticmethod
+  def _fifo(address, offset):
+    '''The emulated state machine whose FIFO register is at `address`, if it is one'''
+    if not isinstance(address, int):
+      return None
+    for pio, base in enumerate(PIO_BASES):
+      if base + offset <= address < base + offset + 16:
+        return emulator.state_machine(4 * pio + (address - base - offset) // 4)
+    raise NotImplementedError(f"DMA from/to {address:#x}")
+
+  def active(self, value=None):
+    if value is None:
+      return self in emulator.dma
+    if value and self.count and self not in emulator.dma:
+      emulator.dma.append(self)
+    elif not value and self in emulator.dma:
+      emulator.dma.remove(self)
+
+  def irq(self, handler=None, hard=False):
+    self._handler = handler
+
+  def close(self):
+    self.active(0)
+
+  def step(self):
+    src, dst = self._src, self._dst
+    # paced by the FIFO's data request signal
+    if src is not None and not src.rx or dst is not None and len(dst.tx) >= FIFO_DEPTH:
+      return
+    if src is not None:
+      value = src.rx.popleft()
+    else:
+      value = self.read[self._ri]
+      self._ri += 1
+    if dst is not None:
+      dst.tx.append(value)
+    else:
+      self.write[self._wi] = value
+      self._wi += 1
+    self.count -= 1
+    if not self.count:
+      self.active(0)
+      if self._handler is not None:
+        self._handler(self)
+
+
+def bootsel_button():
+  return 0
@@ -0,0 +1,170 @@
+'''
+Run the firmware's counter and display pipeline on the host
+
+Drives `controller.init_counter` and `controller.display_loop` against the PIO
+emulator with a synthetic input signal, e.g.
+
+    python host/simulate.py --input-hz 10e6 --gate-ms 10 -n 20 --profile
+'''
+import argparse
+import os
+import sys
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HOST_DIR, os.path.dirname(HOST_DIR)]
+
+import asyncio  # noqa: E402
+import time  # noqa: E402
+
+import micropython  # noqa: E402
+import machine  # noqa: E402
+import constants  # noqa: E402
+from pio_emulator import emulator, SquareWave  # noqa: E402
+
+CHUNK_CYCLES = 10_000  # emulated cycles between yields to the display loop
+
+def configure(pio_freq=None, gate_ms=None, wide=None):
+  '''
+  Override timebase and counter constants before the firmware modules import them.
+  Must be called before importing controller/util.
+  '''
+  if wide is not None:
+    constants.WIDE_COUNT = wide
+  if pio_freq is not None:
+    constants.SYS_FREQ = constants.PIO_FREQ = int(pio_freq)
+    emulator.sys_freq = int(pio_freq)
+  if gate_ms is not None:
+    constants.GATE_MS = gate_ms
+    constants.GATE_CYCLES = int(constants.PIO_FREQ * gate_ms // 1000)
+
+async def run_pio(queues, measurements):
+  '''Step the emulator, yielding to asyncio between chunks, until enough measurements are queued'''
+  while sum(queue.count for queue in queues) < measurements:
+    emulator.run(CHUNK_CYCLES)
+    await asyncio.sleep(0)
+
+async def simulate(disp, queues, gates, measurements, output=None, latency=None, local=None):
+  '''
+  Run one display loop per channel's (queue, gate) until `measurements` IRQs in total.
+  `local` is the output.LocalOutput at the end of `output`, to run its display refresh task.
+  '''
+  import controller
+  display_tasks = [
+    asyncio.create_task(controller.display_loop(disp, queue, gate, output=output, latency=latency))
+    for queue, gate in zip(queues, gates)]
+  display_tasks += [asyncio.create_task(controller.poll_period(gate.period))
+                    for gate in gates if gate.period is not None]
+  if local is not None and not local.inline:
+    display_tasks.append(asyncio.create_task(local.refresh()))
+  await run_pio(queues, measurements)
+  # let the display loops drain the last measurements
+  while not all(queue.empty() for queue in queues):
+    await asyncio.sleep(0.001)
+  await asyncio.sleep(0.01)
+  for task in display_tasks:
+    task.cancel()
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument('--input-hz', type=float, default=1e6, help='input square wave frequency')
+  parser.add_argument('--input-b-hz', type=float, default=None,
+                      help='also run counter channel B on PIO1 with this input frequency')
+  parser.add_argument('--hf-prescale', type=int, default=None, metavar='N',
+                      help='measure through the HF input prescaler dividing by N')
+  parser.add_argument('--gate-ms', type=float, default=10, help='gate time')
+  parser.add_argument('--pio-freq', type=float, default=None, help='override PIO/system clock')
+  parser.add_argument('--wide', action='store_true', help='run the wide (64 bit) counter programs')
+  parser.add_argument('-n', '--measurements', type=int, default=5)
+  parser.add_argument('--auto-range', action='store_true', help='auto-range the gate time')
+  parser.add_argument('--chain', type=int, default=1, metavar='N',
+                      help='N daisy-chained displays, one per channel')
+  parser.add_argument('--dual-core', action='store_true', help='display and print from a second thread')
+  parser.add_argument('--telemetry', metavar='PATH', help='write binary telemetry records to PATH')
+  parser.add_argument('--record', metavar='PATH', help='record readings to a ring file at PATH, see replay.py')
+  parser.add_argument('--latency', action='store_true', help='report per-stage latency histograms')
+  parser.add_argument('--wall-clock', action='store_true',
+                      help="count ticks in host time, not emulated time, e.g. to time the host's own stages")
+  parser.add_argument('--profile', action='store_true', help='profile with cProfile')
+  args = parser.parse_args(argv)
+
+  configure(args.pio_freq, args.gate_ms, args.wide)
+  if not args.wall_clock:
+    # time passes as it would on the device, however slowly the emulator runs
+    micropython.set_clock(emulator.time_ns)
+
+  import controller
+  from constants import MOSI, CS, CK, COUNTER_INPUT_PIN, \
+    COUNTER_B_INPUT_PIN, COUNTER_B_GATE_PIN, COUNTER_B_PULSE_FIN_PIN, \
+    HF_INPUT_PIN, HF_GATE_PIN, HF_PULSE_FIN_PIN
+  from display import Display, ChainedDisplay
+  from measurement_ring import MeasurementRing
+
+  machine.SPI_DEVICES = args.chain
+  disp = Display(MOSI, CS, CK) if args.chain == 1 else ChainedDisplay(MOSI, CS, CK, args.chain)
+  queue = MeasurementRing(constants.MEASUREMENT_RING_SIZE, wide=args.wide)
+  if args.hf_prescale:
+    from prescaler import Prescaler
+    prescaler = Prescaler(HF_INPUT_PIN, args.hf_prescale)
+    # the PWM slice isn't emulated: drive its output with the divided input instead
+    emulator.drive(prescaler.output_pin, SquareWave(args.input_hz / args.hf_prescale))
+    gate = controller.init_counter(queue, input_pin=prescaler.output_pin, gate_pin=HF_GATE_PIN,
+                                   pulse_fin_pin=HF_PULSE_FIN_PIN, prescaler=prescaler)
+  else:
+    emulator.drive(COUNTER_INPUT_PIN, SquareWave(args.input_hz))
+    gate = controller.init_counter(queue)
+  queues, gates = [queue], [gate]
+  if args.input_b_hz is not None:
+    emulator.drive(COUNTER_B_INPUT_PIN, SquareWave(args.input_b_hz))
+    queues.append(MeasurementRing(constants.MEASUREMENT_RING_SIZE, channel=1, wide=args.wide))
+    gates.append(controller.init_counter(queues[1], pio=1, input_pin=COUNTER_B_INPUT_PIN,
+                                         gate_pin=COUNTER_B_GATE_PIN,
+                                         pulse_fin_pin=COUNTER_B_PULSE_FIN_PIN))
+  for gate in gates:
+    gate.auto = args.auto_range
+
+  from output import LocalOutput, start_output_core
+  from latency import LatencyProfile
+  latency = LatencyProfile() if args.latency else None
+  if args.telemetry:
+    from telemetry import TelemetryOutput
+    output = TelemetryOutput(disp, open(args.telemetry, 'wb'), latency=latency, inline=args.dual_core)
+  else:
+    output = LocalOutput(disp, latency=latency, inline=args.dual_core)
+  local = output
+  recorder = None
+  if args.record:
+    from recorder import Recorder, RecordingOutput
+    recorder = Recorder(args.record, inline=True)
+    output = RecordingOutput(output, recorder)
+  if args.dual_core:
+    output = start_output_core(output)
+
+  def run():
+    asyncio.run(simulate(disp, queues, gates, args.measurements, output, latency, local))
+    if args.dual_core:
+      while not output.readings.empty():
+        time.sleep(0.001)
+      output.readings.closed = True
+
+  if args.profile:
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.runcall(run)
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+  else:
+    run()
+
+  print(f"Emulated {emulator.time_s:.6f} s ({emulator.cycle} cycles), {emulator.irq_count} counter IRQs")
+  texts = ' '.join(f"'{disp.spi.text(device)}'" for device in range(disp.devices))
+  print(f"Display: {texts}, {disp.spi.bytes_written} SPI bytes in {disp.spi.transactions} transactions")
+  for queue in queues:
+    print(f"Ring {queue.channel}: {queue.stats()}")
+  if latency is not None:
+    latency.report()
+  if recorder is not None:
+    recorder.close()
+    print(f"Recorded {recorder.written} block writes to {args.record}")
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,112 @@
+'''
+Decode binary telemetry captured from the counter's USB serial port
+
+Resynchronizes on the sync word, skipping interleaved text and corrupt
+records, and reconstructs frequencies with the firmware's own util functions:
+
+    python host/telemetry_decode.py capture.bin
+    cat /dev/ttyACM0 | python host/telemetry_decode.py -
+'''
+import argparse
+import os
+import sys
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HOST_DIR, os.path.dirname(HOST_DIR)]
+
+import micropython  # noqa: E402,F401
+from telemetry import RECORD_SIZE, record_size, FLAG_IDLE, FLAG_DROPPED, CHANNEL_SHIFT, unpack_record  # noqa: E402
+from util import calculate_decihertz, convert_clock_count, convert_pulse_count  # noqa: E402
+
+SYNC_BYTES = b'\xa5\x5a'
+CHUNK_SIZE = 1 << 16
+
+class Decoder():
+  '''Incremental decoder: feed() bytes, get back decoded records'''
+  def __init__(self):
+    self.buffer = bytearray()
+    self.records = 0
+    self.skipped_bytes = 0
+    self.bad_records = 0
+    self.missing = 0
+    self._last_seq = {}  # per counter channel
+
+  def feed(self, data):
+    buf = self.buffer
+    buf += data
+    records = []
+    pos = 0
+    while True:
+      start = buf.find(SYNC_BYTES, pos)
+      if start < 0:
+        # keep a trailing sync byte in case the word is split across chunks
+        keep = 1 if buf[-1:] == SYNC_BYTES[:1] else 0
+        self.skipped_bytes += len(buf) - pos - keep
+        pos = len(buf) - keep
+        break
+      self.skipped_bytes += start - pos
+      if start + RECORD_SIZE > len(buf):
+        pos = start
+        break
+      size = record_size(buf, start)
+      if start + size > len(buf):
+        pos = start
+        break
+      record = unpack_record(buf, start)
+      if record is None:
+        self.bad_records += 1
+        self.skipped_bytes += 1
+        pos = start + 1
+        continue
+      records.append(record)
+      self._track(record)
+      pos = start + size
+    del buf[:pos]
+    return records
+
+  def _track(self, record):
+    seq, _, _, _, flags = record
+    self.records += 1
+    if flags & FLAG_IDLE:
+      return
+    channel = flags >> CHANNEL_SHIFT
+    last_seq = self._last_seq.get(channel)
+    if last_seq is not None and seq > last_seq + 1:
+      self.missing += seq - last_seq - 1
+    self._last_seq[channel] = seq
+
+def format_record(record):
+  seq, ticks_us, clock_raw, pulse_raw, flags = record
+  channel = flags >> CHANNEL_SHIFT
+  if flags & FLAG_IDLE:
+    return f"idle,{channel}"
+  decihertz = calculate_decihertz(clock_raw, pulse_raw)
+  note = ' dropped' if flags & FLAG_DROPPED else ''
+  return (f"{seq},{channel},{ticks_us},{convert_clock_count(clock_raw)},{convert_pulse_count(pulse_raw)},"
+          f"{decihertz // 10}.{decihertz % 10}{note}")
+
+def decode_file(f, out=sys.stdout):
+  decoder = Decoder()
+  print("seq,channel,ticks_us,clock_count,pulse_count,frequency_hz", file=out)
+  while True:
+    chunk = f.read(CHUNK_SIZE)
+    if not chunk:
+      break
+    for record in decoder.feed(chunk):
+      print(format_record(record), file=out)
+  return decoder
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument('capture', help="capture file, or '-' for stdin")
+  args = parser.parse_args(argv)
+  if args.capture == '-':
+    decoder = decode_file(sys.stdin.buffer)
+  else:
+    with open(args.capture, 'rb') as f:
+      decoder = decode_file(f)
+  print(f"{decoder.records} records, {decoder.missing} missing, {decoder.bad_records} bad, "
+        f"{decoder.skipped_bytes} bytes skipped", file=sys.stderr)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,2 @@
+'''Host stand-in for MicroPython's `uarray` alias'''
+from array import *  # noqa: F401,F403
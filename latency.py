@@ -0,0 +1,97 @@
+'''
+Per-stage latency histograms for the measurement-to-display path
+
+Stages are timed with time.ticks_us from the counter IRQ (the ticks captured
+into the MeasurementRing) to the last SPI write of the reading. Counts go into
+fixed power-of-two microsecond buckets, so recording doesn't allocate until
+a stage's total (a Python int, for the mean, so it never wraps) outgrows a
+small int after some 18 minutes of summed latency.
+Instrumentation is only active when a LatencyProfile is passed in; otherwise
+each stage costs a single `is not None` test.
+'''
+import uarray as array
+
+# stages, in pipeline order
+QUEUE = 0  # IRQ capture -> dequeued by display loop
+CALCULATE = 1  # calculate_decihertz and stats
+PRINT = 2  # serial output
+FORMAT = 3  # encode into Code B digits
+DISPLAY = 4  # render and SPI writes
+TOTAL = 5  # IRQ capture -> last SPI write
+STAGE_NAMES = ('queue', 'calculate', 'print', 'format', 'display', 'total')
+
+BUCKETS = 24  # bucket i counts latencies in [2**(i-1), 2**i) us, the last is open ended
+
+def bucket(us):
+  '''Index of the power-of-two bucket for a latency in us'''
+  i = 0
+  while us and i < BUCKETS - 1:
+    us >>= 1
+    i += 1
+  return i
+
+class LatencyProfile():
+  def __init__(self):
+    self.histograms = array.array('I', [0] * (len(STAGE_NAMES) * BUCKETS))
+    self.max_us = array.array('I', [0] * len(STAGE_NAMES))
+    self.total_us = [0] * len(STAGE_NAMES)
+    self.reset()
+
+  def reset(self):
+    for i in range(len(self.histograms)):
+      self.histograms[i] = 0
+    for i in range(len(STAGE_NAMES)):
+      self.max_us[i] = 0
+      self.total_us[i] = 0
+    self.queue_high_water = 0
+    self.missed = 0
+
+  def record(self, stage, us):
+    if us < 0:
+      us = 0
+    self.histograms[stage * BUCKETS + bucket(us)] += 1
+    if us > self.max_us[stage]:
+      self.max_us[stage] = us
+    self.total_us[stage] += us
+
+  def queue_depth(self, depth, missed):
+    '''Record the queue depth seen at dequeue, and the running missed measurement count'''
+    if depth > self.queue_high_water:
+      self.queue_high_water = depth
+    self.missed = missed
+
+  def count(self, stage):
+    start = stage * BUCKETS
+    return sum(self.histograms[start:start + BUCKETS])
+
+  def percentile(self, stage, fraction):
+    '''Upper bound (us) of the bucket holding the given fraction of samples'''
+    n = self.count(stage)
+    if not n:
+      return None
+    target = fraction * n
+    seen = 0
+    start = stage * BUCKETS
+    for i in range(BUCKETS):
+      seen += self.histograms[start + i]
+      if seen >= target:
+        return (1 << i) - 1
+    return self.max_us[stage]
+
+  def report(self):
+    '''Print a summary table; call from the REPL or the serial command loop'''
+    print("stage       count    mean_us    p50<=us    p99<=us     max_us")
+    for stage, name in enumerate(STAGE_NAMES):
+      n = self.count(stage)
+      if not n:
+        continue
+      # n.b. MicroPython can't join adjacent f-strings
+      print(f"{name:<10}{n:>6}{self.total_us[stage] // n:>11}" +
+            f"{self.percentile(stage, 0.5):>11}{self.percentile(stage, 0.99):>11}{self.max_us[stage]:>11}")
+    print(f"queue high water {self.queue_high_water}, missed measurements {self.missed}")
+
+  def histogram(self, stage):
+    '''Non-empty (bucket upper bound us, count) pairs for one stage'''
+    start = stage * BUCKETS
+    return [((1 << i) - 1, self.histograms[start + i]) for i in range(BUCKETS)
+            if self.histograms[start + i]]
@@ -2,7 +2,11 @@
 Main module for 7-segment LED project
 '''
 
-import controller
+import boot_timeline
+boot_timeline.mark('main')
+
+import controller  # noqa: E402
+boot_timeline.mark('imports')
 
 def main():
   controller.main()
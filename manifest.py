@@ -0,0 +1,11 @@
+# Freezes the counter's modules into a MicroPython firmware image (make firmware),
+# so they run from flash without being loaded or compiled at boot. main.py stays on
+# the filesystem. See https://docs.micropython.org/en/latest/reference/manifest.html
+include("$(PORT_DIR)/boards/manifest.py")
+
+for name in (
+    "autorange", "boot_timeline", "burst", "compensation", "constants", "controller", "display",
+    "latency", "measurement_ring", "output", "period", "power", "prescaler", "reciprocal_counter",
+    "reciprocal_counter_wide", "recorder", "stats", "telemetry", "timebase", "transport", "util",
+    "test_display"):
+    module(name + ".py")
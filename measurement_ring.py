@@ -0,0 +1,194 @@
+'''
+Fixed-capacity ring of raw counter measurements
+
+Filled from the counter IRQ handler without allocating: the state machines'
+FIFOs are read straight into preallocated per-slot memoryviews, so neither the
+32 bit counts (which would be heap-allocated big ints on the rp2 port) nor the
+slots themselves create garbage. Single producer (IRQ), single consumer.
+'''
+import asyncio
+import time
+import uarray as array
+
+from constants import MAX_COUNT, MAX_WIDE_COUNT
+
+class MeasurementRing():
+  '''
+  Ring of (clock_raw, pulse_raw, ticks_us) slots with overflow accounting.
+  Each counter channel fills its own ring, tagged with the channel number.
+  When the counter measures a prescaled input, `prescale` scales pulse counts
+  back up to input cycles as they're read out.
+  With `wide` state machines, each slot holds a (low, carry) pair of words per count,
+  combined into one raw count over MAX_COUNT by get() if there were carries.
+  '''
+  def __init__(self, capacity, channel=0, prescale=1, wide=False):
+    self.channel = channel
+    self.prescale = prescale
+    self.words = words = 2 if wide else 1
+    # one slot is kept free to tell full from empty
+    self.size = capacity + 1
+    self.clock = array.array("I", [0] * (words * self.size))
+    self.pulse = array.array("I", [0] * (words * self.size))
+    self.ticks = array.array("I", [0] * self.size)
+    clock_mv = memoryview(self.clock)
+    pulse_mv = memoryview(self.pulse)
+    self._clock_slots = [clock_mv[words * i:words * (i + 1)] for i in range(self.size)]
+    self._pulse_slots = [pulse_mv[words * i:words * (i + 1)] for i in range(self.size)]
+    self._wi = 0
+    self._ri = 0
+    self._full = False
+    # set whenever a measurement is added, so the consumer can sleep until then
+    self.flag = asyncio.ThreadSafeFlag()
+    self.count = 0  # measurements accepted
+    self.dropped = 0  # measurements discarded because the ring was full
+    self.overflows = 0  # number of times the ring filled up
+
+  def empty(self):
+    return self._ri == self._wi
+
+  def full(self):
+    return (self._wi + 1) % self.size == self._ri
+
+  def qsize(self):
+    return (self._wi - self._ri) % self.size
+
+  def fill(self, sm_clock, sm_pulse):
+    '''
+    Drain one measurement from the clock and pulse state machines into the
+    next free slot. IRQ safe: no allocation, no blocking beyond the FIFO reads.
+    '''
+    wi = self._wi
+    if (wi + 1) % self.size == self._ri:
+      # ring full: still drain the FIFOs so the state machines keep running
+      sm_clock.get(self._clock_slots[wi])
+      sm_pulse.get(self._pulse_slots[wi])
+      self.dropped += 1
+      if not self._full:
+        self._full = True
+        self.overflows += 1
+      return
+    sm_clock.get(self._clock_slots[wi])
+    sm_pulse.get(self._pulse_slots[wi])
+    self.ticks[wi] = time.ticks_us()
+    self._full = False
+    self.count += 1
+    self._wi = (wi + 1) % self.size
+    self.flag.set()
+
+  def put(self, clock_raw, pulse_raw, ticks_us=None):
+    '''Add a measurement from already-read values (tests and replay)'''
+    wi = self._wi
+    if (wi + 1) % self.size == self._ri:
+      self.dropped += 1
+      if not self._full:
+        self._full = True
+        self.overflows += 1
+      return False
+    self._store(self.clock, wi, int(clock_raw))
+    self._store(self.pulse, wi, int(pulse_raw))
+    self.ticks[wi] = time.ticks_us() if ticks_us is None else ticks_us
+    self._full = False
+    self.count += 1
+    self._wi = (wi + 1) % self.size
+    self.flag.set()
+    return True
+
+  def _store(self, counts, i, raw):
+    if self.words == 1:
+      counts[i] = raw
+      return
+    counts[2 * i] = raw & MAX_COUNT
+    counts[2 * i + 1] = raw >> 32 if raw > MAX_COUNT else MAX_COUNT
+
+  def _load(self, counts, i):
+    if self.words == 1:
+      return counts[i]
+    raw = counts[2 * i]
+    carry = counts[2 * i + 1]
+    return raw if carry == MAX_COUNT else carry << 32 | raw
+
+  def put_sync(self, item, block=False):
+    '''`ThreadSafeQueue` compatible put of a (clock_raw, pulse_raw) pair'''
+    if not self.put(item[0], item[1]):
+      raise IndexError
+
+  def get(self):
+    '''Remove and return the oldest (clock_raw, pulse_raw, ticks_us) measurement'''
+    ri = self._ri
+    if ri == self._wi:
+      raise IndexError
+    pulse_raw = self._load(self.pulse, ri)
+    if self.prescale != 1:
+      pulses = self.prescale * ((MAX_WIDE_COUNT if pulse_raw > MAX_COUNT else MAX_COUNT) - pulse_raw)
+      pulse_raw = MAX_COUNT - pulses if pulses <= MAX_COUNT else MAX_WIDE_COUNT - pulses
+    item = (self._load(self.clock, ri), pulse_raw, self.ticks[ri])
+    self._ri = (ri + 1) % self.size
+    return item
+
+  def stats(self):
+    return {
+      'count': self.count,
+      'dropped': self.dropped,
+      'overflows': self.overflows,
+      'pending': self.qsize(),
+    }
+
+
+IDLE_READING = -1  # ReadingRing `shown` value telling the consumer the input went idle
+
+class ReadingRing():
+  '''
+  Lock-free single producer, single consumer ring of computed readings, used
+  to hand (seq, clock_raw, pulse_raw, ticks_us, decihertz, shown, channel,
+  dropped, overflows) rows from the measurement core to the output core, each
+  with its MeasurementRing's loss counters as of that reading. Each slot is
+  written completely before the write index is published, and each side only
+  ever stores its own index. `dropped` counts readings this ring lost itself.
+  '''
+  def __init__(self, capacity):
+    self.size = capacity + 1
+    self.seq = array.array("I", [0] * self.size)
+    self.clock = array.array("Q", [0] * self.size)  # raw counts may be wide
+    self.pulse = array.array("Q", [0] * self.size)
+    self.ticks = array.array("I", [0] * self.size)
+    self.decihertz = array.array("q", [0] * self.size)
+    self.shown = array.array("q", [0] * self.size)
+    self.channel = array.array("B", [0] * self.size)
+    self.measurements_dropped = array.array("I", [0] * self.size)
+    self.measurements_overflows = array.array("I", [0] * self.size)
+    self._wi = 0
+    self._ri = 0
+    self.dropped = 0
+    self.closed = False
+
+  def empty(self):
+    return self._ri == self._wi
+
+  def qsize(self):
+    return (self._wi - self._ri) % self.size
+
+  def put(self, seq, clock_raw, pulse_raw, ticks_us, decihertz, shown, channel=0, dropped=0, overflows=0):
+    wi = self._wi
+    if (wi + 1) % self.size == self._ri:
+      self.dropped += 1
+      return False
+    self.seq[wi] = seq
+    self.clock[wi] = clock_raw
+    self.pulse[wi] = pulse_raw
+    self.ticks[wi] = ticks_us
+    self.decihertz[wi] = decihertz
+    self.shown[wi] = shown
+    self.channel[wi] = channel
+    self.measurements_dropped[wi] = dropped
+    self.measurements_overflows[wi] = overflows
+    self._wi = (wi + 1) % self.size
+    return True
+
+  def get(self):
+    ri = self._ri
+    if ri == self._wi:
+      raise IndexError
+    item = (self.seq[ri], self.clock[ri], self.pulse[ri], self.ticks[ri], self.decihertz[ri], self.shown[ri],
+            self.channel[ri], self.measurements_dropped[ri], self.measurements_overflows[ri])
+    self._ri = (ri + 1) % self.size
+    return item
@@ -0,0 +1,201 @@
+'''
+Reading output: LED display and serial console
+
+Either runs inline in the display loop (LocalOutput), or on the RP2040's
+second core (start_output_core), so that slow bit-banged SPI and USB serial
+output never delay the measurement core draining the counter state machines.
+Inline on one core, LocalOutput can instead leave the display refresh to a
+task of its own (LocalOutput.refresh), which yields between register writes.
+'''
+import _thread
+import asyncio
+import time
+
+from constants import READING_RING_SIZE, TEXT_SUMMARY_MS, DISPLAY_CHANNEL
+from latency import PRINT, FORMAT, DISPLAY, TOTAL
+from measurement_ring import ReadingRing, IDLE_READING
+from util import encode_decihertz, convert_clock_count, convert_pulse_count, CODE_B_BLANK, CODE_B_DASH
+
+CHANNEL_NAMES = 'AB'  # counter channel 0 on PIO0, 1 on PIO1
+IDLE_DIGITS = bytes([CODE_B_BLANK] * 7 + [CODE_B_DASH])  # '-', as display('-') shows it
+
+class LocalOutput():
+  '''
+  Display readings immediately, and print them to the console.
+  With summary_ms > 0, print at most one reading per summary_ms.
+  Pass a latency.LatencyProfile to time the print, format and display stages.
+  Only readings from `display_channel` go to the LED display, or with a
+  ChainedDisplay, to its first device and the other channels to the next.
+  With `inline` False, reading() only encodes the digits, and refresh(), run
+  as a task, sends them without holding up the caller.
+  '''
+  def __init__(self, disp, summary_ms=TEXT_SUMMARY_MS, latency=None, display_channel=DISPLAY_CHANNEL,
+               inline=True):
+    self.disp = disp
+    self.display_channel = display_channel
+    self.latency = latency
+    self.inline = inline
+    self.digits = bytearray(8)  # reused Code B buffer for each reading
+    # without inline: the latest digits waiting for each device, and their reading's ticks_us
+    self._next = [bytearray(8) for _ in range(disp.devices)]
+    self._next_ticks = [None] * disp.devices
+    self._due = 0  # bitmask of devices with digits waiting
+    self.flag = asyncio.ThreadSafeFlag()
+    self.dropped = 0
+    self.summary_ms = summary_ms
+    self._printed_ms = None
+    self.skipped = 0  # readings not printed since the last one that was
+
+  def _text_due(self):
+    if not self.summary_ms:
+      return True
+    now = time.ticks_ms()
+    if self._printed_ms is not None and time.ticks_diff(now, self._printed_ms) < self.summary_ms:
+      self.skipped += 1
+      return False
+    self._printed_ms = now
+    return True
+
+  def reading(self, i, clock_raw, pulse_raw, ticks_us, decihertz, shown, dropped=0, overflows=0,
+              channel=0):
+    latency = self.latency
+    if latency is not None:
+      t0 = time.ticks_us()
+    if self._text_due():
+      print(f"Measurement {i}" if not channel else f"Measurement {CHANNEL_NAMES[channel]}{i}")
+      print(f"  Raw data:    (clock {clock_raw}, pulse {pulse_raw})")
+      print(f"  Clock count: {convert_clock_count(clock_raw)}")
+      print(f"  Input count: {convert_pulse_count(pulse_raw)}")
+      print(f"  Frequency:   {decihertz // 10}.{decihertz % 10} Hz")
+      if self.skipped:
+        print(f"  Not shown:   {self.skipped} measurements")
+        self.skipped = 0
+      if dropped != self.dropped:
+        self.dropped = dropped
+        print(f"  Dropped:     {dropped} measurements ({overflows} overflows)")
+    device = self._device(channel)
+    if device is None:
+      return
+    # without inline, refresh() sends the digits, and times DISPLAY and TOTAL
+    digits = self.digits if self.inline else self._next[device]
+    if latency is None:
+      encode_decihertz(shown, digits)
+      if self.inline:
+        self._display_code_b(digits, device)
+      else:
+        self._due_refresh(device, ticks_us)
+      return
+    t1 = time.ticks_us()
+    encode_decihertz(shown, digits)
+    t2 = time.ticks_us()
+    latency.record(PRINT, time.ticks_diff(t1, t0))
+    latency.record(FORMAT, time.ticks_diff(t2, t1))
+    if not self.inline:
+      self._due_refresh(device, ticks_us)
+      return
+    self._display_code_b(digits, device)
+    t3 = time.ticks_us()
+    latency.record(DISPLAY, time.ticks_diff(t3, t2))
+    latency.record(TOTAL, time.ticks_diff(t3, ticks_us))
+
+  def idle(self, channel=0):
+    device = self._device(channel)
+    if device is None:
+      return
+    if not self.inline:
+      # queued behind any reading still waiting, so a late refresh can't overwrite it
+      self._next[device][:] = IDLE_DIGITS
+      self._due_refresh(device, None)
+    elif device:
+      self.disp.display('-', device)
+    else:
+      self.disp.display('-')
+
+  def _due_refresh(self, device, ticks_us):
+    self._next_ticks[device] = ticks_us
+    self._due |= 1 << device
+    self.flag.set()
+
+  async def refresh(self):
+    '''
+    Without `inline`, send each device's latest digits as they come in, a
+    register at a time with other tasks running in between (Display.adisplay_code_b).
+    Digits that arrive meanwhile replace those still waiting, so the display
+    is never more than one refresh behind.
+    '''
+    latency = self.latency
+    digits = self.digits
+    while True:
+      await self.flag.wait()
+      while self._due:
+        for device in range(len(self._next)):
+          bit = 1 << device
+          if not self._due & bit:
+            continue
+          self._due &= ~bit
+          # a copy, since a reading during the refresh replaces _next
+          digits[:] = self._next[device]
+          ticks_us = self._next_ticks[device]
+          t0 = time.ticks_us()
+          if device:
+            await self.disp.adisplay_code_b(digits, device)
+          else:
+            await self.disp.adisplay_code_b(digits)
+          if latency is not None and ticks_us is not None:
+            t1 = time.ticks_us()
+            latency.record(DISPLAY, time.ticks_diff(t1, t0))
+            latency.record(TOTAL, time.ticks_diff(t1, ticks_us))
+
+  def _device(self, channel):
+    '''Display device showing `channel`, or None if it isn't shown'''
+    if channel == self.display_channel:
+      return 0
+    device = channel + 1 if channel < self.display_channel else channel
+    return device if device < self.disp.devices else None
+
+  def _display_code_b(self, digits, device):
+    if device:
+      self.disp.display_code_b(digits, device)
+    else:
+      self.disp.display_code_b(digits)
+
+class HandoffOutput():
+  '''Measurement core side of the core 1 output: queue readings without formatting'''
+  def __init__(self, readings):
+    self.readings = readings
+
+  def reading(self, i, clock_raw, pulse_raw, ticks_us, decihertz, shown, dropped=0, overflows=0,
+              channel=0):
+    self.readings.put(i, clock_raw, pulse_raw, ticks_us, decihertz, shown, channel, dropped, overflows)
+
+  def idle(self, channel=0):
+    self.readings.put(0, 0, 0, 0, 0, IDLE_READING, channel)
+
+def output_loop(readings, output, poll_ms=1):
+  '''
+  Output core: drain readings into `output` until the ring is closed. Readings
+  the handoff itself dropped, because this core fell behind, are reported
+  apart from the measurement ring's, which go to `output` with each reading.
+  '''
+  handoff_dropped = 0
+  while not readings.closed:
+    if readings.empty():
+      time.sleep_ms(poll_ms)
+      continue
+    i, clock_raw, pulse_raw, ticks_us, decihertz, shown, channel, dropped, overflows = readings.get()
+    if readings.dropped != handoff_dropped:
+      handoff_dropped = readings.dropped
+      print(f"Output core behind, {handoff_dropped} readings not output")
+    if shown == IDLE_READING:
+      output.idle(channel)
+    else:
+      output.reading(i, clock_raw, pulse_raw, ticks_us, decihertz, shown, dropped, overflows, channel)
+
+def start_output_core(output, capacity=READING_RING_SIZE):
+  '''
+  Start display rendering and serial output on the second core, feeding `output`.
+  Returns the HandoffOutput to pass to display_loop on the measurement core.
+  '''
+  readings = ReadingRing(capacity)
+  _thread.start_new_thread(output_loop, (readings, output))
+  return HandoffOutput(readings)
@@ -0,0 +1,83 @@
+'''
+Period measurement for sub-hertz and low frequency inputs
+
+The gated reciprocal counter waits for an input edge to open and another to
+close each gate, and starts each measurement from a fresh edge, so a 0.1 Hz
+input gives a reading every 10-20 s. The period state machine instead
+timestamps every rising edge against the system clock, and each pair of
+consecutive edges becomes a full resolution reading of one period.
+
+Readings go into the MeasurementRing as ordinary (clock_raw, pulse_raw) pairs
+of one input pulse, so they're calculated, displayed and logged just like
+gated readings. See autorange.GateControl for switching between the modes.
+
+The timestamps wrap every 2**33 clock cycles (68.7 s at 125 MHz), so longer
+periods would alias to shorter ones. Periods whose edges were read more than
+LONGEST_PERIOD_MS apart are dropped instead: the lowest measurable frequency
+is 1 / LONGEST_PERIOD_MS, about 0.015 Hz at 125 MHz, and slower inputs show
+as idle.
+'''
+import time
+
+from constants import MAX_COUNT, PIO_FREQ
+
+ONE_PULSE_RAW = MAX_COUNT - 1  # pulse_raw for a count of one input pulse
+RX_FIFO_DEPTH = 8  # joined FIFO
+# the timestamps' wrap, less a margin for how late poll() may read an edge
+LONGEST_PERIOD_MS = (1 << 33) * 1000 // PIO_FREQ - 1000
+
+class PeriodCounter():
+  '''Turns the period state machine's edge timestamps into measurements'''
+  def __init__(self, sm, queue):
+    self.sm = sm
+    self.queue = queue
+    self.running = False
+    self._last = None  # previous edge timestamp
+    self._last_ms = 0  # ticks_ms when it was read
+    self._started = False  # the first push marks the start, not an edge
+
+  def start(self):
+    sm = self.sm
+    sm.restart()
+    while sm.rx_fifo():
+      sm.get()
+    self._last = None
+    self._started = True
+    sm.active(1)
+    self.running = True
+
+  def stop(self):
+    self.sm.active(0)
+    self.running = False
+
+  def poll(self):
+    '''
+    Queue a measurement for each new edge. Call at least every
+    RX_FIFO_DEPTH input periods; more often only lowers latency.
+    '''
+    if not self.running:
+      return
+    sm = self.sm
+    pending = sm.rx_fifo()
+    if not pending:
+      return
+    if pending >= RX_FIFO_DEPTH:
+      # edges may have been lost since the last timestamp we have
+      self._last = None
+    if self._started:
+      self._started = False
+      sm.get()
+      pending -= 1
+    now = time.ticks_ms()
+    last = self._last
+    if last is not None and time.ticks_diff(now, self._last_ms) > LONGEST_PERIOD_MS:
+      # the timer may have wrapped since
+      last = None
+    for _ in range(pending):
+      timestamp = sm.get()
+      if last is not None:
+        # the timer counts down, and wraps after 2**33 clock cycles
+        self.queue.put(MAX_COUNT - ((last - timestamp) & MAX_COUNT), ONE_PULSE_RAW)
+      last = timestamp
+    self._last = last
+    self._last_ms = now
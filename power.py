@@ -0,0 +1,97 @@
+'''
+Tiered power saving while no input signal is detected
+
+Once the display loop has shown '-' for idle, the policy steps through:
+
+1. dim the display to IDLE_DIM_INTENSITY
+2. put the MAX7219 into shutdown (register contents are retained)
+3. park the counter state machines and lightsleep the MCU until an edge on
+   COUNTER_INPUT_PIN
+
+Each tier's delay is measured from the moment the input went idle (the '-'
+display); 0 disables a tier. The first reading after waking restores the display, and arrives one
+gate time after the waking edge since the counter restarts from the top.
+'''
+import machine
+import time
+
+from constants import COUNTER_INPUT_PIN, DISPLAY_INTENSITY, IDLE_THRESHOLD_MS, \
+  IDLE_DIM_MS, IDLE_DIM_INTENSITY, IDLE_SHUTDOWN_MS, IDLE_LIGHTSLEEP_MS
+
+ACTIVE = 0
+DIMMED = 1
+SHUTDOWN = 2
+
+class IdlePolicy():
+  def __init__(self, disp, gate=None, input_pin=COUNTER_INPUT_PIN,
+               dim_ms=IDLE_DIM_MS, shutdown_ms=IDLE_SHUTDOWN_MS, sleep_ms=IDLE_LIGHTSLEEP_MS,
+               dim_intensity=IDLE_DIM_INTENSITY, intensity=DISPLAY_INTENSITY,
+               rearm_ms=IDLE_THRESHOLD_MS):
+    self.disp = disp
+    self.gate = gate
+    self.input_pin = input_pin
+    self.intensity = intensity
+    self.dim_intensity = dim_intensity
+    # (delay after going idle, action) in order; lightsleep needs the gate to park the counter
+    self.tiers = tuple((ms, action) for ms, action in (
+        (dim_ms, self.dim),
+        (shutdown_ms, self.shutdown),
+        (sleep_ms if gate is not None else 0, self.lightsleep))
+      if ms)
+    self.rearm_ms = rearm_ms
+    self.state = ACTIVE
+    self.next_tier = 0
+    self.idle_since = None
+    self.sleeps = 0
+
+  def start(self):
+    '''The input just went idle'''
+    self.idle_since = time.ticks_ms()
+    self.next_tier = 0
+
+  def timeout_ms(self):
+    '''ms until the next tier is due, or None if there are no more'''
+    if self.idle_since is None or self.next_tier >= len(self.tiers):
+      return None
+    idle_ms = time.ticks_diff(time.ticks_ms(), self.idle_since)
+    return max(0, self.tiers[self.next_tier][0] - idle_ms)
+
+  def advance(self):
+    '''Apply the next tier'''
+    _, action = self.tiers[self.next_tier]
+    self.next_tier += 1
+    action()
+
+  def dim(self):
+    self.disp.intensity(self.dim_intensity)
+    self.state = DIMMED
+
+  def shutdown(self):
+    self.disp.shutdown()
+    self.state = SHUTDOWN
+
+  def lightsleep(self):
+    '''Park the counter and sleep until an input edge; blocks the whole program meanwhile'''
+    print("Idle, sleeping until input edge...")
+    self.gate.park()
+    pin = machine.Pin(self.input_pin, machine.Pin.IN, machine.Pin.PULL_UP)
+    pin.irq(lambda pin: None, machine.Pin.IRQ_RISING | machine.Pin.IRQ_FALLING)
+    try:
+      machine.lightsleep()
+    finally:
+      pin.irq(None)
+      self.gate.resume()
+    self.sleeps += 1
+    # the edge may have been a glitch: sleep again if nothing is measured within rearm_ms
+    self.next_tier -= 1
+    delay_ms = self.tiers[self.next_tier][0]
+    self.idle_since = time.ticks_add(time.ticks_ms(), self.rearm_ms - delay_ms)
+
+  def wake(self):
+    '''Restore the display for a new reading'''
+    if self.state != ACTIVE:
+      self.disp.intensity(self.intensity)
+      self.disp.enable()
+      self.state = ACTIVE
+    self.next_tier = 0
+    self.idle_since = None
@@ -0,0 +1,59 @@
+'''
+PWM slice prescaler for the high frequency input
+
+The pulse_count state machine spends four instructions per input cycle, so
+it can't follow inputs much above a quarter of PIO_FREQ. A PWM slice in
+edge-counting mode counts rising edges on its B pin in hardware at up to
+half the system clock. With TOP = N - 1 and a 50% compare level it drives a
+square wave at 1/N of the input on its A pin, which the (unchanged) counter
+state machines measure instead of the input.
+
+Every prescaled rising edge is also an input rising edge, so the gate stays
+synchronized to the input and the reciprocal measurement stays exact: pulse
+counts just need multiplying by N (see MeasurementRing.prescale).
+
+MicroPython's machine.PWM doesn't offer the edge-counting mode, so the slice
+is set up through its registers.
+'''
+from machine import mem32
+from micropython import const
+
+from constants import HF_PRESCALE
+
+IO_BANK0_BASE = const(0x40014000)
+GPIO_FUNC_PWM = const(4)
+PWM_BASE = const(0x40050000)
+PWM_SLICE_SIZE = const(0x14)
+PWM_CSR = const(0x00)
+PWM_DIV = const(0x04)
+PWM_CTR = const(0x08)
+PWM_CC = const(0x0c)
+PWM_TOP = const(0x10)
+PWM_CSR_EN = const(0x1)
+PWM_CSR_DIVMODE_RISE = const(2 << 4)  # count rising edges of the B pin
+PWM_DIV_ONE = const(1 << 4)  # 8.4 fixed point
+
+class Prescaler():
+  '''Divide the input on `input_pin` (a PWM B pin, i.e. odd) by `divisor` onto input_pin - 1'''
+  def __init__(self, input_pin, divisor=HF_PRESCALE):
+    assert input_pin & 1, "PWM slices only count edges on their B pin, an odd GPIO"
+    assert 2 <= divisor <= 0x10000 and not divisor & 1
+    self.input_pin = input_pin
+    self.output_pin = input_pin - 1
+    self.divisor = divisor
+    self.base = PWM_BASE + PWM_SLICE_SIZE * ((input_pin >> 1) & 7)
+
+  def start(self):
+    '''Start prescaling; call after any other setup of the two pins'''
+    base = self.base
+    mem32[base + PWM_CSR] = 0
+    mem32[base + PWM_DIV] = PWM_DIV_ONE
+    mem32[base + PWM_TOP] = self.divisor - 1
+    mem32[base + PWM_CC] = self.divisor // 2  # A high for the first half of each count
+    mem32[base + PWM_CTR] = 0
+    for pin in (self.input_pin, self.output_pin):
+      mem32[IO_BANK0_BASE + 8 * pin + 4] = GPIO_FUNC_PWM  # GPIOn_CTRL FUNCSEL
+    mem32[base + PWM_CSR] = PWM_CSR_DIVMODE_RISE | PWM_CSR_EN
+
+  def stop(self):
+    mem32[self.base + PWM_CSR] = 0
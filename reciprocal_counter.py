@@ -2,8 +2,6 @@
 from rp2 import PIO, asm_pio, StateMachine
 from constants import MAX_COUNT, PIO_FREQ
 
-CORRECTED_PIO_FREQ = 125000208.6
-
 @asm_pio(sideset_init=PIO.OUT_HIGH)
 def gate():
     """
@@ -72,10 +70,57 @@ def pulse_count():
     push()                                                 # send data to FIFO
     irq(block, 5)                                          # set irq and wait for gate PIO to acknowledge
 
+@asm_pio(fifo_join=PIO.JOIN_RX, autopush=True, push_thresh=32)
+def period():
+    """
+    PIO timestamping every rising edge of the input, for period measurement.
+
+    x free-runs down, one count every other clock cycle, and is autopushed
+    on each rising edge in a two cycle step that skips one count, so
+    consecutive timestamps t0, t1 span 2 * (t0 - t1 + 1) clock cycles: the
+    same encoding as a clock_count count. Five instructions, so it fits in
+    PIO memory alongside the counter's 27.
+
+    Each jmp(x_dec) falls through to the instruction it jumps to, so x
+    passing zero doesn't change the path; the low loop is last and repeats
+    by wrapping for the same reason. The program starts with a push, which
+    marks the start, not an edge (see period.PeriodCounter).
+
+    Pin requirements:
+
+    - jmp_pin: input_pin
+    """
+    label("edge")
+    in_(x, 32)                          [1]                # rising edge: timestamp it (autopush)
+    label("high")
+    jmp(x_dec, "high_next")                                # count while the input is high
+    label("high_next")
+    jmp(pin, "high")
+    wrap_target()
+    label("low")
+    jmp(x_dec, "low_next")                                 # count while the input is low
+    label("low_next")
+    jmp(pin, "edge")
+    wrap()
+
+def load_gate(sm0, gate_cycles, wide=False):
+    """Load the gate SM's gate time, taking effect from the next measurement."""
+    if wide:
+        sm0.put(gate_cycles >> 32)
+        sm0.exec("pull()")
+        sm0.exec("mov(isr, osr)")
+    sm0.put(gate_cycles & MAX_COUNT)
+    sm0.exec("pull()")
 
-def init_sm(freq, input_pin, gate_pin, pulse_fin_pin, gate_cycles=None):
+def init_sm(freq, input_pin, gate_pin, pulse_fin_pin, gate_cycles=None, pio=0, wide=False):
     """
-    Starts state machines.
+    Starts state machines 0-2 of PIO block `pio`.
+
+    IRQ flags are local to each PIO block, so independent counters can run on
+    PIO0 and PIO1 at the same time, each with its own three pins.
+
+    With `wide`, runs the 64 bit variants, for gates of over 2**32 cycles or
+    counts that wrap.
 
     n.b. pulse_count SM uses both gate and input pulse pins as inputs,
          so input_pin must be gate_pin + 1.
@@ -88,15 +133,19 @@ def init_sm(freq, input_pin, gate_pin, pulse_fin_pin, gate_cycles=None):
 
     print(f"MAX_COUNT = {MAX_COUNT:08x}")
 
-    sm0 = StateMachine(0, gate, freq=freq, in_base=input_pin, sideset_base=gate_pin)
-    sm0.put(gate_cycles)
-    sm0.exec("pull()")
+    sm_base = 4 * pio
+    if wide:
+        # assembled only when needed, to keep boot fast
+        from reciprocal_counter_wide import gate_wide, clock_count_wide, pulse_count_wide
+
+    sm0 = StateMachine(sm_base, gate_wide if wide else gate, freq=freq, in_base=input_pin, sideset_base=gate_pin)
+    load_gate(sm0, gate_cycles, wide)
 
-    sm1 = StateMachine(1, clock_count, freq=freq, in_base=gate_pin, jmp_pin=pulse_fin_pin)
+    sm1 = StateMachine(sm_base + 1, clock_count_wide if wide else clock_count, freq=freq, in_base=gate_pin, jmp_pin=pulse_fin_pin)
     sm1.put(MAX_COUNT)
     sm1.exec("pull()")
 
-    sm2 = StateMachine(2, pulse_count, freq=freq, in_base=gate_pin, sideset_base=pulse_fin_pin, jmp_pin=gate_pin)
+    sm2 = StateMachine(sm_base + 2, pulse_count_wide if wide else pulse_count, freq=freq, in_base=gate_pin, sideset_base=pulse_fin_pin, jmp_pin=gate_pin)
     sm2.put(MAX_COUNT - 1)
     sm2.exec("pull()")
 
@@ -106,9 +155,50 @@ def init_sm(freq, input_pin, gate_pin, pulse_fin_pin, gate_cycles=None):
 
     return sm0, sm1, sm2
 
+def init_period_sm(freq, input_pin, pio=0):
+    """
+    Sets up (but doesn't start) the period state machine, state machine 3 of PIO block `pio`,
+    to run alongside or instead of the reciprocal counter on the same input pin.
+    """
+    return StateMachine(4 * pio + 3, period, freq=freq, jmp_pin=input_pin)
+
+def stop_sm(sm0, sm1, sm2):
+    """Park the state machines, e.g. before sleeping. Use restart_sm to resume counting."""
+    sm0.active(0)
+    sm1.active(0)
+    sm2.active(0)
+
+def restart_sm(sm0, sm1, sm2, gate_cycles, wide=False):
+    """
+    Restart parked state machines from the top of their programs, as init_sm leaves them.
+    The first measurement completes one gate time after the next input edges.
+    """
+    for sm in (sm0, sm1, sm2):
+        sm.restart()
+        while sm.rx_fifo():
+            sm.get()
+
+    sm0.exec("nop() .side(1)")                             # gate high
+    sm2.exec("nop() .side(1)")                             # pulse fin high
+    # drop handshakes left over from a measurement interrupted when parking
+    sm0.exec("irq(clear, 4)")
+    sm0.exec("irq(clear, 5)")
+
+    load_gate(sm0, gate_cycles, wide)
+    sm1.put(MAX_COUNT)
+    sm1.exec("pull()")
+    sm2.put(MAX_COUNT - 1)
+    sm2.exec("pull()")
+
+    sm1.active(1)
+    sm2.active(1)
+    sm0.active(1)
+
 def main():
     from machine import Pin
     import uarray as array
+    from timebase import init_timebase
+    from util import convert_clock_count, convert_pulse_count, calculate_frequency
 
     update_flag = [False]
     data = array.array("I", [0, 0])
@@ -122,6 +212,7 @@ def main():
             data[1] = sm2.get() # pulse count
             update_flag[0] = True
 
+    init_timebase()
     sm0, sm1, sm2 = init_sm(PIO_FREQ, Pin(15, Pin.IN, Pin.PULL_UP), Pin(14, Pin.OUT), Pin(13, Pin.OUT))
     sm0.irq(counter_handler)
 
@@ -129,9 +220,9 @@ def main():
     i = 0
     while True:
         if update_flag[0]:
-            clock_count = 2 * (MAX_COUNT - data[0]+1)
-            pulse_count = MAX_COUNT - data[1]
-            freq = pulse_count * (CORRECTED_PIO_FREQ / clock_count)
+            clock_count = convert_clock_count(data[0])
+            pulse_count = convert_pulse_count(data[1])
+            freq = calculate_frequency(data[0], data[1])
             print(i)
             print("Clock count: {}".format(clock_count))
             print("Input count: {}".format(pulse_count))
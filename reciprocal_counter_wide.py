@@ -0,0 +1,63 @@
+# Wide variants of the reciprocal_counter programs, for gates and counts over
+# 32 bits. When x wraps, jmp(x_dec) falls through to a jmp(y_dec) that carries
+# into y, and both words are pushed, low word first, for software to combine
+# (see MeasurementRing). The three fit in 31 instructions, which leaves no room
+# for period(). Kept apart so they're only assembled when used.
+from rp2 import PIO, asm_pio
+
+@asm_pio(sideset_init=PIO.OUT_HIGH)
+def gate_wide():
+    """
+    gate() with a 64 bit gate time: low word from osr, high word from isr (see load_gate).
+
+    The pulse_count_wide SM doesn't handshake with irq 5: it always finishes before
+    clock_count_wide, whose irq 4 this waits for.
+    """
+    mov(x, osr)                                            # load gate time, low word
+    mov(y, isr)                                            # and high word
+    wait(0, pin, 0)
+    wait(1, pin, 0)
+    label("loopstart")
+    jmp(x_dec, "loopstart") .side(0)
+    jmp(y_dec, "loopstart") .side(0)                       # x wrapped: borrow from y
+    wait(0, pin, 0)
+    wait(1, pin, 0) .side(1)
+    irq(block, 0)
+    wait(1, irq, 4)
+
+@asm_pio(autopush=True, push_thresh=32)
+def clock_count_wide():
+    """
+    clock_count() carrying x wraps into y. Each carry takes one extra clock cycle.
+    """
+    mov(x, osr)                                            # load x and y with max value (2^32-1)
+    mov(y, osr)
+    wait(1, pin, 0)
+    wait(0, pin, 0)
+    label("counter")
+    jmp(pin, "output")
+    jmp(x_dec, "counter")
+    jmp(y_dec, "counter")                                  # x wrapped: carry into y
+    label("output")
+    in_(x, 32)                                             # push low word (autopush)
+    in_(y, 32)                                             # then high word
+    irq(block, 4)
+
+@asm_pio(sideset_init=PIO.OUT_HIGH, autopush=True, push_thresh=32)
+def pulse_count_wide():
+    """
+    pulse_count() carrying x wraps into y.
+    """
+    mov(x, osr)
+    mov(y, invert(null))                                   # load y with max value (2^32-1)
+    wait(1, pin, 0)
+    wait(0, pin, 0) .side(0)
+    label("counter")
+    wait(0, pin, 1)
+    wait(1, pin, 1)
+    jmp(pin, "output")
+    jmp(x_dec, "counter")
+    jmp(y_dec, "counter")                                  # x wrapped: carry into y
+    label("output")
+    in_(x, 32) .side(1)                                    # push low word and stop the clock count
+    in_(y, 32)                                             # then high word
@@ -0,0 +1,209 @@
+'''
+Flash ring-file recorder of raw measurements
+
+Keeps the last RECORDER_BLOCKS blocks of raw (clock_raw, pulse_raw) readings
+in a fixed-size file on flash, so a glitchy reading can be replayed on the
+host later (host/replay.py). Each reading is a telemetry record; records are
+packed into a RAM block and only whole blocks are written, by a background
+task, with a second block buffering readings meanwhile. The task writes a
+block RECORDER_WRITE_SIZE bytes at a time and yields between writes, so the
+display loop waits on at most one of them: a flash page program (under 3 ms)
+or, when LittleFS starts a fresh 4 KB block or commits the file's metadata,
+a sector erase as well (45 ms typical, 400 ms worst case for the Pico's
+W25Q16JV). With DUAL_CORE, blocks are written on the output core instead.
+
+Each block of the file starts with a header:
+
+  magic  4s   b'FCRB'
+  seq    u32  block number since the file was created, to order the ring
+  used   u16  bytes of records following the header
+  num    u32  util.correction the block's readings were calculated with
+  den    u32
+
+and the oldest block is the one after the highest seq. A reading recorded
+under a different correction (compensation.py) starts a new block.
+'''
+import asyncio
+import struct
+
+import util
+from constants import RECORDER_FILE, RECORDER_BLOCKS, RECORDER_BLOCK_SIZE, RECORDER_WRITE_SIZE, MAX_COUNT
+from telemetry import RECORD_SIZE, WIDE_RECORD_SIZE, FLAG_DROPPED, FLAG_IDLE, CHANNEL_SHIFT, pack_record
+
+BLOCK_MAGIC = b'FCRB'
+BLOCK_HEADER_FORMAT = '<4sIHII'
+BLOCK_HEADER_SIZE = struct.calcsize(BLOCK_HEADER_FORMAT)  # 18 bytes
+
+def read_block_header(f, index, block_size=RECORDER_BLOCK_SIZE):
+  '''(seq, used, (num, den)) of block `index`, or None if it has never been written'''
+  f.seek(index * block_size)
+  header = f.read(BLOCK_HEADER_SIZE)
+  if len(header) < BLOCK_HEADER_SIZE:
+    return None
+  magic, seq, used, num, den = struct.unpack(BLOCK_HEADER_FORMAT, header)
+  if magic != BLOCK_MAGIC:
+    return None
+  return seq, used, (num, den)
+
+class Recorder():
+  '''
+  Appends readings to the ring file. With `inline`, full blocks are written
+  as soon as they fill, e.g. on the output core; otherwise run() writes them.
+  '''
+  def __init__(self, path=RECORDER_FILE, blocks=RECORDER_BLOCKS, block_size=RECORDER_BLOCK_SIZE,
+               inline=False, write_size=RECORDER_WRITE_SIZE):
+    self.blocks = blocks
+    self.block_size = block_size
+    self.write_size = write_size
+    self.inline = inline
+    self.record = bytearray(RECORD_SIZE)
+    self.wide_record = bytearray(WIDE_RECORD_SIZE)
+    self._buffers = (bytearray(block_size), bytearray(block_size))
+    self._current = 0  # buffer being filled
+    self._used = BLOCK_HEADER_SIZE
+    self._correction = util.correction  # of the readings in the block being filled
+    self._pending = None  # (buffer, index, seq, used, correction) of a full block waiting to be written
+    self._sync = False  # run() should also write the partly filled block
+    self._sent_dropped = {}
+    self.flag = asyncio.ThreadSafeFlag()
+    self.written = 0  # blocks written
+    self.dropped = 0  # readings lost because both buffers were full
+    try:
+      self.file = open(path, 'r+b')
+    except OSError:
+      self.file = open(path, 'w+b')
+    self.seq, self.index = self._resume()
+
+  def _resume(self):
+    '''Block seq and index to write next: the one after the latest written'''
+    latest = None
+    for index in range(self.blocks):
+      header = read_block_header(self.file, index, self.block_size)
+      if header is not None and (latest is None or header[0] > latest[0]):
+        latest = header[0], index
+    if latest is None:
+      return 0, 0
+    return latest[0] + 1, (latest[1] + 1) % self.blocks
+
+  def reading(self, i, ticks_us, clock_raw, pulse_raw, dropped=0, channel=0):
+    flags = channel << CHANNEL_SHIFT
+    if dropped != self._sent_dropped.get(channel, 0):
+      self._sent_dropped[channel] = dropped
+      flags |= FLAG_DROPPED
+    correction = util.correction
+    if correction != self._correction:
+      if self._used > BLOCK_HEADER_SIZE and not self._next_block():
+        self.dropped += 1
+        return
+      self._correction = correction
+    record = self.record if clock_raw <= MAX_COUNT and pulse_raw <= MAX_COUNT else self.wide_record
+    self._append(pack_record(record, i, ticks_us, clock_raw, pulse_raw, flags))
+
+  def idle(self, channel=0):
+    self._append(pack_record(self.record, 0, 0, 0, 0, FLAG_IDLE | channel << CHANNEL_SHIFT))
+    # nothing is being measured now, so save what there is in case the power goes next
+    if self.inline:
+      self.sync()
+    else:
+      self._sync = True
+      self.flag.set()
+
+  def _next_block(self):
+    '''Hand the block being filled to the writer and start the next, or False if it's busy'''
+    if self._pending is not None:
+      # the writer hasn't caught up, nowhere to put it
+      return False
+    self._pending = (self._buffers[self._current], self.index, self.seq, self._used, self._correction)
+    self._current ^= 1
+    self._used = BLOCK_HEADER_SIZE
+    self.seq += 1
+    self.index = (self.index + 1) % self.blocks
+    if self.inline:
+      self.flush()
+    else:
+      self.flag.set()
+    return True
+
+  def _append(self, record):
+    size = len(record)
+    if self._used + size > self.block_size and not self._next_block():
+      self.dropped += 1
+      return
+    used = self._used
+    self._buffers[self._current][used:used + size] = record
+    self._used = used + size
+
+  def _seek(self, buf, index, seq, used, correction):
+    struct.pack_into(BLOCK_HEADER_FORMAT, buf, 0, BLOCK_MAGIC, seq, used - BLOCK_HEADER_SIZE, *correction)
+    f = self.file
+    f.seek(index * self.block_size)
+    return f
+
+  def _write(self, buf, index, seq, used, correction):
+    f = self._seek(buf, index, seq, used, correction)
+    f.write(buf)
+    f.flush()
+    self.written += 1
+
+  async def _awrite(self, buf, index, seq, used, correction):
+    '''_write, write_size bytes at a time, yielding to other tasks between them'''
+    f = self._seek(buf, index, seq, used, correction)
+    view = memoryview(buf)
+    for start in range(0, len(buf), self.write_size):
+      f.write(view[start:start + self.write_size])
+      await asyncio.sleep_ms(0)
+    f.flush()
+    self.written += 1
+
+  def flush(self):
+    '''Write the full block waiting to be written, if any'''
+    pending = self._pending
+    if pending is None:
+      return
+    self._write(*pending)
+    self._pending = None
+
+  def sync(self):
+    '''Also write the partly filled block, e.g. before power off; it's rewritten once full'''
+    self.flush()
+    self._write(self._buffers[self._current], self.index, self.seq, self._used, self._correction)
+
+  async def _aflush(self):
+    pending = self._pending
+    if pending is None:
+      return
+    await self._awrite(*pending)
+    self._pending = None
+
+  async def run(self):
+    '''
+    Write blocks as they fill. Readings keep arriving during a write; they
+    only ever go after a block's `used` bytes, so it's written consistently.
+    '''
+    while True:
+      await self.flag.wait()
+      await self._aflush()
+      if self._sync:
+        self._sync = False
+        await self._aflush()
+        await self._awrite(self._buffers[self._current], self.index, self.seq, self._used,
+                           self._correction)
+
+  def close(self):
+    self.sync()
+    self.file.close()
+
+class RecordingOutput():
+  '''Record every reading and idle to a Recorder, then pass it on to `output`'''
+  def __init__(self, output, recorder):
+    self.output = output
+    self.recorder = recorder
+
+  def reading(self, i, clock_raw, pulse_raw, ticks_us, decihertz, shown, dropped=0, overflows=0,
+              channel=0):
+    self.recorder.reading(i, ticks_us, clock_raw, pulse_raw, dropped, channel)
+    self.output.reading(i, clock_raw, pulse_raw, ticks_us, decihertz, shown, dropped, overflows, channel)
+
+  def idle(self, channel=0):
+    self.recorder.idle(channel)
+    self.output.idle(channel)
@@ -0,0 +1,148 @@
+'''
+Streaming statistics over frequency readings in fixed memory
+
+Readings are integer tenths of Hz (see util.calculate_decihertz). Everything
+is kept relative to a reference reading (the first one after a reset) so the
+running sums stay small and exact, and the per-reading storage (moving
+average window, phase ring) is preallocated, so memory use doesn't grow with
+the number of readings. Adding one still allocates a few short-lived boxed
+floats for the Welford mean and variance.
+'''
+import math
+import uarray as array
+
+from constants import MOVING_AVERAGE_WINDOW, ALLAN_TAUS
+
+class StreamStats():
+  '''
+  Running mean and standard deviation (Welford), min/max, an N-sample moving
+  average and overlapping Allan deviation at several tau values.
+
+  Allan deviation taus are in multiples of the gate time, tau0. Overlapping
+  ADEV at tau = m * tau0 needs the phase from 2 m readings ago, so phase is
+  kept in a ring of 2 * max(taus) + 1 entries.
+  '''
+  def __init__(self, window=MOVING_AVERAGE_WINDOW, taus=ALLAN_TAUS):
+    self.window = window
+    self.taus = tuple(taus)
+    self._window = array.array('q', [0] * window)
+    self._phase_len = 2 * max(self.taus) + 1
+    self._phase = array.array('q', [0] * self._phase_len)
+    self._adev_sum = array.array('d', [0] * len(self.taus))
+    self._adev_count = array.array('I', [0] * len(self.taus))
+    self.reset()
+
+  def reset(self):
+    self.ref = None
+    self.count = 0
+    self.min = None
+    self.max = None
+    self._mean = 0.0  # relative to ref
+    self._m2 = 0.0
+    self._window_sum = 0
+    self._window_fill = 0
+    self._phase_fill = 0
+    for i in range(len(self.taus)):
+      self._adev_sum[i] = 0
+      self._adev_count[i] = 0
+
+  def add(self, decihertz):
+    if self.ref is None:
+      self.ref = decihertz
+      self.min = self.max = decihertz
+    elif decihertz < self.min:
+      self.min = decihertz
+    elif decihertz > self.max:
+      self.max = decihertz
+    x = decihertz - self.ref
+    n = self.count
+    self.count = n + 1
+
+    # Welford
+    delta = x - self._mean
+    self._mean += delta / self.count
+    self._m2 += delta * (x - self._mean)
+
+    # moving average
+    slot = n % self.window
+    self._window_sum += x - self._window[slot]
+    self._window[slot] = x
+    if self._window_fill < self.window:
+      self._window_fill += 1
+
+    # phase is the running sum of frequency offsets; phase[0] is zero
+    length = self._phase_len
+    phase = self._phase
+    if n == 0:
+      phase[0] = 0
+    k = n + 1
+    phase[k % length] = phase[n % length] + x
+    self._phase_fill = min(k + 1, length)
+    for i, m in enumerate(self.taus):
+      if k >= 2 * m:
+        d = phase[k % length] - 2 * phase[(k - m) % length] + phase[(k - 2 * m) % length]
+        self._adev_sum[i] += d * d
+        self._adev_count[i] += 1
+
+  @property
+  def mean(self):
+    '''Mean reading, tenths of Hz'''
+    return None if self.ref is None else self.ref + self._mean
+
+  def mean_decihertz(self):
+    '''
+    Mean reading rounded to whole tenths of Hz, for display. Only the small
+    offset from ref is a float: a single precision mean near 10 MHz is only
+    good to 8 tenths of Hz.
+    '''
+    return None if self.ref is None else self.ref + int(round(self._mean))
+
+  @property
+  def stddev(self):
+    '''Sample standard deviation, tenths of Hz'''
+    return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+  def moving_average(self):
+    '''Mean of the last `window` readings, rounded to whole tenths of Hz'''
+    if self.ref is None:
+      return None
+    n = self._window_fill
+    return self.ref + (2 * self._window_sum + n) // (2 * n)
+
+  def allan_deviation(self, i):
+    '''Overlapping Allan deviation (fractional) at tau = taus[i] * tau0, None until enough data'''
+    count = self._adev_count[i]
+    if not count or not self.ref:
+      return None
+    m = self.taus[i]
+    return math.sqrt(self._adev_sum[i] / (2 * m * m * count)) / self.ref
+
+  def summary(self):
+    adev = ' '.join(f"{m}:{self.allan_deviation(i):.2e}" for i, m in enumerate(self.taus)
+                    if self._adev_count[i])
+    # n.b. MicroPython can't join adjacent f-strings
+    return (f"n={self.count} mean={self.mean / 10:.2f} sd={self.stddev / 10:.3g} " +
+            f"min={self.min / 10} max={self.max / 10} adev[{adev}]")
+
+def test_stream_stats():
+  import random
+  s = StreamStats(window=4, taus=(1, 2, 4))
+  data = [100_000_000 + random.randint(-50, 50) for _ in range(200)]
+  for d in data:
+    s.add(d)
+  n = len(data)
+  mean = sum(data) / n
+  assert abs(s.mean - mean) < 1e-6
+  assert abs(s.mean_decihertz() - mean) <= 0.5
+  assert abs(s.stddev - math.sqrt(sum((d - mean) ** 2 for d in data) / (n - 1))) < 1e-6
+  assert s.min == min(data) and s.max == max(data)
+  assert s.moving_average() == (2 * sum(data[-4:]) + 4) // 8
+  # overlapping ADEV straight from its definition on frequency data
+  y = [d / s.ref for d in data]
+  for i, m in enumerate(s.taus):
+    terms = [sum(y[j + m:j + 2 * m]) - sum(y[j:j + m]) for j in range(n - 2 * m + 1)]
+    adev = math.sqrt(sum(t * t for t in terms) / (2 * m * m * len(terms)))
+    assert abs(s.allan_deviation(i) - adev) < 1e-3 * adev, (m, s.allan_deviation(i), adev)
+
+if __name__ == '__main__':
+  test_stream_stats()
@@ -0,0 +1,106 @@
+'''
+Framed binary telemetry over USB serial
+
+One fixed-size little-endian record per reading, replacing the five lines of
+text printed per measurement:
+
+  sync      u16  0x5aa5 (bytes a5 5a)
+  seq       u32  measurement number
+  ticks_us  u32  time.ticks_us() when the counter IRQ captured the measurement
+  clock_raw u32  raw clock state machine count
+  pulse_raw u32  raw pulse state machine count
+  flags     u16  FLAG_* bits, counter channel in the high byte
+  [clock_carry u32, pulse_carry u32: only with FLAG_WIDE, bits 32-63 of the raw counts]
+  checksum  u16  Fletcher-16 over seq .. flags (or carries)
+
+host/telemetry_decode.py turns a capture back into frequencies.
+'''
+import struct
+import sys
+
+from output import LocalOutput
+from constants import TEXT_SUMMARY_MS, MAX_COUNT
+
+SYNC = 0x5aa5
+RECORD_FORMAT = '<HIIIIHH'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)  # 22 bytes
+FLAGS_OFFSET = RECORD_SIZE - 4
+CARRY_FORMAT = '<II'
+WIDE_RECORD_SIZE = RECORD_SIZE + struct.calcsize(CARRY_FORMAT)  # 30 bytes
+
+FLAG_DROPPED = 0x1  # measurements were dropped since the previous record
+FLAG_IDLE = 0x2  # no input detected, counts are zero
+FLAG_WIDE = 0x4  # raw counts over 32 bits, carries follow the flags
+CHANNEL_SHIFT = 8  # flags >> CHANNEL_SHIFT is the counter channel
+
+def fletcher16(buf, start=0, end=None):
+  if end is None:
+    end = len(buf)
+  sum1 = sum2 = 0
+  for i in range(start, end):
+    sum1 = (sum1 + buf[i]) % 255
+    sum2 = (sum2 + sum1) % 255
+  return (sum2 << 8) | sum1
+
+def pack_record(buf, seq, ticks_us, clock_raw, pulse_raw, flags):
+  '''Fill a RECORD_SIZE buffer in place, or a WIDE_RECORD_SIZE one for wide raw counts'''
+  size = len(buf)
+  if size == WIDE_RECORD_SIZE:
+    flags |= FLAG_WIDE
+    struct.pack_into(CARRY_FORMAT, buf, RECORD_SIZE - 2, clock_raw >> 32, pulse_raw >> 32)
+  struct.pack_into(RECORD_FORMAT[:-1], buf, 0, SYNC, seq, ticks_us,
+                   clock_raw & MAX_COUNT, pulse_raw & MAX_COUNT, flags)
+  struct.pack_into('<H', buf, size - 2, fletcher16(buf, 2, size - 2))
+  return buf
+
+def record_size(buf, offset=0):
+  '''Size of the record at offset, given at least its first RECORD_SIZE bytes'''
+  flags, = struct.unpack_from('<H', buf, offset + FLAGS_OFFSET)
+  return WIDE_RECORD_SIZE if flags & FLAG_WIDE else RECORD_SIZE
+
+def unpack_record(buf, offset=0):
+  '''
+  Returns (seq, ticks_us, clock_raw, pulse_raw, flags) or None if the record
+  at offset has no sync word or a bad checksum
+  '''
+  sync, seq, ticks_us, clock_raw, pulse_raw, flags = \
+    struct.unpack_from(RECORD_FORMAT[:-1], buf, offset)
+  if sync != SYNC:
+    return None
+  size = WIDE_RECORD_SIZE if flags & FLAG_WIDE else RECORD_SIZE
+  if len(buf) < offset + size:
+    return None
+  checksum, = struct.unpack_from('<H', buf, offset + size - 2)
+  if checksum != fletcher16(buf, offset + 2, offset + size - 2):
+    return None
+  if flags & FLAG_WIDE:
+    clock_carry, pulse_carry = struct.unpack_from(CARRY_FORMAT, buf, offset + RECORD_SIZE - 2)
+    clock_raw |= clock_carry << 32
+    pulse_raw |= pulse_carry << 32
+  return seq, ticks_us, clock_raw, pulse_raw, flags
+
+class TelemetryOutput(LocalOutput):
+  '''
+  Display readings and write one binary record per reading to the serial port.
+  Text is limited to one reading per summary_ms; the decoder skips it.
+  '''
+  def __init__(self, disp, stream=None, summary_ms=TEXT_SUMMARY_MS or 1000, latency=None, inline=True):
+    super().__init__(disp, summary_ms, latency, inline=inline)
+    self.stream = stream if stream is not None else sys.stdout.buffer
+    self.record = bytearray(RECORD_SIZE)
+    self.wide_record = bytearray(WIDE_RECORD_SIZE)
+    self._sent_dropped = {}
+
+  def reading(self, i, clock_raw, pulse_raw, ticks_us, decihertz, shown, dropped=0, overflows=0,
+              channel=0):
+    flags = channel << CHANNEL_SHIFT
+    if dropped != self._sent_dropped.get(channel, 0):
+      self._sent_dropped[channel] = dropped
+      flags |= FLAG_DROPPED
+    record = self.record if clock_raw <= MAX_COUNT and pulse_raw <= MAX_COUNT else self.wide_record
+    self.stream.write(pack_record(record, i, ticks_us, clock_raw, pulse_raw, flags))
+    super().reading(i, clock_raw, pulse_raw, ticks_us, decihertz, shown, dropped, overflows, channel)
+
+  def idle(self, channel=0):
+    self.stream.write(pack_record(self.record, 0, 0, 0, 0, FLAG_IDLE | channel << CHANNEL_SHIFT))
+    super().idle(channel)
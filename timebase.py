@@ -0,0 +1,39 @@
+'''
+System clock setup
+
+constants.SYS_FREQ is the single source of truth for the timebase. The
+counter state machines run at PIO_FREQ == SYS_FREQ, undivided, and gate
+cycle counts and frequency calculations are all derived from it, so
+raising SYS_FREQ raises the clock count, and so the resolution, of every
+gate. At 250 MHz a 100 ms gate resolves 1 part in 12.5 million instead of
+6.25 million.
+
+Call init_timebase() first thing at boot, before any state machine, SPI or
+UART is set up, since their dividers are computed from the system clock.
+'''
+import machine
+import time
+from micropython import const
+
+from constants import SYS_FREQ, OVERCLOCK_VREG_ABOVE_HZ
+
+VREG_AND_CHIP_RESET_BASE = const(0x40064000)
+VREG_VSEL_MASK = const(0xf << 4)
+VREG_VSEL_1_15V = const(0b1100 << 4)  # default is 0b1011, 1.10 V
+VREG_SETTLE_MS = 10
+
+def init_timebase(freq=SYS_FREQ):
+  '''Switch the system clock to `freq`, raising the core voltage first when overclocking hard'''
+  if freq > OVERCLOCK_VREG_ABOVE_HZ:
+    vreg = machine.mem32[VREG_AND_CHIP_RESET_BASE]
+    if vreg & VREG_VSEL_MASK < VREG_VSEL_1_15V:
+      machine.mem32[VREG_AND_CHIP_RESET_BASE] = (vreg & ~VREG_VSEL_MASK) | VREG_VSEL_1_15V
+      time.sleep_ms(VREG_SETTLE_MS)
+  if machine.freq() != freq:
+    # raises ValueError if the PLL can't make freq exactly
+    machine.freq(freq)
+  actual = machine.freq()
+  if actual != freq:
+    raise ValueError(f"system clock is {actual} Hz, not SYS_FREQ {freq} Hz")
+  print(f"System clock {freq // 1_000_000} MHz")
+  return actual
@@ -0,0 +1,114 @@
+'''
+SPI transports for the MAX7219 display
+
+A transport owns the bus and the chip select line, and sends each buffer
+it's given as one CS-low transaction, without allocating. HardSPITransport
+drives one of the RP2040's SPI blocks at DISPLAY_SPI_BAUDRATE; the MAX7219
+takes up to 10 MHz, ten times what bit-banging manages, and the block
+shifts the bits out while the CPU only feeds its FIFO. That needs the
+display's MOSI and CK on a block's TX and SCK pins, so open_transport()
+falls back to SoftSPITransport on any other wiring, as on the original board
+(GP13 is SPI1's CSn, not SCK).
+
+awrite() is the asyncio path: it sends one frame, a single register write,
+then yields to the other tasks before returning, so a refresh sent with
+awrite() lets the loop run between registers instead of holding it for all
+of them. That's how output.LocalOutput.refresh() updates the display on a
+single core.
+
+Run this module on the board to benchmark the transports.
+'''
+import asyncio
+from machine import Pin, SPI, SoftSPI
+import time
+
+from constants import DISPLAY_SPI_BAUDRATE, DISPLAY_SOFT_SPI_BAUDRATE, DISPLAY_MISO
+
+# SoftSPI forces us to set a MISO even though we are TX-only
+# Pick an unused pin (not GP20, the HF prescaler's output).
+MISO = DISPLAY_MISO
+
+def hard_spi_id(mosi, ck):
+  '''The SPI block with `mosi` as a TX pin and `ck` as an SCK pin, or None'''
+  # GPIO n is block (n // 8) % 2's RX, CSn, SCK or TX for n % 4 of 0, 1, 2 or 3
+  if mosi % 4 == 3 and ck % 4 == 2 and mosi // 8 % 2 == ck // 8 % 2:
+    return mosi // 8 % 2
+  return None
+
+class Transport():
+  '''Send buffers as CS-low transactions on `spi`'''
+  def __init__(self, spi, cs):
+    self.spi = spi
+    self.cs = Pin(cs, Pin.OUT, value=1)
+
+  def write(self, buf):
+    try:
+      self.cs.off()
+      self.spi.write(buf)
+    finally:
+      self.cs.on()
+
+  async def awrite(self, buf):
+    '''Send `buf`, then yield to other tasks'''
+    self.write(buf)
+    await asyncio.sleep_ms(0)
+
+class HardSPITransport(Transport):
+  '''SPI block `spi_id`, which must have `mosi` as a TX pin and `ck` as an SCK pin'''
+  def __init__(self, spi_id, mosi, cs, ck, baudrate=DISPLAY_SPI_BAUDRATE):
+    super().__init__(SPI(spi_id, baudrate=baudrate, polarity=1, phase=0, sck=Pin(ck), mosi=Pin(mosi),
+                         miso=None), cs)
+
+class SoftSPITransport(Transport):
+  '''Bit-banged SPI, on any pins'''
+  # n.b. miso is an unused pin, but SoftSPI forces us to set it
+  def __init__(self, mosi, cs, ck, miso=MISO, baudrate=DISPLAY_SOFT_SPI_BAUDRATE):
+    super().__init__(SoftSPI(baudrate=baudrate, polarity=1, phase=0, sck=Pin(ck), mosi=Pin(mosi),
+                             miso=Pin(miso)), cs)
+
+def open_transport(mosi, cs, ck, miso=None):
+  '''Hardware SPI if the pins allow it, else SoftSPI (with `miso`, default MISO)'''
+  spi_id = hard_spi_id(mosi, ck)
+  if spi_id is None:
+    print(f"No SPI block has TX on GP{mosi} and SCK on GP{ck}, using SoftSPI")
+    return SoftSPITransport(mosi, cs, ck, MISO if miso is None else miso)
+  return HardSPITransport(spi_id, mosi, cs, ck)
+
+def benchmark(transport, refreshes=200):
+  '''Time full 8-digit refreshes of 2-byte register frames, blocking and with awrite()'''
+  frame = bytearray(2)
+
+  def refresh():
+    for digit in range(1, 9):
+      frame[0] = digit
+      frame[1] = 0xf  # Code B blank
+      transport.write(frame)
+
+  async def arefresh():
+    for digit in range(1, 9):
+      frame[0] = digit
+      frame[1] = 0xf
+      await transport.awrite(frame)
+
+  async def arun():
+    for _ in range(refreshes):
+      await arefresh()
+
+  start = time.ticks_us()
+  for _ in range(refreshes):
+    refresh()
+  blocking_us = time.ticks_diff(time.ticks_us(), start)
+  start = time.ticks_us()
+  asyncio.run(arun())
+  async_us = time.ticks_diff(time.ticks_us(), start)
+  name = type(transport).__name__
+  # n.b. MicroPython can't join adjacent f-strings
+  print(f"{name}: {blocking_us / refreshes:.1f} us per 8-digit refresh, " +
+        f"{async_us / refreshes:.1f} us with awrite()")
+
+if __name__ == '__main__':
+  from constants import MOSI, CS, CK
+  benchmark(SoftSPITransport(MOSI, CS, CK))
+  spi_id = hard_spi_id(MOSI, CK)
+  if spi_id is not None:
+    benchmark(HardSPITransport(spi_id, MOSI, CS, CK))
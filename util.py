@@ -1,38 +1,231 @@
-from constants import MAX_COUNT, PIO_FREQ, CORRECTION
-import re
+from constants import MAX_COUNT, MAX_WIDE_COUNT, PIO_FREQ, CORRECTION_NUM, CORRECTION_DEN
+
+def _gcd(a, b):
+  while b:
+    a, b = b, a % b
+  return a
+
+def set_correction(num, den):
+  '''Publish a new timebase correction num / den, e.g. from compensation.Compensator'''
+  global correction, _decihertz_ratio
+  numerator = 10 * PIO_FREQ * num
+  divisor = _gcd(numerator, den)
+  _decihertz_ratio = (numerator // divisor, den // divisor)
+  correction = (num, den)
+
+# timebase correction (num, den) applied by the calculate_ functions, as an exact ratio;
+# compensation.py keeps it updated for the crystal's temperature. One tuple, so a reader
+# on the other core never sees a new numerator with an old denominator. _decihertz_ratio
+# is 10 * PIO_FREQ * num / den in lowest terms, what calculate_decihertz multiplies the
+# counts by, worked out once per correction rather than for every reading.
+set_correction(CORRECTION_NUM, CORRECTION_DEN)
+
+# MAX7219 Code B font values used by encode_frequency (see display.CODE_B_ALPHABET)
+CODE_B_DASH = 0xa
+CODE_B_E = 0xb
+CODE_B_BLANK = 0xf
+CODE_B_DP = 0x80
 
 def format_frequency(f):
   '''Format frequency in Hz for display in 8 characters'''
   # - Allow display of one decimal place, but only under 10 kHz
   # - Limit to 6 sig figs scientific notation at or over 100 MHz (which the counter can't reach
-  #   anyway) (we can fit 6 since we remove the '+' and leading '0' of the exponent.
+  #   anyway) (we can fit 6 since we remove the '+' and leading '0' of the exponent, 5 once the
+  #   exponent needs two digits).
   # - Shorten scientific notation display by removing the non-displayable '+' and the unused
   #   leading 0 of the exponent
-  formatted = f"{round(f, 1):{'.1f' if f < 10000 else '.0f' if f < 1e8 else '.6g'}}"
-  return re.sub(r'e\+?0', 'e', formatted)
+  # - Pick the format from the rounded value, so e.g. 99999999.7 can't overflow to 9 digits
+  tenths = round(f, 1)
+  if tenths < 10000:
+    return f"{tenths:.1f}"
+  if round(tenths) < 1e8:
+    return f"{tenths:.0f}"
+  return f"{f:.{6 if f < 1e10 else 5}g}".replace('e+', 'e').replace('e0', 'e')
 
+def encode_frequency(f, buf):
+  '''
+  Format frequency in Hz straight into `buf`, 8 Code B digit values (leftmost
+  digit first) following the same rules as format_frequency, without building
+  any strings. Returns buf.
+  '''
+  return encode_decihertz(int(f * 10 + 0.5), buf)
+
+def encode_decihertz(d, buf):
+  '''
+  Encode an integer frequency in tenths of Hz into `buf` (see encode_frequency).
+  Integer only, so exact for any frequency the counter can measure.
+  '''
+  pos = 7
+  if d < 100_000:
+    # 0.0 - 9999.9: one decimal place
+    buf[pos] = d % 10
+    d //= 10
+    pos -= 1
+    buf[pos] = (d % 10) | CODE_B_DP
+    d //= 10
+    pos -= 1
+  else:
+    # round to whole Hz, half to even like printf (a no-op on calculate_display_decihertz's)
+    units, tenths = divmod(d, 10)
+    if tenths > 5 or (tenths == 5 and units & 1):
+      units += 1
+    if units >= 100_000_000:
+      return _encode_scientific(d, buf)
+    d = units
+  # integer digits
+  while d:
+    buf[pos] = d % 10
+    d //= 10
+    pos -= 1
+  while pos >= 0:
+    buf[pos] = CODE_B_BLANK
+    pos -= 1
+  return buf
+
+def _encode_scientific(d, buf, figures=6):
+  '''Encode d >= 1e9 tenths of Hz with 6 significant figures, e.g. 1.12346e8'''
+  limit = 10 ** figures
+  exponent = figures - 2  # d is in tenths
+  scaled = d
+  while scaled >= 10 * limit:
+    scaled //= 10
+    exponent += 1
+  # scaled now has one digit more than we want, round it off (half up, like printf)
+  mantissa = (scaled + 5) // 10
+  exponent += 1
+  if mantissa >= limit:
+    mantissa //= 10
+    exponent += 1
+  if exponent >= 10 and figures == 6:
+    # two digit exponent, give up a significant figure to stay within 8 digits
+    return _encode_scientific(d, buf, 5)
+  while mantissa % 10 == 0 and mantissa >= 10:
+    mantissa //= 10
+  pos = 7
+  while True:
+    buf[pos] = exponent % 10
+    exponent //= 10
+    pos -= 1
+    if not exponent:
+      break
+  buf[pos] = CODE_B_E
+  pos -= 1
+  digits = 0
+  while mantissa:
+    buf[pos] = mantissa % 10
+    mantissa //= 10
+    pos -= 1
+    digits += 1
+  if digits > 1:
+    # decimal point after the leading digit
+    buf[pos + 1] |= CODE_B_DP
+  while pos >= 0:
+    buf[pos] = CODE_B_BLANK
+    pos -= 1
+  return buf
+
+# Raw counts over MAX_COUNT come from the wide state machines, with the carry
+# word above bit 32 (see MeasurementRing.get); 32 bit raw counts are the same
+# as wide ones with a carry word of MAX_COUNT, i.e. no carries.
 def convert_pulse_count(pulse_raw):
+  if pulse_raw > MAX_COUNT:
+    return MAX_WIDE_COUNT - pulse_raw
   return MAX_COUNT - pulse_raw
 def convert_clock_count(clock_raw):
+  if clock_raw > MAX_COUNT:
+    # each carry also took clock_count_wide one uncounted cycle
+    return 2 * (MAX_WIDE_COUNT - clock_raw + 1) + (MAX_COUNT - (clock_raw >> 32))
   return 2 * (MAX_COUNT - clock_raw + 1)
 def calculate_frequency(clock_raw, pulse_raw):
-  return PIO_FREQ * CORRECTION * convert_pulse_count(pulse_raw) / convert_clock_count(clock_raw)
+  num, den = correction
+  return PIO_FREQ * num * convert_pulse_count(pulse_raw) / (den * convert_clock_count(clock_raw))
+def _frequency_ratio(clock_raw, pulse_raw):
+  '''(numerator, denominator) of the exact frequency in tenths of Hz'''
+  multiplier, divisor = _decihertz_ratio
+  return multiplier * convert_pulse_count(pulse_raw), divisor * convert_clock_count(clock_raw)
+def calculate_scaled_frequency(clock_raw, pulse_raw, scale):
+  '''
+  Frequency in units of 1/scale Hz, rounded half up, using exact integer math.
+  Avoids the rp2 port's single precision floats, which can't hold 8 digits.
+  '''
+  num, den = correction
+  numerator = scale * PIO_FREQ * num * convert_pulse_count(pulse_raw)
+  denominator = den * convert_clock_count(clock_raw)
+  return (2 * numerator + denominator) // (2 * denominator)
+def calculate_decihertz(clock_raw, pulse_raw):
+  '''Frequency in tenths of Hz, exact, for stats'''
+  numerator, denominator = _frequency_ratio(clock_raw, pulse_raw)
+  return (2 * numerator + denominator) // (2 * denominator)
+def calculate_display_decihertz(clock_raw, pulse_raw):
+  '''
+  Frequency in tenths of Hz for encode_decihertz, rounded once from the exact
+  ratio to the digits it shows: tenths under 10 kHz, else whole Hz (half to
+  even, like printf), or the leading figures in scientific notation. Rounding
+  calculate_decihertz again would get the last digit wrong whenever its tenth
+  was rounded up to or from a 5.
+  '''
+  return calculate_decihertz_and_display(clock_raw, pulse_raw)[1]
+def calculate_decihertz_and_display(clock_raw, pulse_raw):
+  '''
+  (calculate_decihertz, calculate_display_decihertz) of a reading, from one
+  exact ratio
+  '''
+  numerator, denominator = _frequency_ratio(clock_raw, pulse_raw)
+  d = (2 * numerator + denominator) // (2 * denominator)
+  if d < 100_000:
+    return d, d
+  decihertz = d
+  # the display's unit in tenths of Hz: 1 Hz, or the last of 6 (5) significant figures
+  unit = 10
+  if d >= 999_999_995:
+    # as _encode_scientific, 5 figures once the exponent needs two digits
+    figures = 6 if d < 99_999_950_000 else 5
+    limit = 10 ** figures
+    unit = 1
+    while d >= limit:
+      d //= 10
+      unit *= 10
+  units, rest = divmod(numerator, unit * denominator)
+  rest *= 2
+  if rest > unit * denominator or (rest == unit * denominator and units & 1):
+    units += 1
+  return decihertz, units * unit
 
 def unconvert_pulse_count(pulse_count):
   '''Helper for tests'''
+  if pulse_count > MAX_COUNT:
+    return MAX_WIDE_COUNT - pulse_count
   return MAX_COUNT - pulse_count
 def unconvert_clock_count(clock_count):
   '''Helper for tests'''
-  return MAX_COUNT - clock_count / 2 - 1
+  decrements = clock_count // 2 - 1
+  if decrements > MAX_COUNT:
+    return MAX_WIDE_COUNT - (clock_count - (decrements >> 32)) // 2 + 1
+  return MAX_COUNT - decrements
 
 test_frequencies = [.001, 0.1, 1.01, 1, 1.1, 10.264, 1000.0, 1000.1, 1000.01, 9.99801e6, 10.000e6, 1e8, 100123100, 1.1234567e8]
-test_raw_data = [(unconvert_clock_count(PIO_FREQ * CORRECTION), unconvert_pulse_count(int(f))) for f in test_frequencies]
+# one second gate of corrected clock cycles, so each expected frequency is exactly int(f)
+test_raw_data = [(unconvert_clock_count(PIO_FREQ * CORRECTION_NUM // CORRECTION_DEN), unconvert_pulse_count(int(f))) for f in test_frequencies]
 
 # TODO: convert to unit test
 def test_format_frequency():
   return [(len(s), s) for s in
           [format_frequency(n) for n in test_frequencies]]
 
+def decode_code_b(buf):
+  '''Helper for tests: turn encode_frequency output back into a display string'''
+  return ''.join(
+    '0123456789-ehlp '[value & 0xf] + ('.' if value & CODE_B_DP else '')
+    for value in buf).lstrip()
+
+def test_encode_frequency():
+  buf = bytearray(8)
+  extra = [0, 0.04, 0.05, 9999.94, 9999.96, 12344.5, 12345.5, 99999999.4, 99999999.7, 123456789, 999999500, 1e9, 12345678901]
+  for f in test_frequencies + extra:
+    expected = format_frequency(f)
+    encoded = decode_code_b(encode_frequency(f, buf))
+    assert encoded == expected, (f, encoded, expected)
+
 def test_calculate_frequencies():
   for (clock, pulse), f in zip(test_raw_data, test_frequencies):
     delta = calculate_frequency(clock, pulse) - f
@@ -40,7 +233,78 @@ def test_calculate_frequencies():
     print(f"{f} Hz, error {delta:.3g} Hz ({ppm:.2f} ppm)")
     assert delta < 1 or ppm < 10
 
+def test_calculate_decihertz():
+  for (clock, pulse), f in zip(test_raw_data, test_frequencies):
+    assert calculate_decihertz(clock, pulse) == 10 * int(f), (f, calculate_decihertz(clock, pulse))
+
+  # 10 ms - 10 s gates at 10 MHz-ish inputs: must be the correctly rounded exact ratio
+  for gate_clocks in (1_250_000, 12_500_000, 125_000_000, 1_250_000_000):
+    for pulses in (1, 99_980, 999_801, 9_998_010, 99_980_100):
+      clock, pulse = unconvert_clock_count(gate_clocks), unconvert_pulse_count(pulses)
+      clocks = convert_clock_count(clock)
+      d = calculate_decihertz(clock, pulse)
+      error = 2 * (d * CORRECTION_DEN * clocks - 10 * PIO_FREQ * CORRECTION_NUM * pulses)
+      assert -CORRECTION_DEN * clocks < error <= CORRECTION_DEN * clocks, (gate_clocks, pulses, d)
+
+def test_display_decihertz():
+  from fractions import Fraction
+  import random
+  random.seed(5)
+  buf = bytearray(8)
+
+  def expected(f):
+    # format_frequency's rules, rounding the exact frequency once
+    tenths = (20 * f + 1) // 2
+    if tenths < 100_000:
+      return f"{tenths // 10}.{tenths % 10}"
+    if round(f) < 100_000_000:
+      return str(round(f))
+    for figures in (6, 5):
+      exponent = len(str(int(f))) - 1
+      mantissa = round(f / 10 ** (exponent - figures + 1))
+      if mantissa >= 10 ** figures:
+        mantissa //= 10
+        exponent += 1
+      if exponent < 10:
+        break
+    digits = str(mantissa).rstrip('0')
+    return (digits[0] + '.' + digits[1:] if len(digits) > 1 else digits) + 'e' + str(exponent)
+
+  twice_rounded = 0
+  for _ in range(5000):
+    clocks = 2 * random.randint(625_000, 625_000_000)
+    pulses = random.getrandbits(random.randint(1, 32)) or 1
+    clock, pulse = unconvert_clock_count(clocks), unconvert_pulse_count(pulses)
+    f = Fraction(PIO_FREQ * CORRECTION_NUM * pulses, CORRECTION_DEN * clocks)
+    shown = decode_code_b(encode_decihertz(calculate_display_decihertz(clock, pulse), buf))
+    assert shown == expected(f), (clocks, pulses, shown, expected(f))
+    twice_rounded += decode_code_b(encode_decihertz(calculate_decihertz(clock, pulse), buf)) != shown
+  # and some of those would have been off by one through calculate_decihertz
+  assert twice_rounded, twice_rounded
+
+def test_wide_counts():
+  # an hour's gate on a 10 MHz input: both counts carry
+  for gate_clocks, pulses in ((3600 * PIO_FREQ, 36_000_000_000), (3600 * PIO_FREQ + 7, 35_999_999_999)):
+    decrements = gate_clocks // 2 - 1
+    clock = MAX_WIDE_COUNT - decrements
+    pulse = unconvert_pulse_count(pulses)
+    clocks = convert_clock_count(clock)
+    assert clocks == 2 * (decrements + 1) + (decrements >> 32), (gate_clocks, clocks)
+    assert unconvert_clock_count(clocks) == clock
+    assert convert_pulse_count(pulse) == pulses
+    d = calculate_decihertz(clock, pulse)
+    error = 2 * (d * CORRECTION_DEN * clocks - 10 * PIO_FREQ * CORRECTION_NUM * pulses)
+    assert -CORRECTION_DEN * clocks < error <= CORRECTION_DEN * clocks, (gate_clocks, pulses, d)
+  # without carries, wide raw counts convert like 32 bit ones
+  for clock, pulse in test_raw_data:
+    assert convert_clock_count(MAX_COUNT << 32 | clock) == convert_clock_count(clock)
+    assert convert_pulse_count(MAX_COUNT << 32 | pulse) == convert_pulse_count(pulse)
+
 if __name__ == '__main__':
   from pprint import pprint
   pprint(test_format_frequency())
+  test_encode_frequency()
   test_calculate_frequencies()
+  test_calculate_decihertz()
+  test_display_decihertz()
+  test_wide_counts()